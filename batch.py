@@ -0,0 +1,246 @@
+# batch.py
+"""
+Batches: many videos (a list of URLs, playlists and channels expanded) split into
+one streamed archive or manifest.
+
+A batch runs as a two-stage pipeline. A downloader thread probes and fetches the
+next videos while the current one is split, handing sources over through a queue
+of at most BATCH_PREFETCH; every queued source holds its source cache lease, so
+the queue also bounds the disk a batch pins. Clips go into the output as they are
+cut, named `{nnn}_{base_name}{i}.mp4` after the video's position in the batch.
+
+A video that fails (too long, unavailable, ...) is skipped and reported in the
+batch summary (batch.json in the archive, the manifest itself) instead of failing
+the whole batch; only a batch without a single clip fails.
+"""
+
+import json
+import os
+import queue
+import threading
+import traceback
+from contextlib import ExitStack
+
+import metrics
+import workspace
+from config import BATCH_MAX_VIDEOS, BATCH_PREFETCH
+from pipeline import (
+    SplitError, cached_source, check_duration, cleanup_file, estimate_bytes, expand_playlist, probe, reserved,
+    split_source, validate_interval,
+)
+from zipstream import ZipStream
+
+QUEUE_POLL_SECONDS = 0.5
+_DONE = object()
+
+
+def expand(urls) -> list:
+    """Video URLs of the batch, in order, with playlists expanded. Raises SplitError for empty or oversized batches."""
+    videos = []
+    for url in urls:
+        try:
+            videos += expand_playlist(url, BATCH_MAX_VIDEOS - len(videos))
+        except SplitError as e:
+            if e.status_code == 429:
+                raise
+            # keep it as a video: its error ends up in the summary like any other failed video
+            videos.append(url)
+        if len(videos) > BATCH_MAX_VIDEOS:
+            raise SplitError({"error": f"batch has more than {BATCH_MAX_VIDEOS} videos"}, 400)
+    if not videos:
+        raise SplitError({"error": "no videos in batch"}, 400)
+    return videos
+
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> bool:
+    """Put `item` on the bounded queue, waiting for room unless the batch is stopped."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=QUEUE_POLL_SECONDS)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _download_stage(videos, section, sources: queue.Queue, stop: threading.Event, on_progress=None,
+                    admission=(False, None)):
+    """
+    Probe and fetch each video in turn, queueing (index, url, info, duration, path, lease stack, error).
+    Sources are reserved with the batch's `admission` (see workspace.admitted()).
+    """
+    with workspace.admitted(admission):
+        for index, url in enumerate(videos):
+            if stop.is_set():
+                return
+            stack = ExitStack()
+            stage = metrics.StageTimer()
+            try:
+                stage("probing")
+                info = probe(url)
+                duration = check_duration(info, section)
+                stage("downloading")
+                info, path = stack.enter_context(cached_source(url, section, info, on_progress))
+                item = (index, url, info, duration, path, stack, None)
+            except Exception as e:
+                stack.close()
+                if not isinstance(e, SplitError):
+                    traceback.print_exc()
+                error = e.payload if isinstance(e, SplitError) else {"error": "unexpected error", "details": str(e)}
+                item = (index, url, None, None, None, None, error)
+            finally:
+                stage.finish()
+            if not _put(sources, item, stop):
+                if item[5] is not None:
+                    item[5].close()
+                return
+        _put(sources, _DONE, stop)
+
+
+def iter_batch(videos, interval: float, base_name: str, workdir: str, section=None, accurate: bool = False,
+               timings: dict = None, on_progress=None, mode: str = "interval"):
+    """
+    Split `videos` (URLs) into `workdir`, downloading ahead while splitting.
+    Yields (summary, clips) per video, in order: `summary` is a dict (index, url,
+    id, title, clips: [names], error) that is complete once `clips`, a lazy
+    iterator over the clip paths, is exhausted; consume it before the next video.
+    `timings`, `on_progress` and `mode` work like in pipeline.start_split; on_progress
+    also gets {"batch": {...}} with the videos done so far.
+    """
+    interval = validate_interval(interval)
+    # the clips of every video end up in the output, so their space stays reserved until the batch is done
+    outputs = ExitStack()
+    sources = queue.Queue(maxsize=max(BATCH_PREFETCH, 1))
+    stop = threading.Event()
+    batch = {"videos_total": len(videos), "videos_done": 0, "videos_failed": 0}
+    # the downloader reserves for this batch, which already holds its workdir: it mustn't wait for room either
+    downloader = threading.Thread(target=_download_stage,
+                                  args=(videos, section, sources, stop, on_progress, workspace.admission()),
+                                  name="batch-download", daemon=True)
+    downloader.start()
+    try:
+        while True:
+            item = sources.get()
+            if item is _DONE:
+                break
+            index, url, info, duration, path, stack, error = item
+            summary = {"index": index, "url": url, "id": info and info.get("id"), "title": info and info.get("title"),
+                       "clips": [], "error": error}
+            if error:
+                batch["videos_failed"] += 1
+                yield summary, iter(())
+            else:
+                with stack:
+                    outputs.enter_context(reserved(workspace.reserve(estimate_bytes(info, section))))
+                    clips = split_source(path, duration, interval, f"{index + 1:03d}_{base_name}", workdir, accurate,
+                                         metrics.StageTimer(), timings, on_progress, mode)
+
+                    def collect(clips=clips, summary=summary):
+                        try:
+                            for clip in clips:
+                                summary["clips"].append(os.path.basename(clip))
+                                yield clip
+                        except SplitError as e:
+                            # a video that fails while splitting doesn't end the batch either
+                            summary["error"] = e.payload
+
+                    yield summary, collect()
+                if summary["error"]:
+                    batch["videos_failed"] += 1
+            batch["videos_done"] += 1
+            if on_progress:
+                on_progress({"batch": dict(batch)})
+    finally:
+        stop.set()
+        outputs.close()
+        # release the leases of sources nobody will split
+        while True:
+            try:
+                item = sources.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _DONE and item[5] is not None:
+                item[5].close()
+        downloader.join()
+
+
+def _check_any(summaries):
+    if not any(summary["clips"] for summary in summaries):
+        errors = [summary["error"] for summary in summaries if summary["error"]]
+        raise SplitError({"error": "no video of the batch could be split", "videos": errors}, 502)
+
+
+def write_batch(f, videos, interval: float, base_name: str, workdir: str, section=None, accurate: bool = False,
+                on_progress=None, mode: str = "interval"):
+    """Run a batch, writing one ZIP of all clips (and batch.json, the summary) to `f` as clips are produced."""
+    zs = ZipStream()
+    summaries = []
+    try:
+        for summary, clips in iter_batch(videos, interval, base_name, workdir, section, accurate,
+                                         on_progress=on_progress, mode=mode):
+            summaries.append(summary)
+            for clip in clips:
+                for chunk in zs.add_file(clip, os.path.basename(clip)):
+                    f.write(chunk)
+                f.flush()
+                cleanup_file(clip)
+        _check_any(summaries)
+        summary_path = os.path.join(workdir, "batch.json")
+        with open(summary_path, "w", encoding="utf-8") as summary_file:
+            json.dump({"videos": summaries}, summary_file, indent=2)
+        for chunk in zs.add_file(summary_path, "batch.json"):
+            f.write(chunk)
+        f.write(zs.finish())
+        f.flush()
+    except SplitError:
+        raise
+    except Exception as e:
+        traceback.print_exc()
+        raise SplitError({"error": "unexpected error", "details": str(e)}, 500)
+
+
+def write_batch_job(f, videos, interval: float, base_name: str, section=None, accurate: bool = False,
+                    on_progress=None, mode: str = "interval"):
+    """
+    write_batch in a fresh workdir that is always removed afterwards. Clips pass
+    through it one video at a time, so only the downloads and the archive are
+    reserved (by size, see iter_batch).
+    """
+    with reserved(workspace.workdir("ytbatch_")) as workdir:
+        write_batch(f, videos, interval, base_name, workdir, section, accurate, on_progress, mode)
+
+
+def write_batch_manifest(f, videos, interval: float, base_name: str, clip_dir: str, clip_url, section=None,
+                         accurate: bool = False, on_progress=None, mode: str = "interval"):
+    """
+    Run a batch keeping the clips in `clip_dir` and write a JSON manifest of them,
+    per video, to `f` once all are done (see pipeline.write_manifest).
+    """
+    offset = section[0] if section else 0.0
+    timings = {}
+    summaries = []
+    try:
+        os.makedirs(clip_dir, exist_ok=True)
+        for summary, clips in iter_batch(videos, interval, base_name, clip_dir, section, accurate, timings,
+                                         on_progress, mode):
+            entries = []
+            for index, clip in enumerate(clips):
+                start, end = timings[clip]
+                name = os.path.basename(clip)
+                entries.append({
+                    "index": index,
+                    "name": name,
+                    "start": round(offset + start, 3),
+                    "duration": round(end - start, 3),
+                    "size": os.path.getsize(clip),
+                    "url": clip_url(name),
+                })
+            summaries.append({**summary, "clips": entries})
+        _check_any(summaries)
+    except SplitError:
+        raise
+    except Exception as e:
+        traceback.print_exc()
+        raise SplitError({"error": "unexpected error", "details": str(e)}, 500)
+    f.write(json.dumps({"videos": summaries}).encode("utf-8"))
+    f.flush()
@@ -0,0 +1,356 @@
+# bench.py
+"""
+Offline benchmark of the split pipeline.
+
+Synthetic sources are generated with ffmpeg's lavfi `testsrc` (video) and `sine`
+(audio), so nothing is fetched from YouTube: yt_dlp.YoutubeDL is replaced by
+BenchYoutubeDL, which "downloads" by copying the generated file. Requests go
+through the real FastAPI app served by uvicorn on a local port, so routing,
+streaming and the transfer are measured too.
+
+Every combination of --durations, --intervals and --concurrency is one scenario.
+Each client of a scenario asks for its own video id, so the source cache and
+request coalescing never hide a download; per-stage times come from the
+difference of /metrics before and after the scenario.
+
+    python bench.py --durations 60,600 --intervals 10,60 --concurrency 1,4 --out bench.json
+
+Run it from the repository directory (the app serves static/ and templates/).
+
+Results are written as JSON (environment, then one entry per scenario).
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_URL = "https://bench.invalid/watch?v="
+
+
+# ---------- synthetic sources ----------
+def generate_source(out_dir: str, duration: float, size: str, rate: int, gop: int) -> str:
+    """Encode a testsrc + sine clip (H.264/AAC mp4), reusing an earlier one with the same parameters."""
+    path = os.path.join(out_dir, f"testsrc_{duration:g}s_{size}_{rate}fps_g{gop}.mp4")
+    if os.path.exists(path):
+        return path
+    tmp_path = path + ".tmp.mp4"
+    cmd = [
+        "ffmpeg",
+        "-y",
+        "-hide_banner",
+        "-loglevel", "error",
+        "-f", "lavfi", "-i", f"testsrc=duration={duration:g}:size={size}:rate={rate}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=44100:duration={duration:g}",
+        "-c:v", "libx264", "-preset", "ultrafast", "-g", str(gop), "-keyint_min", str(gop),
+        "-sc_threshold", "0", "-pix_fmt", "yuv420p",
+        "-c:a", "aac",
+        "-shortest",
+        tmp_path,
+    ]
+    subprocess.run(cmd, check=True)
+    os.replace(tmp_path, path)
+    return path
+
+
+def probe_duration(path: str) -> float:
+    out = subprocess.run(
+        ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", path],
+        check=True, stdout=subprocess.PIPE, text=True,
+    ).stdout
+    return float(out.strip())
+
+
+# ---------- stand-in for yt_dlp.YoutubeDL ----------
+class BenchYoutubeDL:
+    """
+    Just enough of yt_dlp.YoutubeDL for pipeline.py: video ids are looked up in
+    `sources` (id -> local file) and downloading copies the file to `outtmpl`
+    under the "home" path.
+    download_ranges is ignored, the whole file is always copied.
+    """
+
+    sources = {}
+
+    def __init__(self, params=None):
+        self.params = params or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def close(self):
+        pass
+
+    def get_info_extractor(self, ie_key):
+        return None
+
+    @staticmethod
+    def sanitize_info(info, remove_private_keys=False):
+        return info
+
+    def extract_info(self, url, download=True, **kwargs):
+        import yt_dlp
+
+        video_id = url.rsplit("=", 1)[-1]
+        path = self.sources.get(video_id)
+        if path is None:
+            raise yt_dlp.utils.DownloadError(f"ERROR: [bench] {video_id}: no such benchmark source")
+        size = os.path.getsize(path)
+        info = {
+            "id": video_id,
+            "extractor": "bench",
+            "extractor_key": "Bench",
+            "title": os.path.basename(path),
+            "duration": probe_duration(path),
+            "ext": "mp4",
+            "format_id": "bench",
+            "filesize": size,
+            "webpage_url": url,
+        }
+        info["formats"] = [{k: info[k] for k in ("format_id", "ext", "filesize")}]
+        return self.process_ie_result(info, download=True) if download else info
+
+    def prepare_filename(self, info):
+        outtmpl = self.params.get("outtmpl") or "%(id)s.%(ext)s"
+        home = self.params.get("paths", {}).get("home", "")
+        return os.path.join(home, outtmpl.replace("%(id)s", info["id"]).replace("%(ext)s", info["ext"]))
+
+    def process_ie_result(self, info, download=True):
+        info = dict(info)
+        if download:
+            filepath = self.prepare_filename(info)
+            shutil.copyfile(self.sources[info["id"]], filepath)
+            info["requested_downloads"] = [{"filepath": filepath}]
+        return info
+
+
+# ---------- server ----------
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(app):
+    """Serve `app` with uvicorn in a background thread; returns (server, thread, base_url)."""
+    import uvicorn
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, name="bench-server", daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread, f"http://127.0.0.1:{port}"
+
+
+# ---------- measuring ----------
+def read_metrics(client) -> dict:
+    """`_sum`/`_count` samples of the server's histograms, keyed by series and labels."""
+    values = {}
+    for line in client.get("/metrics").text.splitlines():
+        if line.startswith("#") or not line.strip():
+            continue
+        series, value = line.rsplit(" ", 1)
+        if "_sum" in series or "_count" in series or "_total" in series:
+            values[series] = float(value)
+    return values
+
+
+def stage_breakdown(before: dict, after: dict) -> dict:
+    """Mean seconds per observation of every histogram that changed during the scenario, plus counter deltas."""
+    result = {}
+    for series, value in after.items():
+        delta = value - before.get(series, 0.0)
+        if not delta:
+            continue
+        if "_sum" in series:
+            count_series = series.replace("_sum", "_count", 1)
+            count = after.get(count_series, 0.0) - before.get(count_series, 0.0)
+            result[series.replace("_sum", "", 1)] = {"count": int(count), "total_seconds": round(delta, 4),
+                                                     "mean_seconds": round(delta / count, 4) if count else None}
+        elif "_total" in series:
+            result[series] = delta
+    return result
+
+
+def run_one(client, video_id: str, interval: float, accurate: bool) -> dict:
+    """One /split request, reading the whole archive; returns its timings."""
+    params = {"url": BENCH_URL + video_id, "interval": interval, "base_name": "clip", "accurate": accurate}
+    started = time.monotonic()
+    first_byte = None
+    size = 0
+    tail = b""
+    with client.stream("GET", "/split", params=params) as response:
+        for chunk in response.iter_bytes():
+            if first_byte is None:
+                first_byte = time.monotonic() - started
+            size += len(chunk)
+            tail = (tail + chunk)[-22:]
+        status = response.status_code
+    if status == 200 and not tail.startswith(b"PK\x05\x06"):
+        status = None  # the stream broke off after it started: no end of central directory
+    return {"status": status, "seconds": time.monotonic() - started, "first_byte_seconds": first_byte,
+            "bytes": size}
+
+
+def _percentile(values, q: float):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def run_scenario(client, source: str, duration: float, interval: float, concurrency: int, repeat: int,
+                 accurate: bool) -> dict:
+    before = read_metrics(client)
+    runs = []
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(repeat):
+            ids = []
+            for _ in range(concurrency):
+                # a fresh id per request: always a cache miss, never coalesced
+                video_id = uuid.uuid4().hex[:11]
+                BenchYoutubeDL.sources[video_id] = source
+                ids.append(video_id)
+            runs += pool.map(lambda video_id: run_one(client, video_id, interval, accurate), ids)
+    wall = time.monotonic() - started
+    time.sleep(0.2)  # the server records a response just after its last byte
+    after = read_metrics(client)
+
+    ok = [r for r in runs if r["status"] == 200]
+    latencies = [r["seconds"] for r in ok]
+    result = {
+        "duration": duration,
+        "interval": interval,
+        "concurrency": concurrency,
+        "accurate": accurate,
+        "requests": len(runs),
+        "failed": len(runs) - len(ok),
+        "wall_seconds": round(wall, 4),
+        "stages": stage_breakdown(before, after),
+    }
+    if ok:
+        total_bytes = sum(r["bytes"] for r in ok)
+        result.update({
+            "latency_seconds": {
+                "min": round(min(latencies), 4),
+                "median": round(statistics.median(latencies), 4),
+                "p95": round(_percentile(latencies, 0.95), 4),
+                "max": round(max(latencies), 4),
+            },
+            "first_byte_seconds_median": round(statistics.median(r["first_byte_seconds"] or 0 for r in ok), 4),
+            "bytes_per_request": total_bytes // len(ok),
+            "throughput_mb_per_second": round(total_bytes / wall / 1e6, 3),
+            "video_seconds_per_second": round(duration * len(ok) / wall, 2),
+            "requests_per_second": round(len(ok) / wall, 3),
+        })
+    return result
+
+
+def environment() -> dict:
+    def first_line(cmd):
+        try:
+            return subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout.splitlines()[0]
+        except (OSError, IndexError):
+            return None
+
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": first_line(["git", "rev-parse", "HEAD"]),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "ffmpeg": first_line(["ffmpeg", "-hide_banner", "-version"]),
+    }
+
+
+def _floats(text: str):
+    return [float(v) for v in text.split(",") if v]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--durations", type=_floats, default=[60.0], help="source lengths in seconds (comma separated)")
+    parser.add_argument("--intervals", type=_floats, default=[10.0], help="clip lengths in seconds (comma separated)")
+    parser.add_argument("--concurrency", type=lambda s: [int(v) for v in _floats(s)], default=[1],
+                        help="parallel clients (comma separated)")
+    parser.add_argument("--size", default="1280x720", help="video resolution")
+    parser.add_argument("--rate", type=int, default=30, help="frame rate")
+    parser.add_argument("--gop", type=int, default=60, help="keyframe interval in frames")
+    parser.add_argument("--repeat", type=int, default=3, help="rounds per scenario")
+    parser.add_argument("--accurate", action="store_true", help="use frame-accurate cuts")
+    parser.add_argument("--workdir", help="where sources, caches and state go (default: a temporary directory)")
+    parser.add_argument("--out", default="bench-results.json", help="JSON results file")
+    args = parser.parse_args(argv)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="ytbench_")
+    os.makedirs(workdir, exist_ok=True)
+    # keep the benchmark's caches and state away from the server's; must be set before config is imported
+    os.environ.update({
+        "STATE_DIR": os.path.join(workdir, "state"),
+        "DOWNLOAD_FOLDER": os.path.join(workdir, "downloads"),
+        "SOURCE_CACHE_DIR": os.path.join(workdir, "cache", "sources"),
+        "ARTIFACT_DIR": os.path.join(workdir, "cache", "artifacts"),
+        "WORKSPACE_DIR": os.path.join(workdir, "cache", "work"),
+        # measure disk workdirs, and leave the server's tmpfs alone
+        "WORKSPACE_TMPFS": "",
+        "JOB_WORKERS": "0",
+        # the stand-in is local: don't pace it like a real origin
+        "DOWNLOAD_RATE": "1000",
+        "DOWNLOAD_BURST": "1000",
+    })
+    sources_dir = os.path.join(workdir, "sources")
+    os.makedirs(sources_dir, exist_ok=True)
+
+    import httpx
+    import yt_dlp
+
+    yt_dlp.YoutubeDL = BenchYoutubeDL
+    import metrics
+    from main import app
+
+    server, server_thread, base_url = start_server(app)
+    results = {"environment": environment(), "parameters": {k: v for k, v in vars(args).items() if k != "out"},
+               "scenarios": []}
+    try:
+        with httpx.Client(base_url=base_url, timeout=None) as client:
+            for duration in args.durations:
+                print(f"generating {duration:g}s {args.size} source...")
+                source = generate_source(sources_dir, duration, args.size, args.rate, args.gop)
+                for interval in args.intervals:
+                    for concurrency in args.concurrency:
+                        result = run_scenario(client, source, duration, interval, concurrency, args.repeat,
+                                              args.accurate)
+                        result.update({"size": args.size, "gop": args.gop, "rate": args.rate})
+                        results["scenarios"].append(result)
+                        latency = result.get("latency_seconds", {}).get("median")
+                        print(f"duration={duration:g}s interval={interval:g}s concurrency={concurrency}: "
+                              f"median {latency}s, {result.get('video_seconds_per_second')} video s/s, "
+                              f"{result['failed']} failed")
+    finally:
+        server.should_exit = True
+        server_thread.join()  # it may still be recording metrics under workdir
+        metrics.flush()  # before workdir goes, not at exit
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"results written to {args.out}")
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
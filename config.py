@@ -0,0 +1,92 @@
+# config.py
+"""
+Server settings shared by the web app and the background job workers.
+Everything can be overridden through environment variables.
+"""
+
+import os
+
+DOWNLOAD_FOLDER = os.environ.get("DOWNLOAD_FOLDER", "downloads")
+
+# sqlite databases and lock files shared by every gunicorn worker on the host
+STATE_DIR = os.environ.get("STATE_DIR", "state")
+
+# Protect server from extremely large videos
+MAX_TOTAL_SECONDS = int(os.environ.get("MAX_TOTAL_SECONDS", 60 * 60 * 3))  # 3 hours cap
+
+# set a common browser UA to look like a browser
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115 Safari/537.36"
+
+# downloaded sources shared between requests (see source_cache.py)
+SOURCE_CACHE_DIR = os.environ.get("SOURCE_CACHE_DIR", os.path.join("cache", "sources"))
+SOURCE_CACHE_BYTES = int(os.environ.get("SOURCE_CACHE_BYTES", 20 * 1024 ** 3))  # 20 GB disk budget
+SOURCE_CACHE_TTL = int(os.environ.get("SOURCE_CACHE_TTL", 24 * 60 * 60))  # drop sources unused for a day
+
+# yt-dlp metadata reused between /probe, the pre-flight check and the download (see info_cache.py)
+INFO_CACHE_TTL = int(os.environ.get("INFO_CACHE_TTL", 10 * 60))  # format URLs expire, keep this short
+
+# finished archives of coalesced /split requests, kept briefly for late arrivals (see singleflight.py)
+ARTIFACT_DIR = os.environ.get("ARTIFACT_DIR", os.path.join("cache", "artifacts"))
+ARTIFACT_TTL = int(os.environ.get("ARTIFACT_TTL", 5 * 60))
+
+# pacing of yt-dlp requests per origin, shared by every process on the host (see scheduler.py)
+DOWNLOAD_RATE = float(os.environ.get("DOWNLOAD_RATE", 1.0))  # requests per second when the origin is healthy
+DOWNLOAD_MIN_RATE = float(os.environ.get("DOWNLOAD_MIN_RATE", 0.05))  # floor after repeated 429s
+DOWNLOAD_BURST = float(os.environ.get("DOWNLOAD_BURST", 5))
+DOWNLOAD_BACKOFF = float(os.environ.get("DOWNLOAD_BACKOFF", 5))  # first backoff after a 429 without Retry-After
+DOWNLOAD_BACKOFF_MAX = float(os.environ.get("DOWNLOAD_BACKOFF_MAX", 15 * 60))
+DOWNLOAD_ATTEMPTS = int(os.environ.get("DOWNLOAD_ATTEMPTS", 4))  # tries per request when rate limited
+DOWNLOAD_MAX_WAIT = float(os.environ.get("DOWNLOAD_MAX_WAIT", 120))  # longer than this: fail with 429
+DOWNLOADS_PER_PROCESS = int(os.environ.get("DOWNLOADS_PER_PROCESS", 2))
+DOWNLOADS_PER_HOST = int(os.environ.get("DOWNLOADS_PER_HOST", 4))
+
+# cookie files downloads rotate through (see cookie_pool.py); YT_COOKIES is added to them
+COOKIE_POOL_DIR = os.environ.get("COOKIE_POOL_DIR", "cookies")
+COOKIE_QUARANTINE = int(os.environ.get("COOKIE_QUARANTINE", 15 * 60))  # after a 429, doubling while they continue
+COOKIE_AUTH_QUARANTINE = int(os.environ.get("COOKIE_AUTH_QUARANTINE", 24 * 60 * 60))  # after a sign-in failure
+
+# warm yt-dlp instances kept per option set in each process (see ydl_pool.py)
+YDL_POOL_SIZE = int(os.environ.get("YDL_POOL_SIZE", 4))
+YDL_POOL_MAX_USES = int(os.environ.get("YDL_POOL_MAX_USES", 100))  # then a fresh instance
+
+# startup: import yt-dlp and warm the pool before serving (otherwise on the first request),
+# and warn when a worker takes longer than COLD_START_BUDGET seconds to become ready
+PRELOAD_YTDLP = os.environ.get("PRELOAD_YTDLP", "1").lower() in ("1", "true", "yes")
+COLD_START_BUDGET = float(os.environ.get("COLD_START_BUDGET", 5))
+
+# mode=smart: how far a cut may move from its target to land on a pause (fraction of the interval),
+# and whether scene changes count too (decodes the whole video; see smartcuts.py)
+SMART_TOLERANCE = float(os.environ.get("SMART_TOLERANCE", 0.25))
+SMART_SCENES = os.environ.get("SMART_SCENES", "").lower() in ("1", "true", "yes")
+
+# scratch space of running splits: downloads in progress, clip workdirs, job archives (see workspace.py)
+WORKSPACE_DIR = os.environ.get("WORKSPACE_DIR", os.path.join("cache", "work"))
+WORKSPACE_BYTES = int(os.environ.get("WORKSPACE_BYTES", 20 * 1024 ** 3))  # reserved on disk at once, at most
+WORKSPACE_MIN_FREE = int(os.environ.get("WORKSPACE_MIN_FREE", 1024 ** 3))  # never reserve the last GB of a disk
+WORKSPACE_TMPFS = os.environ.get("WORKSPACE_TMPFS", "/dev/shm")  # "" keeps every workdir on disk
+WORKSPACE_TMPFS_BYTES = int(os.environ.get("WORKSPACE_TMPFS_BYTES", 512 * 1024 ** 2))
+WORKSPACE_TMPFS_MAX = int(os.environ.get("WORKSPACE_TMPFS_MAX", 64 * 1024 ** 2))  # larger workdirs go to disk
+WORKSPACE_BYTES_PER_SECOND = int(os.environ.get("WORKSPACE_BYTES_PER_SECOND", 1024 ** 2))  # if yt-dlp has no size
+WORKSPACE_WAIT = float(os.environ.get("WORKSPACE_WAIT", 30))  # requests wait this long for space, then get a 507
+WORKSPACE_JOB_WAIT = float(os.environ.get("WORKSPACE_JOB_WAIT", 30 * 60))  # jobs stay in line longer
+WORKSPACE_LEASE = int(os.environ.get("WORKSPACE_LEASE", 6 * 60 * 60))  # older reservations are stale
+WORKSPACE_ORPHAN_AGE = int(os.environ.get("WORKSPACE_ORPHAN_AGE", 10 * 60))  # unowned leftovers older than this go
+WORKSPACE_JANITOR_INTERVAL = int(os.environ.get("WORKSPACE_JANITOR_INTERVAL", 5 * 60))
+
+# batches of videos split into one output (see batch.py)
+BATCH_MAX_VIDEOS = int(os.environ.get("BATCH_MAX_VIDEOS", 50))  # after expanding playlists
+BATCH_PREFETCH = int(os.environ.get("BATCH_PREFETCH", 2))  # downloaded sources waiting to be split
+
+# background jobs
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))  # worker processes; 0 = don't run a pool in this process
+JOB_POLL_SECONDS = float(os.environ.get("JOB_POLL_SECONDS", 1.0))
+JOB_RESULT_TTL = int(os.environ.get("JOB_RESULT_TTL", 60 * 60))  # keep finished job archives for an hour
+
+# metrics are added up in each process and written to STATE_DIR this often (see metrics.py)
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", 5))
+
+# add a Server-Timing header (probe time, wait for the first byte) to /split responses
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "").lower() in ("1", "true", "yes")
+
+os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
+os.makedirs(STATE_DIR, exist_ok=True)
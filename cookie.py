@@ -7,6 +7,8 @@ Usage:
 If you supply "headed" as the 4th arg, the browser window will be visible so you can complete 2FA.
 If you prefer security, run without password and sign-in manually when the browser opens:
     python export_youtube_cookies.py --manual cookies.txt headed
+Add --pool NAME to also add the cookies to the server's cookie pool (cookie_pool.py),
+so downloads rotate between several accounts.
 """
 
 import sys
@@ -24,19 +26,29 @@ def save_netscape_cookiefile(cookies, out_path: Path):
     for c in cookies:
         # Convert cookie data to netscape fields
         domain = c.get("domain", "")
-        # Netscape uses TRUE/FALSE for include_subdomains
-        include_subdomains = "TRUE" if c.get("hostOnly") is False else "FALSE"
+        # Netscape uses TRUE/FALSE for include_subdomains; loaders require it to match the leading dot
+        include_subdomains = "TRUE" if domain.startswith(".") else "FALSE"
         path = c.get("path", "/")
         secure = "TRUE" if c.get("secure") else "FALSE"
-        # expiry: if 'expires' not present or 0, set -1
-        expires = str(int(c.get("expires", -1))) if c.get("expires") is not None else "-1"
+        # expiry: Playwright uses -1 for session cookies, Netscape files use 0
+        expires = str(int(c["expires"])) if (c.get("expires") or -1) > 0 else "0"
         name = c.get("name", "")
         value = c.get("value", "")
         lines.append("\t".join([domain, include_subdomains, path, secure, expires, name, value]))
     out_path.write_text("\n".join(lines), encoding="utf-8")
     print(f"[+] Saved cookies to {out_path}")
 
-def run(email=None, password=None, out_file="cookies.txt", headed=True):
+def add_to_pool(out_path: Path, pool_name: str):
+    """Add the exported cookies to the server's cookie pool (see cookie_pool.py)."""
+    import cookie_pool
+    try:
+        path = cookie_pool.add(pool_name, out_path.read_text(encoding="utf-8"))
+    except ValueError as e:
+        print(f"[!] Could not add cookies to the pool: {e}")
+        return
+    print(f"[+] Added to the cookie pool as '{pool_name}' ({path})")
+
+def run(email=None, password=None, out_file="cookies.txt", headed=True, pool_name=None):
     out_path = Path(out_file).resolve()
     with sync_playwright() as p:
         # Pick chromium for best compatibility
@@ -98,10 +110,22 @@ def run(email=None, password=None, out_file="cookies.txt", headed=True):
 
     # Save cookies in netscape format
     save_netscape_cookiefile(cookies, out_path)
+    if pool_name:
+        add_to_pool(out_path, pool_name)
     print("[*] Done. Use the cookies.txt with yt-dlp via --cookies cookies.txt")
 
 if __name__ == "__main__":
     # Basic CLI parsing
+    # --pool NAME: also add the cookies to the server's cookie pool under NAME
+    pool_name = None
+    if "--pool" in sys.argv:
+        i = sys.argv.index("--pool")
+        if i + 1 >= len(sys.argv):
+            print("[!] --pool needs a name for the identity")
+            sys.exit(1)
+        pool_name = sys.argv[i + 1]
+        del sys.argv[i:i + 2]
+
     if "--manual" in sys.argv:
         # manual mode: open browser and sign-in yourself
         try:
@@ -109,7 +133,7 @@ if __name__ == "__main__":
         except:
             out = "cookies.txt"
         headed_flag = True if len(sys.argv) < 4 or sys.argv[3] != "headless" else False
-        run(email=None, password=None, out_file=out, headed=headed_flag)
+        run(email=None, password=None, out_file=out, headed=headed_flag, pool_name=pool_name)
         sys.exit(0)
 
     if len(sys.argv) >= 4:
@@ -117,8 +141,9 @@ if __name__ == "__main__":
         password = sys.argv[2]
         out = sys.argv[3]
         headed_flag = True if len(sys.argv) < 5 or sys.argv[4].lower() != "headless" else False
-        run(email=email, password=password, out_file=out, headed=headed_flag)
+        run(email=email, password=password, out_file=out, headed=headed_flag, pool_name=pool_name)
     else:
         print("Usage examples:")
         print("  python export_youtube_cookies.py youremail@gmail.com yourpassword cookies.txt headed")
         print("  python export_youtube_cookies.py --manual cookies.txt headed")
+        print("  python export_youtube_cookies.py --manual cookies.txt headed --pool account1")
@@ -0,0 +1,251 @@
+# cookie_pool.py
+"""
+Pool of YouTube identities (Netscape cookies.txt files) that downloads rotate through.
+
+The pool is every `*.txt` in COOKIE_POOL_DIR, plus the YT_COOKIES file if it is
+set. Files are read once into memory (again only when the directory or a file
+changes) and handed to yt-dlp as text streams, so a download never reads or
+rewrites the files on disk.
+
+Each download leases the least recently used healthy identity. Outcomes are
+recorded per identity in sqlite under STATE_DIR, shared by all workers: a 429
+quarantines the identity for COOKIE_QUARANTINE seconds (doubling while it keeps
+happening), a sign-in failure for COOKIE_AUTH_QUARANTINE seconds, since its
+cookies most likely expired. Re-exporting the file (see cookie.py) clears it.
+With no healthy identity, downloads go out without cookies.
+"""
+
+import glob
+import io
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+from config import STATE_DIR, COOKIE_POOL_DIR, COOKIE_QUARANTINE, COOKIE_AUTH_QUARANTINE
+
+COOKIE_DB = os.path.join(STATE_DIR, "cookie_pool.db")
+LEGACY_NAME = "default"  # the YT_COOKIES file
+NAME_RE = re.compile(r"^[A-Za-z0-9_.-]+$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS identities (
+    name TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    last_used REAL NOT NULL DEFAULT 0,
+    successes INTEGER NOT NULL DEFAULT 0,
+    rate_limited INTEGER NOT NULL DEFAULT 0,
+    auth_failures INTEGER NOT NULL DEFAULT 0,
+    strikes INTEGER NOT NULL DEFAULT 0,
+    quarantined_until REAL NOT NULL DEFAULT 0
+);
+"""
+
+AUTH_ERRORS = ("sign in to confirm", "login required", "cookies are no longer valid", "use --cookies")
+
+_lock = threading.Lock()
+_loaded = {}  # name -> (path, mtime, text)
+_loaded_stamp = None
+
+
+class Identity:
+    """One cookies file of the pool; `cookiefile()` gives yt-dlp a fresh stream of it."""
+
+    def __init__(self, name: str, text: str):
+        self.name = name
+        self.text = text
+
+    def cookiefile(self):
+        return io.StringIO(self.text)
+
+
+def connect():
+    conn = sqlite3.connect(COOKIE_DB, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
+
+
+def init_db():
+    conn = connect()
+    try:
+        conn.executescript(SCHEMA)
+    finally:
+        conn.close()
+
+
+def _sources():
+    """name -> path of every cookies file in the pool."""
+    paths = {os.path.splitext(os.path.basename(p))[0]: p for p in glob.glob(os.path.join(COOKIE_POOL_DIR, "*.txt"))}
+    legacy = os.environ.get("YT_COOKIES")
+    if legacy and os.path.exists(legacy):
+        paths.setdefault(LEGACY_NAME, legacy)
+    return paths
+
+
+def _validate(text: str):
+    """Raise ValueError unless `text` is a Netscape cookies file yt-dlp can load."""
+    from yt_dlp.cookies import YoutubeDLCookieJar
+
+    jar = YoutubeDLCookieJar(io.StringIO(text))
+    try:
+        jar.load()
+    except Exception as e:
+        raise ValueError(f"not a Netscape cookies file: {e}")
+    if not len(jar):
+        raise ValueError("no cookies in file")
+
+
+def _load():
+    """(Re)read the pool files if any of them changed; returns name -> (path, mtime, text)."""
+    global _loaded, _loaded_stamp
+    sources = _sources()
+    stamp = {}
+    for name, path in sources.items():
+        try:
+            stamp[name] = os.path.getmtime(path)
+        except OSError:
+            pass
+    with _lock:
+        if stamp == _loaded_stamp:
+            return _loaded
+        loaded = {}
+        for name, mtime in stamp.items():
+            previous = _loaded.get(name)
+            if previous and previous[1] == mtime:
+                loaded[name] = previous
+                continue
+            try:
+                with open(sources[name], "r", encoding="utf-8") as f:
+                    text = f.read()
+                _validate(text)
+            except (OSError, ValueError) as e:
+                print(f"cookie pool: skipping {sources[name]}: {e}")
+                continue
+            loaded[name] = (sources[name], mtime, text)
+        _loaded, _loaded_stamp = loaded, stamp
+    return loaded
+
+
+def _sync(conn, loaded: dict):
+    """Make sure every loaded identity has a row; a re-exported file starts healthy again."""
+    rows = {row["name"]: row for row in conn.execute("SELECT name, mtime FROM identities")}
+    for name, (_, mtime, _) in loaded.items():
+        row = rows.get(name)
+        if row is None:
+            conn.execute("INSERT INTO identities (name, mtime) VALUES (?, ?)", (name, mtime))
+        elif row["mtime"] != mtime:
+            conn.execute("UPDATE identities SET mtime = ?, strikes = 0, quarantined_until = 0 WHERE name = ?",
+                         (mtime, name))
+
+
+def _take_identity():
+    """The least recently used identity that is not quarantined (marked as used), or None."""
+    loaded = _load()
+    if not loaded:
+        return None
+    conn = connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            _sync(conn, loaded)
+            now = time.time()
+            placeholders = ",".join("?" * len(loaded))
+            row = conn.execute(
+                f"SELECT name FROM identities WHERE name IN ({placeholders}) AND quarantined_until <= ? "
+                "ORDER BY last_used LIMIT 1",
+                (*loaded, now),
+            ).fetchone()
+            if row is not None:
+                conn.execute("UPDATE identities SET last_used = ? WHERE name = ?", (now, row["name"]))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    return Identity(row["name"], loaded[row["name"]][2])
+
+
+def identities() -> list:
+    """Every identity in the pool, healthy or not."""
+    return [Identity(name, text) for name, (_, _, text) in _load().items()]
+
+
+def classify(exc) -> str:
+    """'rate_limited', 'auth' or 'error' for a failed yt-dlp call."""
+    import scheduler
+
+    if scheduler.is_rate_limited(exc):
+        return "rate_limited"
+    message = str(exc).lower()
+    if any(marker in message for marker in AUTH_ERRORS):
+        return "auth"
+    return "error"
+
+
+def report(name: str, outcome: str):
+    """Record the outcome ('ok', 'rate_limited', 'auth' or 'error') of a request made as `name`."""
+    metrics.inc("cutter_cookie_requests_total", identity=name, outcome=outcome)
+    if outcome == "error":
+        return  # says nothing about the identity
+    conn = connect()
+    try:
+        now = time.time()
+        if outcome == "ok":
+            conn.execute("UPDATE identities SET successes = successes + 1, strikes = 0 WHERE name = ?", (name,))
+        elif outcome == "rate_limited":
+            row = conn.execute("SELECT strikes FROM identities WHERE name = ?", (name,)).fetchone()
+            strikes = (row["strikes"] if row else 0) + 1
+            quarantine = min(COOKIE_QUARANTINE * 2 ** (strikes - 1), COOKIE_AUTH_QUARANTINE)
+            conn.execute("UPDATE identities SET rate_limited = rate_limited + 1, strikes = ?, quarantined_until = ? "
+                         "WHERE name = ?", (strikes, now + quarantine, name))
+        elif outcome == "auth":
+            conn.execute("UPDATE identities SET auth_failures = auth_failures + 1, quarantined_until = ? "
+                         "WHERE name = ?", (now + COOKIE_AUTH_QUARANTINE, name))
+    finally:
+        conn.close()
+
+
+@contextmanager
+def lease():
+    """
+    Yield an Identity for one yt-dlp request (None if the pool has no healthy
+    identity) and record how the request went when the block exits.
+    """
+    identity = _take_identity()
+    try:
+        yield identity
+    except Exception as e:
+        if identity is not None:
+            report(identity.name, classify(e))
+        raise
+    if identity is not None:
+        report(identity.name, "ok")
+
+
+def add(name: str, text: str) -> str:
+    """
+    Add (or replace) the identity `name` with the cookies in `text` (Netscape format).
+    Returns the path of the pool file. Raises ValueError for bad names or files.
+    """
+    if not NAME_RE.match(name):
+        raise ValueError(f"invalid identity name {name!r}: use letters, digits, '.', '_' and '-'")
+    _validate(text)
+    os.makedirs(COOKIE_POOL_DIR, exist_ok=True)
+    path = os.path.join(COOKIE_POOL_DIR, f"{name}.txt")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.chmod(tmp_path, 0o600)
+    os.replace(tmp_path, path)
+    return path
+
+
+init_db()
@@ -0,0 +1,74 @@
+# info_cache.py
+"""
+TTL cache of yt-dlp metadata (`extract_info(download=False)` results).
+
+The pre-flight check of /split and the /probe endpoint both need the video's info
+before anything is downloaded; caching it means a rejected request comes back in
+milliseconds and the download that follows does not extract the video a second
+time. Format URLs expire, so entries are only kept for INFO_CACHE_TTL seconds.
+Stored in sqlite under STATE_DIR so all workers share it.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from config import STATE_DIR, INFO_CACHE_TTL
+
+INFO_DB = os.path.join(STATE_DIR, "info_cache.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS infos (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    info TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS infos_expires ON infos (expires);
+"""
+
+
+def connect():
+    conn = sqlite3.connect(INFO_DB, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
+
+
+def init_db():
+    conn = connect()
+    try:
+        conn.executescript(SCHEMA)
+    finally:
+        conn.close()
+
+
+def _key(url: str) -> str:
+    return hashlib.sha256(url.strip().encode("utf-8")).hexdigest()
+
+
+def get(url: str):
+    """Return the cached info dict for `url`, or None if missing or expired."""
+    conn = connect()
+    try:
+        row = conn.execute("SELECT info FROM infos WHERE key = ? AND expires > ?", (_key(url), time.time())).fetchone()
+    finally:
+        conn.close()
+    return json.loads(row[0]) if row else None
+
+
+def put(url: str, info: dict, ttl: float = INFO_CACHE_TTL):
+    """Store a JSON-safe info dict (see YoutubeDL.sanitize_info)."""
+    now = time.time()
+    conn = connect()
+    try:
+        conn.execute("INSERT OR REPLACE INTO infos (key, url, info, expires) VALUES (?, ?, ?, ?)",
+                     (_key(url), url, json.dumps(info), now + ttl))
+        conn.execute("DELETE FROM infos WHERE expires < ?", (now,))
+    finally:
+        conn.close()
+
+
+init_db()
@@ -0,0 +1,321 @@
+# jobs.py
+"""
+Persistent job queue for asynchronous splits.
+
+Jobs live in a sqlite database under STATE_DIR, so every gunicorn worker sees the
+same queue and a restart does not lose queued work. One process per host (whichever
+grabs the pool lock first) runs a bounded pool of JOB_WORKERS worker processes that
+claim queued jobs and run the split pipeline.
+
+Run the pool on its own (e.g. with JOB_WORKERS=0 on the web workers) with:
+    python jobs.py
+"""
+
+import fcntl
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+
+import metrics
+import progress
+from config import STATE_DIR, JOB_WORKERS, JOB_POLL_SECONDS, JOB_RESULT_TTL, WORKSPACE_JOB_WAIT
+
+JOBS_DB = os.path.join(STATE_DIR, "jobs.db")
+POOL_LOCK = os.path.join(STATE_DIR, "jobs.pool.lock")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,          -- queued | running | done | failed
+    stage TEXT NOT NULL,
+    params TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    status_code INTEGER,
+    worker INTEGER,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);
+"""
+
+
+# ---------- store ----------
+def connect():
+    conn = sqlite3.connect(JOBS_DB, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
+
+
+def init_db():
+    conn = connect()
+    try:
+        conn.executescript(SCHEMA)
+    finally:
+        conn.close()
+
+
+def _row_to_job(row):
+    if row is None:
+        return None
+    job = dict(row)
+    job["params"] = json.loads(job["params"])
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    job["error"] = json.loads(job["error"]) if job["error"] else None
+    return job
+
+
+def submit(params: dict) -> str:
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    conn = connect()
+    try:
+        conn.execute(
+            "INSERT INTO jobs (id, status, stage, params, created, updated) VALUES (?, 'queued', 'queued', ?, ?, ?)",
+            (job_id, json.dumps(params), now, now),
+        )
+    finally:
+        conn.close()
+    progress.Reporter(progress_key(job_id), stage="queued")
+    return job_id
+
+
+def progress_key(job_id: str) -> str:
+    """Key of the job's live progress (see progress.py)."""
+    return f"job:{job_id}"
+
+
+def get_job(job_id: str):
+    conn = connect()
+    try:
+        return _row_to_job(conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+    finally:
+        conn.close()
+
+
+def queue_position(job_id: str) -> int:
+    """Number of queued jobs ahead of `job_id`."""
+    conn = connect()
+    try:
+        row = conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created < (SELECT created FROM jobs WHERE id = ?)",
+            (job_id,),
+        ).fetchone()
+        return row[0]
+    finally:
+        conn.close()
+
+
+def claim_next(worker: int):
+    """Atomically move the oldest queued job to running and return it (or None)."""
+    conn = connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY created LIMIT 1").fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+        conn.execute(
+            "UPDATE jobs SET status = 'running', stage = 'starting', worker = ?, updated = ? WHERE id = ?",
+            (worker, time.time(), row["id"]),
+        )
+        conn.execute("COMMIT")
+        return _row_to_job(row)
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def _update(job_id: str, **fields):
+    fields["updated"] = time.time()
+    cols = ", ".join(f"{k} = ?" for k in fields)
+    conn = connect()
+    try:
+        conn.execute(f"UPDATE jobs SET {cols} WHERE id = ?", (*fields.values(), job_id))
+    finally:
+        conn.close()
+
+
+def set_stage(job_id: str, stage: str):
+    _update(job_id, stage=stage)
+
+
+def finish(job_id: str, result: dict):
+    _update(job_id, status="done", stage="done", result=json.dumps(result))
+
+
+def fail(job_id: str, error: dict, status_code: int = 500):
+    _update(job_id, status="failed", stage="failed", error=json.dumps(error), status_code=status_code)
+
+
+def requeue_running():
+    """Put jobs whose worker died (e.g. on restart) back in the queue."""
+    conn = connect()
+    try:
+        conn.execute("UPDATE jobs SET status = 'queued', stage = 'queued', worker = NULL, updated = ? WHERE status = 'running'",
+                     (time.time(),))
+    finally:
+        conn.close()
+
+
+def purge_expired():
+    """Delete finished jobs older than JOB_RESULT_TTL together with their archives."""
+    from pipeline import cleanup_file
+
+    cutoff = time.time() - JOB_RESULT_TTL
+    conn = connect()
+    try:
+        rows = conn.execute("SELECT id, result FROM jobs WHERE status IN ('done', 'failed') AND updated < ?",
+                            (cutoff,)).fetchall()
+        for row in rows:
+            if row["result"]:
+                cleanup_file(json.loads(row["result"]).get("path"))
+            conn.execute("DELETE FROM jobs WHERE id = ?", (row["id"],))
+    finally:
+        conn.close()
+
+
+def archive_paths() -> list:
+    """Paths of the archives of finished jobs (the janitor keeps these, see workspace.py)."""
+    conn = connect()
+    try:
+        rows = conn.execute("SELECT result FROM jobs WHERE result IS NOT NULL").fetchall()
+    finally:
+        conn.close()
+    paths = (json.loads(row["result"]).get("path") for row in rows)
+    return [path for path in paths if path]
+
+
+# ---------- workers ----------
+def run_job(job: dict):
+    import workspace
+    from pipeline import SplitError, run_split_job
+
+    job_id = job["id"]
+    params = job["params"]
+    metrics.observe("cutter_job_queue_wait_seconds", time.time() - job["created"])
+    reporter = progress.Reporter(progress_key(job_id))
+
+    def on_stage(stage):
+        set_stage(job_id, stage)
+        reporter.stage(stage)
+
+    try:
+        # a job is already waiting in line: rather than fail, it waits for disk space a while longer
+        with workspace.patience(WORKSPACE_JOB_WAIT):
+            zip_filename = run_split_job(
+                params["url"], params["interval"], params.get("base_name", "clip"),
+                section=params.get("section"),
+                accurate=params.get("accurate", False),
+                mode=params.get("mode", "interval"),
+                stream=params.get("stream", False),
+                on_stage=on_stage,
+                on_progress=reporter.progress,
+            )
+        finish(job_id, {"path": zip_filename, "filename": os.path.basename(zip_filename)})
+        reporter.finish(download_url=f"/jobs/{job_id}/download")
+    except SplitError as e:
+        fail(job_id, e.payload, e.status_code)
+        reporter.finish(e.payload)
+    except Exception as e:
+        traceback.print_exc()
+        fail(job_id, {"error": "unexpected error", "details": str(e)}, 500)
+        reporter.finish({"error": "unexpected error", "details": str(e)})
+
+
+def worker_main(stop_event):
+    pid = os.getpid()
+    last_purge = 0.0
+    while not stop_event.is_set():
+        if time.time() - last_purge > 60:
+            try:
+                purge_expired()
+            except Exception:
+                traceback.print_exc()
+            last_purge = time.time()
+        job = claim_next(pid)
+        if job is None:
+            stop_event.wait(JOB_POLL_SECONDS)
+            continue
+        run_job(job)
+    # multiprocessing exits without running atexit
+    metrics.flush()
+
+
+class WorkerPool:
+    """
+    Runs `size` worker processes, but only in the process holding POOL_LOCK, so the
+    pool stays bounded no matter how many gunicorn workers start one. The other
+    processes keep retrying the lock and take over if the owner goes away.
+    """
+
+    def __init__(self, size: int = JOB_WORKERS):
+        self.size = size
+        self._ctx = multiprocessing.get_context("spawn")
+        self._stop = self._ctx.Event()
+        self._procs = []
+        self._lock_fd = None
+        self._thread = None
+
+    def start(self):
+        if self.size <= 0:
+            return
+        self._thread = threading.Thread(target=self._supervise, name="job-pool", daemon=True)
+        self._thread.start()
+
+    def _try_lock(self) -> bool:
+        fd = os.open(POOL_LOCK, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    def _supervise(self):
+        while not self._stop.is_set():
+            if self._lock_fd is None:
+                if not self._try_lock():
+                    self._stop.wait(5)
+                    continue
+                # we own the pool now: anything still "running" belonged to a dead pool
+                requeue_running()
+            # (re)start missing workers
+            self._procs = [p for p in self._procs if p.is_alive()]
+            while len(self._procs) < self.size:
+                proc = self._ctx.Process(target=worker_main, args=(self._stop,), daemon=True)
+                proc.start()
+                self._procs.append(proc)
+            self._stop.wait(1)
+
+    def stop(self, timeout: float = 5):
+        self._stop.set()
+        for proc in self._procs:
+            proc.join(timeout)
+            if proc.is_alive():
+                proc.terminate()
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+
+init_db()
+
+if __name__ == "__main__":
+    pool = WorkerPool(max(JOB_WORKERS, 1))
+    pool.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pool.stop()
@@ -0,0 +1,155 @@
+# keyframes.py
+"""
+Keyframe index of a source video, built with ffprobe and cached next to the file.
+
+Only packets are read (no decoding), so indexing is about as fast as reading the
+file. The index is stored as `<source>.keyframes.json` together with the source's
+size and mtime; it is rebuilt if the file changes. Used by the accurate cut mode
+in splitter.py.
+"""
+
+import bisect
+import json
+import os
+import subprocess
+
+INDEX_SUFFIX = ".keyframes.json"
+
+
+def _stamp(source: str) -> dict:
+    st = os.stat(source)
+    return {"size": st.st_size, "mtime": st.st_mtime}
+
+
+def _probe_keyframes(source: str):
+    cmd = [
+        "ffprobe",
+        "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags",
+        "-of", "csv=p=0",
+        source,
+    ]
+    out = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, text=True).stdout
+    times = []
+    for line in out.splitlines():
+        pts_time, _, flags = line.partition(",")
+        if "K" in flags and pts_time not in ("", "N/A"):
+            times.append(float(pts_time))
+    return sorted(times)
+
+
+def probe_video_stream(source: str) -> dict:
+    """codec_name, pix_fmt, width, height, time_base etc. of the first video stream."""
+    cmd = [
+        "ffprobe",
+        "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "stream=codec_name,profile,pix_fmt,width,height,time_base,r_frame_rate",
+        "-of", "json",
+        source,
+    ]
+    out = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, text=True).stdout
+    streams = json.loads(out).get("streams") or [{}]
+    return streams[0]
+
+
+def source_offsets(source: str):
+    """
+    (preroll, list_offset) of `source` for the segment muxer, in seconds.
+
+    A stream copy of a section (-ss before -i) starts on the keyframe before the
+    section and hides the frames up to its start behind an edit list; `preroll`
+    is how far the first video packet lies before 0. Players and decoders apply
+    the edit list, the segment muxer does not. Its segment list counts from the
+    first packet's dts instead, which B-frames (and audio priming) can put further
+    back: `list_offset` seconds before 0.
+    """
+    preroll = _first_packet_time(["-select_streams", "v:0", "-show_entries", "packet=pts_time",
+                                  "-read_intervals", "%+#1"], source)
+    preroll = max(0.0, -preroll) if preroll is not None else 0.0
+    # the first packets of every stream
+    first_dts = _first_packet_time(["-show_entries", "packet=dts_time", "-read_intervals", "%+#16"], source)
+    if first_dts is None:
+        return preroll, preroll
+    return preroll, preroll + max(0.0, -(first_dts + preroll))
+
+
+def stream_offsets(url: str, start: float, input_args=()):
+    """
+    source_offsets for ffmpeg reading `url` (with the protocol options
+    `input_args`) from `-ss start`. Where that seek lands depends on the demuxer
+    (a fragmented MP4 can land after `start`, so the preroll may be negative);
+    ffmpeg is asked by copying the first second after it. (0, 0) if it can't say.
+    """
+    cmd = [
+        "ffmpeg",
+        "-v", "error",
+        *input_args,
+        "-ss", f"{start:.6f}",
+        "-i", url,
+        "-c", "copy",
+        "-t", "1",
+        "-f", "framecrc",
+        "-",
+    ]
+    time_bases, first = {}, {}
+    for line in subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout.splitlines():
+        fields = [field.strip() for field in line.split(",")]
+        if line.startswith("#tb "):
+            index, _, base = line[4:].partition(":")
+            num, _, den = base.strip().partition("/")
+            time_bases[index.strip()] = int(num) / int(den)
+        elif not line.startswith("#") and len(fields) > 2 and fields[0] in time_bases and fields[0] not in first:
+            # the first packet of each stream: (dts, pts) in seconds
+            first[fields[0]] = (int(fields[1]) * time_bases[fields[0]], int(fields[2]) * time_bases[fields[0]])
+    if "0" not in first:
+        return 0.0, 0.0
+    # the streams the segment pass picks too, video first: its first packet is the keyframe the seek landed on
+    return -first["0"][1], -min(dts for dts, _ in first.values())
+
+
+def _first_packet_time(args, source: str):
+    """The smallest time ffprobe prints for the packets `args` select, or None."""
+    cmd = ["ffprobe", "-v", "error", *args, "-of", "csv=p=0", source]
+    times = []
+    for value in subprocess.run(cmd, stdout=subprocess.PIPE, text=True).stdout.replace(",", " ").split():
+        try:
+            times.append(float(value))
+        except ValueError:
+            pass  # N/A: no timestamp
+    return min(times) if times else None
+
+
+def keyframe_index(source: str) -> dict:
+    """
+    Return {"keyframes": [...], "video": {...}} for `source`, from the cached index
+    file when it is still valid.
+    """
+    index_path = source + INDEX_SUFFIX
+    stamp = _stamp(source)
+    try:
+        with open(index_path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        if index.get("stamp") == stamp:
+            return index
+    except (OSError, ValueError):
+        pass
+
+    index = {
+        "stamp": stamp,
+        "keyframes": _probe_keyframes(source),
+        "video": probe_video_stream(source),
+    }
+    # write atomically: other workers may be reading the same index
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f)
+    os.replace(tmp_path, index_path)
+    return index
+
+
+def next_keyframe(keyframes, t: float, eps: float = 0.001):
+    """First keyframe at or after `t` (within `eps`), or None."""
+    i = bisect.bisect_left(keyframes, t - eps)
+    return keyframes[i] if i < len(keyframes) else None
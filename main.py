@@ -1,22 +1,100 @@
+# app.py
+from contextlib import asynccontextmanager
+from urllib.parse import quote
 
 from fastapi import FastAPI, Query, Request
-from fastapi.responses import FileResponse, JSONResponse, HTMLResponse
+from fastapi.responses import FileResponse, JSONResponse, HTMLResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from starlette.background import BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-import os
-import yt_dlp
-import subprocess
-import zipfile
+from pydantic import BaseModel
+from typing import List, Optional
+import json
 import math
-import uuid
+import os
+import re
+import threading
+import time
+import traceback
+
+import batch
+import jobs
+import metrics
+import pipeline
+import progress
+import singleflight
+import toolchain
+import workspace
+import ydl_pool
+from config import COLD_START_BUDGET, JOB_WORKERS, MAX_TOTAL_SECONDS, PRELOAD_YTDLP, SERVER_TIMING
+from pipeline import (
+    SplitError, check_duration, ensure_ffmpeg_exists, probe, split_key, summarize,
+    validate_interval, validate_mode, validate_section, validate_stream, write_manifest, write_split_job,
+)
+from singleflight import FlightError
+from zipstream import ZipStream
+
+
+# ---------- startup ----------
+STARTUP = {}  # phase -> seconds, see warm_up
 
 
+def process_age():
+    """Seconds since this process started (from /proc, Linux only), or None."""
+    try:
+        with open("/proc/self/stat", "r") as f:
+            # fields after the "(comm)" one; starttime is field 22 of the whole line
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime", "r") as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+
+
+def warm_up():
+    """
+    Work done once per process before it serves: detect ffmpeg/ffprobe and their
+    encoders, and (with PRELOAD_YTDLP) import yt-dlp and warm the YoutubeDL pool.
+    Records how long startup took and warns when it is over COLD_START_BUDGET.
+    """
+    started = time.monotonic()
+    toolchain.detect()
+    STARTUP["toolchain"] = time.monotonic() - started
+    if PRELOAD_YTDLP:
+        started = time.monotonic()
+        try:
+            pipeline.warm_up()
+        except Exception:
+            # the first request warms it instead
+            traceback.print_exc()
+        STARTUP["yt_dlp"] = time.monotonic() - started
+    STARTUP["total"] = process_age() or sum(STARTUP.values())
+    for phase, seconds in STARTUP.items():
+        metrics.observe("cutter_startup_seconds", seconds, phase=phase)
+    if STARTUP["total"] > COLD_START_BUDGET:
+        print(f"startup took {STARTUP['total']:.2f}s, over the cold start budget of {COLD_START_BUDGET:g}s")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # job workers: only one process per host actually runs them (see jobs.WorkerPool)
+    pool = jobs.WorkerPool(JOB_WORKERS)
+    pool.start()
+    # reclaims what crashed splits left on disk; one sweep at a time per host (see workspace.py)
+    janitor_stop = threading.Event()
+    janitor = threading.Thread(target=workspace.run_janitor, args=(janitor_stop,), name="workspace-janitor",
+                               daemon=True)
+    janitor.start()
+    warm_up()
+    yield
+    janitor_stop.set()
+    pool.stop()
+    ydl_pool.clear()
+
 
-app = FastAPI()
-DOWNLOAD_FOLDER = "downloads"
-os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
+# ---------- config ----------
+app = FastAPI(lifespan=lifespan)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
@@ -28,10 +106,11 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
 
 # Security headers middleware
 @app.middleware("http")
-async def add_security_headers(request, call_next):
+async def add_security_headers(request: Request, call_next):
     response = await call_next(request)
     response.headers["X-Content-Type-Options"] = "nosniff"
     response.headers["X-Frame-Options"] = "DENY"
@@ -40,177 +119,80 @@ async def add_security_headers(request, call_next):
     return response
 
 
-def cleanup_file(path: str):
-    if os.path.exists(path):
-        os.remove(path)
-
-
+# ---------- routes ----------
 @app.get("/", response_class=HTMLResponse)
 def home(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
-def split_video(
-    url: str = Query(..., description="YouTube video URL"),
-    interval: float = Query(..., description="Interval in seconds"),
-    base_name: str = Query("clip", description="Base name for split clips"),
-    background_tasks: BackgroundTasks = None
- ):
-    try:
-        # Step 1: Download full video
-        full_filename = os.path.join(DOWNLOAD_FOLDER, "%(title)s.%(ext)s")
-        # Configure yt-dlp with safer defaults for production
-        cookiefile = os.environ.get("YT_COOKIES")  # path to cookies.txt if user sets it in Render env
-        ydl_opts = {
-            "outtmpl": full_filename,
-            "format": "mp4",
-            # retry and pacing options to reduce 429s
-            "retries": 10,
-            "sleep_interval_requests": 2,
-            "sleep_interval": 1,
-            "http_chunk_size": 0,
-            "no_warnings": True,
-            "quiet": True,
-            # set a common browser UA to avoid bot blocks
-            "http_headers": {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115 Safari/537.36"
-            }
-        }
-        if cookiefile:
-            ydl_opts["cookiefile"] = cookiefile
-
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            full_filepath = ydl.prepare_filename(info)
-
-        # Get video duration in seconds
-        duration = info.get("duration")
-        if not duration:
-            return JSONResponse(content={"error": "Cannot get video duration"}, status_code=500)
-
-        clip_files = []
-
-        # Step 2: Split video into interval clips
-        num_clips = math.ceil(duration / interval)
-        for i in range(num_clips):
-            start = i * interval
-            end = min((i + 1) * interval, duration)
-            clip_filename = os.path.join(DOWNLOAD_FOLDER, f"{base_name}{i}.mp4")  # numbered clips
-
-            cmd = [
-                "ffmpeg",
-                "-i", full_filepath,
-                "-ss", str(start),
-                "-to", str(end),
-                "-c", "copy",
-                clip_filename,
-                "-y"
-            ]
-            subprocess.run(cmd, check=True)
-            clip_files.append(clip_filename)
-
-        # Step 3: Create ZIP of all clips
-        zip_filename = os.path.join(DOWNLOAD_FOLDER, f"{base_name}_{uuid.uuid4().hex}.zip")
-        with zipfile.ZipFile(zip_filename, "w") as zipf:
-            for clip in clip_files:
-                zipf.write(clip, os.path.basename(clip))
-
-        # Step 4: Cleanup clips + full video in background (if BackgroundTasks provided)
-        if background_tasks:
-            background_tasks.add_task(cleanup_file, full_filepath)
-            for clip in clip_files:
-                background_tasks.add_task(cleanup_file, clip)
-            background_tasks.add_task(cleanup_file, zip_filename)  # delete zip after sending
-
-        # Step 5: Send ZIP to client
-        return FileResponse(
-            zip_filename,
-            media_type="application/zip",
-            filename=os.path.basename(zip_filename),
-            background=background_tasks
-        )
-
-    except Exception as e:
-        msg = str(e)
-        # Common guidance for known failure modes from yt-dlp
-        if "Sign in to confirm" in msg or "sign in" in msg.lower():
-            guidance = (
-                "YouTube is asking to sign in (captcha / age-restricted or bot detection). "
-                "Provide cookies exported from your browser and set the YT_COOKIES environment variable (path to cookies.txt) in your Render service, "
-                "or use browser-based authentication. See yt-dlp docs: https://github.com/yt-dlp/yt-dlp/wiki/FAQ#how-do-i-pass-cookies-to-yt-dlp"
-            )
-            return JSONResponse(content={"error": msg, "guidance": guidance}, status_code=403)
-
-        if "429" in msg or "Too Many Requests" in msg or "HTTP Error 429" in msg:
-            guidance = (
-                "The request was rate-limited (HTTP 429). Try using cookies, increasing sleep intervals, or run on a server with a different IP. "
-                "You can also set the YT_COOKIES env var to a cookies.txt file to reduce bot detection."
-            )
-            return JSONResponse(content={"error": msg, "guidance": guidance}, status_code=429)
-
-        return JSONResponse(content={"error": msg}, status_code=500)
-# app.py
-from fastapi import FastAPI, Query, Request, BackgroundTasks
-from fastapi.responses import FileResponse, JSONResponse, HTMLResponse
-from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
-from fastapi.middleware.cors import CORSMiddleware
-import os
-import yt_dlp
-import subprocess
-import zipfile
-import math
-import uuid
-import time
-import shutil
-import tempfile
 
-# ---------- config ----------
-app = FastAPI()
-DOWNLOAD_FOLDER = "downloads"
-os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
-app.mount("/static", StaticFiles(directory="static"), name="static")
-templates = Jinja2Templates(directory="templates")
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Stage timings, cache hit counts and bytes sent, in the Prometheus text format (see metrics.py)."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
-# CORS for frontend
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
 
-# Security headers middleware
-@app.middleware("http")
-async def add_security_headers(request: Request, call_next):
-    response = await call_next(request)
-    response.headers["X-Content-Type-Options"] = "nosniff"
-    response.headers["X-Frame-Options"] = "DENY"
-    response.headers["X-XSS-Protection"] = "1; mode=block"
-    response.headers["Strict-Transport-Security"] = "max-age=63072000; includeSubDomains"
-    return response
+@app.get("/health")
+def health():
+    """Readiness of this worker: the ffmpeg/ffprobe it found, how long it took to start and the scratch space."""
+    tools = toolchain.detect()
+    ready = all(tools[tool]["path"] for tool in ("ffmpeg", "ffprobe"))
+    return JSONResponse({
+        "ready": ready,
+        "ffmpeg": tools["ffmpeg"],
+        "ffprobe": tools["ffprobe"],
+        "encoders": len(tools["encoders"]),
+        "startup_seconds": {phase: round(seconds, 3) for phase, seconds in STARTUP.items()},
+        "cold_start_budget": COLD_START_BUDGET,
+        "workspace": workspace.usage(),
+    }, status_code=200 if ready else 503)
 
 
-# ---------- helpers ----------
-def cleanup_file(path: str):
+@app.get("/probe")
+def probe_video(
+    url: str = Query(..., description="YouTube video URL"),
+    interval: float = Query(None, description="Interval in seconds, to estimate the number of clips"),
+    start: float = Query(None, description="Only split from this many seconds into the video"),
+    end: float = Query(None, description="Only split up to this many seconds into the video"),
+):
+    """
+    Video metadata (title, duration, formats, size estimates) without downloading it,
+    and whether /split would accept it. Results are cached, so a following /split
+    doesn't resolve the video again.
+    """
+    try:
+        section = validate_section(start, end)
+        if interval is not None:
+            interval = validate_interval(interval)
+        info = probe(url)
+    except SplitError as e:
+        return JSONResponse(e.payload, status_code=e.status_code)
+
+    result = summarize(info, section)
     try:
-        if path and os.path.exists(path):
-            os.remove(path)
-    except Exception:
-        pass
+        duration = check_duration(info, section)
+        result["allowed"] = True
+        if interval:
+            result["estimated_clips"] = math.ceil(duration / interval)
+    except SplitError as e:
+        result["allowed"] = False
+        result["error"] = e.payload["error"]
+    result["max_seconds"] = MAX_TOTAL_SECONDS
+    return result
 
 
-def ensure_ffmpeg_exists():
-    try:
-        subprocess.run(["ffmpeg", "-version"], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    except Exception:
-        raise RuntimeError("ffmpeg not found: install ffmpeg and ensure it's in PATH.")
+def content_disposition(filename: str) -> str:
+    # same rules as FileResponse
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
 
 
-# ---------- routes ----------
-@app.get("/", response_class=HTMLResponse)
-def home(request: Request):
-    return templates.TemplateResponse("index.html", {"request": request})
+def server_timing(timings: dict) -> dict:
+    """Server-Timing header (durations in ms) if SERVER_TIMING is enabled."""
+    if not SERVER_TIMING:
+        return {}
+    return {"Server-Timing": ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())}
 
 
 @app.get("/split")
@@ -218,142 +200,344 @@ def split_video(
     url: str = Query(..., description="YouTube video URL"),
     interval: float = Query(..., description="Interval in seconds"),
     base_name: str = Query("clip", description="Base name for split clips"),
-    background_tasks: BackgroundTasks = None
+    start: float = Query(None, description="Only split from this many seconds into the video"),
+    end: float = Query(None, description="Only split up to this many seconds into the video"),
+    accurate: bool = Query(False, description="Frame-accurate cuts (re-encodes the start of each clip)"),
+    output: str = Query("zip", description="'zip' for one archive, 'manifest' for a JSON list of clip URLs"),
+    mode: str = Query("interval", description="'interval' to cut every interval, 'smart' to cut on pauses near it"),
+    stream: bool = Query(False, description="Split while downloading, without storing the video"),
 ):
     """
-    Download a video (using yt-dlp), split it into clips of `interval` seconds,
-    zip them, return the zip file and schedule background cleanup.
+    Download a video (using yt-dlp), split it into clips of `interval` seconds and
+    stream back a ZIP of them. With `start`/`end` only that part of the video is
+    downloaded and split. With `mode=smart` each cut moves, by up to a quarter of
+    the interval, to a pause in the audio. Each clip goes out as soon as ffmpeg finishes it.
+    With `stream=true` ffmpeg cuts the video while it downloads and it is never stored,
+    so the first clips arrive before the download is done (not with accurate or mode=smart).
+    With `output=manifest` the clips are kept on the server instead and a JSON list
+    of them (name, start, duration, size, url) is returned; fetch them from /clips,
+    or all of them as one ZIP from its zip_url.
+    GET /split/events with the same parameters streams the progress.
+    Concurrent identical requests share one pipeline and the finished archive is
+    kept for ARTIFACT_TTL seconds for late arrivals (see singleflight.py).
     - Optionally set YT_COOKIES env var to point to a cookies.txt file to bypass sign-in prompts.
+    - For long videos prefer POST /jobs, which doesn't hold the connection open.
+    - With SERVER_TIMING=1 the response carries a Server-Timing header.
     """
     # Basic validation
     try:
-        interval = float(interval)
-        if interval <= 0:
-            return JSONResponse({"error": "interval must be positive"}, status_code=400)
-    except Exception:
-        return JSONResponse({"error": "invalid interval"}, status_code=400)
+        interval = validate_interval(interval)
+        section = validate_section(start, end)
+        mode = validate_mode(mode)
+        validate_stream(stream, accurate, mode)
+    except SplitError as e:
+        return JSONResponse(e.payload, status_code=e.status_code)
+    if output not in ("zip", "manifest"):
+        return JSONResponse({"error": "output must be 'zip' or 'manifest'"}, status_code=400)
+
+    # Ensure ffmpeg is present (detected once per process)
+    try:
+        ensure_ffmpeg_exists()
+    except RuntimeError as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+    # Identical requests share one pipeline: key on the resolved video, not the URL text.
+    timings = {}
+    started = time.monotonic()
+    try:
+        info = probe(url)
+    except SplitError as e:
+        return JSONResponse(e.payload, status_code=e.status_code)
+    timings["probe"] = time.monotonic() - started
+    key = split_key(info, interval, base_name, section, accurate, output, mode, stream)
+
+    def produce(f):
+        with progress.Reporter(key) as reporter:
+            if output == "manifest":
+                write_manifest(f, url, interval, base_name, singleflight.files_dir(key),
+                               lambda name: f"/clips/{key}/{quote(name)}", section, accurate,
+                               reporter.stage, reporter.progress, mode, stream)
+            else:
+                write_split_job(f, url, interval, base_name, section, accurate, reporter.stage, reporter.progress,
+                                mode, stream)
+
+    started = time.monotonic()
+    try:
+        # waits for the first bytes, so download errors are still reported as JSON
+        body = singleflight.join(key, produce)
+        if output == "manifest":
+            manifest = json.loads(b"".join(body))
+            manifest["zip_url"] = f"/clips/{key}.zip"
+            timings["split"] = time.monotonic() - started
+            return JSONResponse(manifest, headers=server_timing(timings))
+    except FlightError as e:
+        return JSONResponse(e.payload, status_code=e.status_code)
+    timings["wait"] = time.monotonic() - started
+
+    zip_name = f"{base_name}_{key[:12]}.zip"
+    headers = {"Content-Disposition": content_disposition(zip_name), **server_timing(timings)}
+    return StreamingResponse(body, media_type="application/zip", headers=headers)
+
+
+EVENT_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
 
-    # Ensure ffmpeg is present
+@app.get("/split/events")
+def split_events(
+    url: str = Query(..., description="YouTube video URL"),
+    interval: float = Query(..., description="Interval in seconds"),
+    base_name: str = Query("clip", description="Base name for split clips"),
+    start: float = Query(None, description="Only split from this many seconds into the video"),
+    end: float = Query(None, description="Only split up to this many seconds into the video"),
+    accurate: bool = Query(False, description="Frame-accurate cuts (re-encodes the start of each clip)"),
+    output: str = Query("zip", description="'zip' for one archive, 'manifest' for a JSON list of clip URLs"),
+    mode: str = Query("interval", description="'interval' to cut every interval, 'smart' to cut on pauses near it"),
+    stream: bool = Query(False, description="Split while downloading, without storing the video"),
+):
+    """
+    Server-sent events with the progress of the /split request with the same
+    parameters (open it alongside, or before, the /split request): the stage,
+    download progress from yt-dlp and the position of ffmpeg in the source,
+    then `done` or `failed`. See progress.py for the event data.
+    """
     try:
+        interval = validate_interval(interval)
+        section = validate_section(start, end)
+        mode = validate_mode(mode)
+        validate_stream(stream, accurate, mode)
+        if output not in ("zip", "manifest"):
+            raise SplitError({"error": "output must be 'zip' or 'manifest'"}, 400)
+        info = probe(url)
+    except SplitError as e:
+        return JSONResponse(e.payload, status_code=e.status_code)
+    key = split_key(info, interval, base_name, section, accurate, output, mode, stream)
+    if not singleflight.touch(key):
+        # a finished run whose output is gone: the next /split runs it again
+        progress.forget(key)
+    return StreamingResponse(progress.events(key), media_type="text/event-stream", headers=EVENT_HEADERS)
+
+
+# ---------- batches ----------
+class BatchSplit(BaseModel):
+    urls: List[str]
+    interval: float
+    base_name: str = "clip"
+    start: Optional[float] = None
+    end: Optional[float] = None
+    accurate: bool = False
+    output: str = "zip"
+    mode: str = "interval"
+
+
+def batch_key(request: BatchSplit, interval: float, section) -> str:
+    """Batches are coalesced on the URLs as given: expanding playlists is part of the run."""
+    return singleflight.flight_key("batch", json.dumps(request.urls), repr(float(interval)), section, request.accurate,
+                                   request.base_name, request.output, request.mode)
+
+
+def validate_batch(request: BatchSplit):
+    """(interval, section) of a batch request; raises SplitError if it is invalid."""
+    interval = validate_interval(request.interval)
+    section = validate_section(request.start, request.end)
+    if not request.urls:
+        raise SplitError({"error": "urls must not be empty"}, 400)
+    if request.output not in ("zip", "manifest"):
+        raise SplitError({"error": "output must be 'zip' or 'manifest'"}, 400)
+    validate_mode(request.mode)
+    return interval, section
+
+
+@app.post("/batch")
+def split_batch(request: BatchSplit):
+    """
+    Split many videos into one output: `urls` can mix videos, playlists and
+    channels (expanded, up to BATCH_MAX_VIDEOS videos). The next video downloads
+    while the current one is split (see batch.py). Streams back one ZIP of all
+    clips plus batch.json, the per-video summary; with `output=manifest` returns
+    the JSON manifest per video instead. Videos that fail are reported in the
+    summary and skipped. POST the same body to /batch/events for the progress.
+    """
+    try:
+        interval, section = validate_batch(request)
         ensure_ffmpeg_exists()
+    except SplitError as e:
+        return JSONResponse(e.payload, status_code=e.status_code)
     except RuntimeError as e:
         return JSONResponse({"error": str(e)}, status_code=500)
 
-    # Work inside a temporary directory to avoid clashing files
-    workdir = tempfile.mkdtemp(prefix="ytsplit_")
+    key = batch_key(request, interval, section)
+
+    def produce(f):
+        with progress.Reporter(key) as reporter:
+            reporter.stage("expanding")
+            videos = batch.expand(request.urls)
+            reporter.stage("running")
+            if request.output == "manifest":
+                batch.write_batch_manifest(f, videos, interval, request.base_name, singleflight.files_dir(key),
+                                           lambda name: f"/clips/{key}/{quote(name)}", section, request.accurate,
+                                           reporter.progress, request.mode)
+            else:
+                batch.write_batch_job(f, videos, interval, request.base_name, section, request.accurate,
+                                      reporter.progress, request.mode)
+
     try:
-        # Prepare yt-dlp options
-        out_template = os.path.join(workdir, "%(title)s.%(ext)s")
-        cookiefile = os.environ.get("YT_COOKIES")  # if set, path to cookies.txt on server
-        ydl_opts = {
-            "outtmpl": out_template,
-            "format": "mp4/best",
-            "noplaylist": True,
-            "quiet": True,
-            "no_warnings": True,
-            # retry/pacing options to reduce 429
-            "retries": 10,
-            "sleep_interval_requests": 2,
-            "sleep_interval": 1,
-            # set a common browser UA to look like a browser
-            "http_headers": {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115 Safari/537.36"
-            }
+        body = singleflight.join(key, produce)
+        if request.output == "manifest":
+            return JSONResponse(json.loads(b"".join(body)))
+    except FlightError as e:
+        return JSONResponse(e.payload, status_code=e.status_code)
+
+    zip_name = f"{request.base_name}_batch_{key[:12]}.zip"
+    return StreamingResponse(body, media_type="application/zip",
+                             headers={"Content-Disposition": content_disposition(zip_name)})
+
+
+@app.post("/batch/events")
+def batch_events(request: BatchSplit):
+    """Server-sent events with the progress of the /batch request with the same body, like /split/events."""
+    try:
+        interval, section = validate_batch(request)
+    except SplitError as e:
+        return JSONResponse(e.payload, status_code=e.status_code)
+    key = batch_key(request, interval, section)
+    if not singleflight.touch(key):
+        progress.forget(key)
+    return StreamingResponse(progress.events(key), media_type="text/event-stream", headers=EVENT_HEADERS)
+
+
+# ---------- clips ----------
+FLIGHT_KEY_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+@app.get("/clips/{key}/{name}")
+def get_clip(key: str, name: str, request: Request):
+    """
+    One clip of a manifest from /split?output=manifest. Supports Range/If-Range
+    (resumes, parallel fetches) and ETag/If-None-Match. Fetching a clip keeps the
+    manifest's clips for another ARTIFACT_TTL seconds.
+    """
+    if not FLIGHT_KEY_RE.match(key) or name != os.path.basename(name) or name.startswith("."):
+        return JSONResponse({"error": "clip not found"}, status_code=404)
+    path = os.path.join(singleflight.files_dir(key), name)
+    if not singleflight.touch(key) or not os.path.isfile(path):
+        return JSONResponse({"error": "clip not found or expired"}, status_code=404)
+
+    response = FileResponse(path, media_type="video/mp4", filename=name, stat_result=os.stat(path),
+                            content_disposition_type="inline")
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, response.headers["etag"]):
+        return Response(status_code=304, headers={"ETag": response.headers["etag"]})
+    return response
+
+
+@app.get("/clips/{key}.zip")
+def get_clips_zip(key: str):
+    """
+    All clips of a manifest from /split?output=manifest as one STORED ZIP, read
+    from the clips already on the server instead of splitting the video again.
+    """
+    path = singleflight.finished_output(key) if FLIGHT_KEY_RE.match(key) else None
+    if path is None or not singleflight.touch(key):
+        return JSONResponse({"error": "clips not found or expired"}, status_code=404)
+    with open(path, "rb") as f:
+        names = [clip["name"] for clip in json.load(f)["clips"]]
+    clip_dir = singleflight.files_dir(key)
+    if not all(os.path.isfile(os.path.join(clip_dir, name)) for name in names):
+        return JSONResponse({"error": "clips not found or expired"}, status_code=404)
+
+    def body():
+        zs = ZipStream()
+        for name in names:
+            yield from zs.add_file(os.path.join(clip_dir, name), name)
+        yield zs.finish()
+
+    zip_name = f"clips_{key[:12]}.zip"
+    return StreamingResponse(body(), media_type="application/zip",
+                             headers={"Content-Disposition": content_disposition(zip_name)})
+
+
+# ---------- jobs ----------
+class SplitJob(BaseModel):
+    url: str
+    interval: float
+    base_name: str = "clip"
+    start: Optional[float] = None
+    end: Optional[float] = None
+    accurate: bool = False
+    mode: str = "interval"
+    stream: bool = False
+
+
+def job_status(job: dict) -> dict:
+    status = {
+        "id": job["id"],
+        "status": job["status"],
+        "stage": job["stage"],
+        "created": job["created"],
+        "updated": job["updated"],
+    }
+    if job["status"] == "queued":
+        status["queue_position"] = jobs.queue_position(job["id"])
+    if job["status"] == "done":
+        status["result"] = {
+            "filename": job["result"]["filename"],
+            "download_url": f"/jobs/{job['id']}/download",
         }
-        if cookiefile and os.path.exists(cookiefile):
-            ydl_opts["cookiefile"] = cookiefile
-
-        # Try extraction with retries (yt-dlp has internal retries too)
-        extraction_error = None
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            try:
-                info = ydl.extract_info(url, download=True)
-            except yt_dlp.utils.DownloadError as de:
-                extraction_error = str(de)
-                # If yt-dlp says "Sign in to confirm..." return helpful guidance
-                if "sign in to confirm" in extraction_error.lower() or "cookies" in extraction_error.lower():
-                    guidance = (
-                        "YouTube requires authentication (sign-in or cookies). "
-                        "Set environment variable YT_COOKIES to a cookies.txt file (Netscape format) or upload cookies and restart the service. "
-                        "See: https://github.com/yt-dlp/yt-dlp/wiki/FAQ#how-do-i-pass-cookies-to-yt-dlp"
-                    )
-                    return JSONResponse({"error": extraction_error, "guidance": guidance}, status_code=403)
-                return JSONResponse({"error": extraction_error}, status_code=500)
-            except Exception as e:
-                import traceback
-                traceback.print_exc()
-                return JSONResponse({"error": str(e)}, status_code=500)
-
-            # prepare filename while ydl is available
-            try:
-                full_filepath = ydl.prepare_filename(info)
-            except Exception:
-                # fallback to info fields
-                title = info.get("title", uuid.uuid4().hex)
-                ext = info.get("ext", "mp4")
-                full_filepath = os.path.join(workdir, f"{title}.{ext}")
-
-        # Confirm file exists
-        if not os.path.exists(full_filepath):
-            return JSONResponse({"error": "downloaded file not found", "path": full_filepath}, status_code=500)
-
-        duration = info.get("duration")
-        if not duration:
-            return JSONResponse({"error": "Cannot determine video duration"}, status_code=500)
-
-        # Protect server from extremely large videos
-        MAX_TOTAL_SECONDS = 60 * 60 * 3  # 3 hours cap
-        if duration > MAX_TOTAL_SECONDS:
-            return JSONResponse({"error": f"Video duration {duration}s exceeds server limit ({MAX_TOTAL_SECONDS}s)."}, status_code=400)
-
-        # Split into clips
-        clip_paths = []
-        num_clips = math.ceil(duration / interval)
-        for i in range(num_clips):
-            start = i * interval
-            end = min((i + 1) * interval, duration)
-            clip_name = f"{base_name}{i}.mp4"
-            clip_path = os.path.join(workdir, clip_name)
-
-            # Use -ss and -to with input; -y to overwrite
-            cmd = [
-                "ffmpeg",
-                "-y",
-                "-ss", str(start),
-                "-to", str(end),
-                "-i", full_filepath,
-                "-c", "copy",
-                clip_path
-            ]
-            subprocess.run(cmd, check=True)
-            clip_paths.append(clip_path)
-
-        # Create ZIP in DOWNLOAD_FOLDER
-        zip_filename = os.path.join(DOWNLOAD_FOLDER, f"{base_name}_{uuid.uuid4().hex}.zip")
-        with zipfile.ZipFile(zip_filename, "w", compression=zipfile.ZIP_DEFLATED) as zipf:
-            for clip in clip_paths:
-                zipf.write(clip, os.path.basename(clip))
-
-        # Schedule cleanup tasks (zip + temporary workdir)
-        if background_tasks:
-            background_tasks.add_task(cleanup_file, zip_filename)
-            background_tasks.add_task(shutil.rmtree, workdir, True)
-        else:
-            # if BackgroundTasks not provided, try best-effort immediate cleanup after a short delay
-            # (not ideal for large files; recommend letting FastAPI inject BackgroundTasks)
-            time.sleep(1)
-            shutil.rmtree(workdir, ignore_errors=True)
-
-        return FileResponse(zip_filename, media_type="application/zip", filename=os.path.basename(zip_filename), background=background_tasks)
-
-    except subprocess.CalledProcessError as e:
-        
-        traceback.print_exc()
-        # ffmpeg failed
-        shutil.rmtree(workdir, ignore_errors=True)
-        return JSONResponse({"error": "ffmpeg processing failed", "details": str(e)}, status_code=500)
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        shutil.rmtree(workdir, ignore_errors=True)
-        return JSONResponse({"error": "unexpected error", "details": str(e)}, status_code=500)
+    if job["status"] == "failed":
+        status["error"] = job["error"]
+        status["status_code"] = job["status_code"]
+    return status
+
+
+@app.post("/jobs", status_code=202)
+def create_job(job: SplitJob):
+    """
+    Queue a split and return immediately with the job id.
+    Poll GET /jobs/{id} for the stage and result, or follow GET /jobs/{id}/events.
+    """
+    try:
+        interval = validate_interval(job.interval)
+        section = validate_section(job.start, job.end)
+        mode = validate_mode(job.mode)
+        validate_stream(job.stream, job.accurate, mode)
+    except SplitError as e:
+        return JSONResponse(e.payload, status_code=e.status_code)
+
+    job_id = jobs.submit({"url": job.url, "interval": interval, "base_name": job.base_name, "section": section,
+                          "accurate": job.accurate, "mode": mode, "stream": job.stream})
+    return JSONResponse(job_status(jobs.get_job(job_id)), status_code=202, headers={"Location": f"/jobs/{job_id}"})
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = jobs.get_job(job_id)
+    if job is None:
+        return JSONResponse({"error": "job not found"}, status_code=404)
+    return job_status(job)
+
+
+@app.get("/jobs/{job_id}/events")
+def job_events(job_id: str):
+    """Server-sent events with the progress of a job, like /split/events."""
+    if jobs.get_job(job_id) is None:
+        return JSONResponse({"error": "job not found"}, status_code=404)
+    return StreamingResponse(progress.events(jobs.progress_key(job_id)), media_type="text/event-stream",
+                             headers=EVENT_HEADERS)
+
+
+@app.get("/jobs/{job_id}/download")
+def download_job(job_id: str):
+    job = jobs.get_job(job_id)
+    if job is None:
+        return JSONResponse({"error": "job not found"}, status_code=404)
+    if job["status"] != "done":
+        return JSONResponse({"error": f"job is {job['status']}", "stage": job["stage"]}, status_code=409)
+    path = job["result"]["path"]
+    if not os.path.exists(path):
+        return JSONResponse({"error": "job result expired"}, status_code=410)
+    return FileResponse(path, media_type="application/zip", filename=job["result"]["filename"])
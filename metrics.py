@@ -0,0 +1,260 @@
+# metrics.py
+"""
+Counters and histograms of where the time goes, exported in the Prometheus text
+format on /metrics.
+
+Requests, coalesced flights and job workers run in different processes, so the
+values live in sqlite under STATE_DIR (like the job queue and the caches) and
+/metrics reports the totals of every process on the host. Updates are added up
+in memory and written in one transaction every METRICS_FLUSH_INTERVAL seconds
+(and by the process rendering /metrics, and at exit), so recording one costs no
+sqlite write; other processes' last few seconds show up on the next scrape.
+
+Metrics are declared in METRICS below; inc() and observe() update them, timed()
+and StageTimer time code into histograms, MetricsMiddleware measures every
+response (duration until the last byte went out, bytes sent).
+"""
+
+import atexit
+import math
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from config import STATE_DIR, METRICS_FLUSH_INTERVAL
+
+METRICS_DB = os.path.join(STATE_DIR, "metrics.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    name TEXT NOT NULL,
+    labels TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (name, labels)
+);
+"""
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# name -> (type, help, buckets)
+METRICS = {
+    "cutter_stage_seconds": (
+        "histogram", "Time spent in each pipeline stage (probing, downloading, analyzing, splitting, streaming).",
+        SECONDS_BUCKETS),
+    "cutter_download_seconds": ("histogram", "yt-dlp download time of a source video.", SECONDS_BUCKETS),
+    "cutter_download_bytes_total": ("counter", "Bytes of source video downloaded by yt-dlp.", None),
+    "cutter_download_wait_seconds": (
+        "histogram", "Time yt-dlp requests waited for their origin's rate limit and a download slot.", SECONDS_BUCKETS),
+    "cutter_rate_limited_total": ("counter", "HTTP 429 responses from an origin.", None),
+    "cutter_cookie_requests_total": (
+        "counter", "yt-dlp requests by cookie pool identity and outcome (ok, rate_limited, auth, error).", None),
+    "cutter_clip_seconds": ("histogram", "Wall time waiting for ffmpeg to produce each clip, by cut mode.", SECONDS_BUCKETS),
+    "cutter_zip_seconds": ("histogram", "Time spent writing the ZIP archive of a split.", SECONDS_BUCKETS),
+    "cutter_job_queue_wait_seconds": ("histogram", "Time jobs spent queued before a worker claimed them.", SECONDS_BUCKETS),
+    "cutter_cache_requests_total": (
+        "counter", "Cache lookups by cache (source, info, artifact, ydl) and result (hit, shared, miss).", None),
+    "cutter_workspace_wait_seconds": ("histogram", "Time splits waited for scratch space, by place.", SECONDS_BUCKETS),
+    "cutter_workspace_refused_total": ("counter", "Splits refused for lack of scratch space, by place.", None),
+    "cutter_workspace_reclaimed_bytes_total": (
+        "counter", "Bytes the workspace janitor removed, by reason (stale reservation, orphan).", None),
+    "cutter_startup_seconds": (
+        "histogram", "Worker startup time by phase (toolchain, yt_dlp) and until ready (total).", SECONDS_BUCKETS),
+    "cutter_response_seconds": ("histogram", "Time until the last byte of a response was sent, by route.", SECONDS_BUCKETS),
+    "cutter_sent_bytes_total": ("counter", "Response body bytes sent, by route.", None),
+}
+
+
+def connect():
+    conn = sqlite3.connect(METRICS_DB, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
+
+
+def init_db():
+    conn = connect()
+    try:
+        conn.executescript(SCHEMA)
+    finally:
+        conn.close()
+
+
+def _labels(labels: dict) -> str:
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return ",".join(f'{k}="{escape(v)}"' for k, v in sorted(labels.items()))
+
+
+# ---------- buffered updates ----------
+# (name, labels) -> amount not written yet, and the pid whose flusher thread writes it
+_pending = {}
+_pending_lock = threading.Lock()
+_flusher_pid = None
+
+
+def _add(rows):
+    """Add (name, labels, amount) rows to the samples; they are written by flush()."""
+    global _flusher_pid
+    with _pending_lock:
+        for name, labels, amount in rows:
+            _pending[name, labels] = _pending.get((name, labels), 0) + amount
+        if _flusher_pid != os.getpid():
+            # a forked child doesn't inherit the thread
+            _flusher_pid = os.getpid()
+            threading.Thread(target=_flush_loop, name="metrics-flush", daemon=True).start()
+
+
+def flush():
+    """Write the buffered updates in one transaction. Metrics must never break a request."""
+    with _pending_lock:
+        rows = [(name, labels, amount) for (name, labels), amount in _pending.items()]
+        _pending.clear()
+    if not rows:
+        return
+    try:
+        conn = connect()
+        try:
+            conn.execute("BEGIN")
+            conn.executemany(
+                "INSERT INTO samples (name, labels, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (name, labels) DO UPDATE SET value = value + excluded.value",
+                rows,
+            )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"metrics: could not record {len(rows)} samples, keeping them for the next flush: {e}")
+        _add(rows)
+
+
+def _flush_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        flush()
+
+
+def inc(name: str, amount: float = 1, **labels):
+    """Add `amount` to a counter."""
+    _add([(name, _labels(labels), amount)])
+
+
+def observe(name: str, value: float, **labels):
+    """Record one observation in a histogram."""
+    buckets = METRICS[name][2]
+    rows = [(f"{name}_bucket", _labels({**labels, "le": f"{le:g}"}), 1) for le in buckets if value <= le]
+    rows += [
+        (f"{name}_bucket", _labels({**labels, "le": "+Inf"}), 1),
+        (f"{name}_sum", _labels(labels), value),
+        (f"{name}_count", _labels(labels), 1),
+    ]
+    _add(rows)
+
+
+@contextmanager
+def timed(name: str, **labels):
+    """Observe the time the block takes (also when it raises)."""
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        observe(name, time.monotonic() - started, **labels)
+
+
+class StageTimer:
+    """
+    `on_stage` callback for the pipeline that times each stage into
+    cutter_stage_seconds and passes the stage on to `on_stage`.
+    """
+
+    def __init__(self, on_stage=None):
+        self.on_stage = on_stage
+        self._stage = None
+        self._started = None
+
+    def __call__(self, name: str):
+        self.finish()
+        self._stage, self._started = name, time.monotonic()
+        if self.on_stage:
+            self.on_stage(name)
+
+    def finish(self):
+        """End the current stage (call once the last stage is done)."""
+        if self._stage is not None:
+            observe("cutter_stage_seconds", time.monotonic() - self._started, stage=self._stage)
+            self._stage = None
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    flush()
+    conn = connect()
+    try:
+        rows = conn.execute("SELECT name, labels, value FROM samples ORDER BY name, labels").fetchall()
+    finally:
+        conn.close()
+    samples = {}
+    for name, labels, value in rows:
+        samples.setdefault(name, []).append((labels, value))
+
+    def bucket_order(sample):
+        # group by the other labels, then buckets in increasing order
+        labels = sample[0].split(",")
+        le = next((label[4:-1] for label in labels if label.startswith("le=")), "+Inf")
+        rest = ",".join(label for label in labels if not label.startswith("le="))
+        return rest, float(le)
+
+    lines = []
+    for name, (kind, help_text, _) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        series = [name] if kind == "counter" else [f"{name}_bucket", f"{name}_sum", f"{name}_count"]
+        for series_name in series:
+            series_samples = samples.get(series_name, [])
+            if series_name.endswith("_bucket"):
+                series_samples.sort(key=bucket_order)
+            for labels, value in series_samples:
+                value = int(value) if value.is_integer() and not math.isinf(value) else value
+                lines.append(f"{series_name}{{{labels}}} {value}" if labels else f"{series_name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def _route_label(scope) -> str:
+    route = scope.get("route")
+    return getattr(route, "path", None) or "other"
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording cutter_response_seconds and cutter_sent_bytes_total per route."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.monotonic()
+        sent = 0
+
+        async def counting_send(message):
+            nonlocal sent
+            if message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, counting_send)
+        finally:
+            route = _route_label(scope)
+            elapsed = time.monotonic() - started
+
+            # buffered, no sqlite write on the event loop
+            observe("cutter_response_seconds", elapsed, route=route)
+            inc("cutter_sent_bytes_total", sent, route=route)
+
+
+init_db()
+atexit.register(flush)
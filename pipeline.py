@@ -0,0 +1,801 @@
+# pipeline.py
+"""
+The download -> split -> zip pipeline behind /split and /jobs.
+
+Clips are zipped (STORED, see zipstream.py) while ffmpeg is still producing them
+and deleted as soon as they are in the archive. With `stream` the source is not
+stored at all: ffmpeg segments it while it downloads (see stream_input). In manifest mode the clips are
+kept instead and a JSON list of them is written, so clients fetch only the clips
+they want.
+
+Progress is reported through two optional callbacks: `on_stage(name)` when the
+pipeline moves between stages and `on_progress(update)` with download progress
+({"download": {...}}) and splitting progress ({"split": {...}}); see progress.py.
+
+Failures that should reach the client are raised as SplitError, which carries the
+JSON payload and HTTP status code the route returns.
+"""
+
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from contextlib import ExitStack, contextmanager
+
+import cookie_pool
+import info_cache
+import metrics
+import scheduler
+import singleflight
+import source_cache
+import toolchain
+import workspace
+import ydl_pool
+from config import DOWNLOAD_FOLDER, MAX_TOTAL_SECONDS, SOURCE_CACHE_DIR, USER_AGENT, WORKSPACE_BYTES_PER_SECOND
+from keyframes import keyframe_index, stream_offsets
+from smartcuts import smart_cut_points
+from splitter import cut_points, iter_accurate_segments, iter_segments, iter_stream_segments
+from zipstream import ZipStream
+
+
+class SplitError(Exception):
+    def __init__(self, payload: dict, status_code: int = 500):
+        super().__init__(payload.get("error"))
+        self.payload = payload
+        self.status_code = status_code
+
+
+# ---------- helpers ----------
+def cleanup_file(path: str):
+    try:
+        if path and os.path.exists(path):
+            os.remove(path)
+    except Exception:
+        pass
+
+
+@contextmanager
+def reserved(cm):
+    """Enter workspace.reserve()/workdir() `cm`, reporting a full workspace as SplitError (507)."""
+    with ExitStack() as stack:
+        try:
+            value = stack.enter_context(cm)
+        except workspace.WorkspaceFull as e:
+            guidance = (
+                "The server is out of scratch disk space for now. Try again later, "
+                "or use POST /jobs, which waits for space instead."
+            )
+            raise SplitError({"error": str(e), "guidance": guidance, "retry_after": e.retry_after}, 507)
+        yield value
+
+
+def ensure_ffmpeg_exists():
+    # detected once per process, see toolchain.py
+    toolchain.require()
+
+
+def validate_interval(interval) -> float:
+    try:
+        interval = float(interval)
+    except Exception:
+        raise SplitError({"error": "invalid interval"}, 400)
+    if not math.isfinite(interval):  # NaN would pass the check below
+        raise SplitError({"error": "invalid interval"}, 400)
+    if interval <= 0:
+        raise SplitError({"error": "interval must be positive"}, 400)
+    return interval
+
+
+MODES = ("interval", "smart")
+
+
+def validate_mode(mode: str) -> str:
+    """'interval' (a cut every `interval` seconds) or 'smart' (near every `interval`, on a pause; see smartcuts.py)."""
+    if mode not in MODES:
+        raise SplitError({"error": f"mode must be one of {', '.join(MODES)}"}, 400)
+    return mode
+
+
+def validate_stream(stream: bool, accurate: bool = False, mode: str = "interval"):
+    """Streaming reads the source once, front to back: frame-accurate and smart cuts need all of it first."""
+    if stream and (accurate or mode != "interval"):
+        raise SplitError({"error": "stream can't be combined with accurate or mode=smart"}, 400)
+
+
+def validate_section(start=None, end=None):
+    """Validate optional start/end (seconds). Returns (start, end) or None for the whole video."""
+    if start is None and end is None:
+        return None
+    start = float(start or 0)
+    end = float(end) if end is not None else float("inf")
+    # an open end is inf already (the end of the video); NaN compares false with everything
+    if not math.isfinite(start) or math.isnan(end):
+        raise SplitError({"error": "start and end must be numbers of seconds"}, 400)
+    if start < 0:
+        raise SplitError({"error": "start must not be negative"}, 400)
+    if end <= start:
+        raise SplitError({"error": "end must be greater than start"}, 400)
+    return start, end
+
+
+# ---------- stages ----------
+SOURCE_FORMAT = "mp4/best"
+
+
+def _retry_sleep(attempt: int) -> float:
+    # exponential backoff instead of fixed sleeps between yt-dlp's own retries
+    return min(2 ** attempt, 30)
+
+
+# pooled YoutubeDLs keep their progress hooks, so the hook reports to whatever
+# download runs in the calling thread
+_download_progress = threading.local()
+
+
+def _progress_hook(d: dict):
+    callback = getattr(_download_progress, "callback", None)
+    if callback is not None:
+        callback(d)
+
+
+def _ydl_opts(identity=None) -> dict:
+    """Options of the YoutubeDL instances pooled for `identity` (see ydl_pool.py)."""
+    ydl_opts = {
+        "format": SOURCE_FORMAT,
+        "progress_hooks": [_progress_hook],
+        "noplaylist": True,
+        "quiet": True,
+        "no_warnings": True,
+        # 429s are paced and retried by scheduler.py; these retries are for network errors
+        "retries": 3,
+        "fragment_retries": 3,
+        "retry_sleep_functions": {"http": _retry_sleep, "fragment": _retry_sleep},
+        "http_headers": {
+            "User-Agent": USER_AGENT
+        },
+        # relative to the "home" path each download sets, see _call_opts
+        "outtmpl": "%(id)s.%(ext)s",
+    }
+    if identity is not None:
+        # cookies from the pool (YT_COOKIES is part of it), as an in-memory stream
+        ydl_opts["cookiefile"] = identity.cookiefile()
+    return ydl_opts
+
+
+def _call_opts(out_dir: str = None, section=None, playlist_end: int = None) -> dict:
+    """
+    Options of a single call, set on a pooled YoutubeDL for its duration.
+    With `playlist_end` playlists are listed (up to that many entries) instead of resolved.
+    """
+    opts = {}
+    if playlist_end:
+        opts.update({"noplaylist": False, "extract_flat": "in_playlist", "playlistend": playlist_end})
+    if out_dir:
+        opts["paths"] = {"home": out_dir}
+    if section:
+        from yt_dlp.utils import download_range_func
+
+        # only fetch the requested time range, stream copied: it starts on the keyframe
+        # before `start` (force_keyframes_at_cuts would re-encode all of it; see splitter.py)
+        opts["download_ranges"] = download_range_func(None, [section])
+    return opts
+
+
+def _ydl(identity=None, out_dir: str = None, section=None, playlist_end: int = None):
+    """Lease a warm YoutubeDL for requests made as `identity` (None: without cookies)."""
+    key = (identity.name, identity.text) if identity is not None else None
+    return ydl_pool.lease(key, lambda: _ydl_opts(identity), _call_opts(out_dir, section, playlist_end))
+
+
+def _rate_limited(e: scheduler.RateLimited) -> SplitError:
+    guidance = (
+        "The video site is rate limiting this server (HTTP 429). Try again later; "
+        "adding cookies of more accounts to the cookie pool (see cookie.py) spreads the load."
+    )
+    return SplitError({"error": str(e), "guidance": guidance, "retry_after": round(e.retry_after)}, 429)
+
+
+def _ydl_call(url: str, action, out_dir: str = None, section=None, is_download: bool = False,
+              playlist_end: int = None):
+    """
+    Run `action(ydl)` with a YoutubeDL for `url` through the download scheduler
+    (pacing, 429 backoff, download slots), as an identity from the cookie pool,
+    turning its failures into SplitError.
+    """
+    from yt_dlp.utils import DownloadError
+
+    def attempt(identity):
+        with _ydl(identity, out_dir, section, playlist_end) as ydl:
+            return action(ydl)
+
+    try:
+        return scheduler.run(url, attempt, is_download=is_download, lease=cookie_pool.lease)
+    except scheduler.RateLimited as e:
+        raise _rate_limited(e)
+    except DownloadError as de:
+        extraction_error = str(de)
+        # If yt-dlp says "Sign in to confirm..." return helpful guidance
+        if "sign in to confirm" in extraction_error.lower() or "cookies" in extraction_error.lower():
+            guidance = (
+                "YouTube requires authentication (sign-in or cookies). "
+                "Add a cookies.txt file (Netscape format) to the cookie pool with cookie.py --pool, or set YT_COOKIES to one. "
+                "See: https://github.com/yt-dlp/yt-dlp/wiki/FAQ#how-do-i-pass-cookies-to-yt-dlp"
+            )
+            raise SplitError({"error": extraction_error, "guidance": guidance}, 403)
+        raise SplitError({"error": extraction_error}, 500)
+    except Exception as e:
+        traceback.print_exc()
+        raise SplitError({"error": str(e)}, 500)
+
+
+def warm_up():
+    """
+    Import yt-dlp and put a YoutubeDL with the YouTube extractor loaded in the pool
+    for every cookie pool identity (and for requests without one), so the first
+    requests of a new worker don't pay for it.
+    """
+    for identity in [None, *cookie_pool.identities()]:
+        with _ydl(identity) as ydl:
+            ydl.get_info_extractor("Youtube")
+
+
+def _section_key(section) -> str:
+    if not section:
+        return SOURCE_FORMAT
+    # exact: sections that only differ past a few digits are different downloads
+    return f"{SOURCE_FORMAT}@{float(section[0])!r}-{float(section[1])!r}"
+
+
+def probe(url: str) -> dict:
+    """
+    Metadata for `url` without downloading anything (extract_info(download=False)),
+    served from the info cache when possible. Raises SplitError like the download does.
+    """
+    info = info_cache.get(url)
+    metrics.inc("cutter_cache_requests_total", cache="info", result="miss" if info is None else "hit")
+    if info is None:
+        info = _ydl_call(url, lambda ydl: ydl.sanitize_info(ydl.extract_info(url, download=False)))
+        info_cache.put(url, info)
+    return info
+
+
+def expand_playlist(url: str, limit: int) -> list:
+    """
+    The video URLs behind `url`: the entries of a playlist or channel (at most
+    `limit` + 1, so callers can tell it was cut off), or just `url` for a single
+    video, whose info is cached for the probe that follows.
+    """
+    info = _ydl_call(url, lambda ydl: ydl.sanitize_info(ydl.extract_info(url, download=False)), playlist_end=limit + 1)
+    if info.get("_type") not in ("playlist", "multi_video"):
+        info_cache.put(url, info)
+        return [url]
+    urls = []
+    for entry in info.get("entries") or []:
+        entry_url = entry and (entry.get("url") or entry.get("webpage_url"))
+        if entry_url:
+            urls.append(entry_url)
+    return urls[:limit + 1]
+
+
+def estimate_filesize(info: dict, section=None):
+    """Best guess of the download size in bytes, or None if yt-dlp doesn't know."""
+    formats = info.get("requested_formats") or [info]
+    sizes = [f.get("filesize") or f.get("filesize_approx") for f in formats]
+    if not all(sizes):
+        return None
+    size = sum(sizes)
+    duration = info.get("duration")
+    if section and duration:
+        start, end = section
+        size = size * max(min(end, duration) - start, 0) / duration
+    return int(size)
+
+
+def estimate_bytes(info: dict, section=None) -> int:
+    """What to reserve for the source (and as much again for its clips): yt-dlp's estimate, else by duration."""
+    size = estimate_filesize(info, section)
+    if size is None:
+        duration = info.get("duration") or 0
+        if section:
+            duration = max(min(section[1], duration) - section[0], 0)
+        size = int(duration * WORKSPACE_BYTES_PER_SECOND)
+    return size
+
+
+def summarize(info: dict, section=None) -> dict:
+    """The parts of an info dict /probe returns."""
+    return {
+        "id": info.get("id"),
+        "extractor": info.get("extractor_key") or info.get("extractor"),
+        "title": info.get("title"),
+        "duration": info.get("duration"),
+        "thumbnail": info.get("thumbnail"),
+        "format_id": info.get("format_id"),
+        "filesize_estimate": estimate_filesize(info, section),
+        "formats": [
+            {
+                "format_id": f.get("format_id"),
+                "ext": f.get("ext"),
+                "resolution": f.get("resolution"),
+                "vcodec": f.get("vcodec"),
+                "acodec": f.get("acodec"),
+                "filesize": f.get("filesize") or f.get("filesize_approx"),
+            }
+            for f in info.get("formats") or []
+        ],
+    }
+
+
+@contextmanager
+def cached_source(url: str, section=None, info: dict = None, on_progress=None):
+    """
+    Yield (info, full_filepath) for `url`, downloading it with yt-dlp only if it is
+    not in the source cache yet. With `section` (start, end) only that range is
+    downloaded and the file plays from `start` (with a pre-roll from the keyframe
+    before it, see keyframes.source_preroll). Pass the `info` from probe() to skip
+    resolving the video again. `on_progress` gets yt-dlp's download progress.
+    The file must not be modified or deleted by the caller.
+    """
+    info = info or probe(url)
+    staging = []  # made by fetch(), on a miss
+    fetched = []
+
+    def report(d: dict):
+        if d.get("status") == "downloading":
+            on_progress({"download": {
+                "downloaded_bytes": d.get("downloaded_bytes"),
+                "total_bytes": d.get("total_bytes") or d.get("total_bytes_estimate"),
+                "speed": d.get("speed"),
+                "eta": d.get("eta"),
+            }})
+
+    def download(ydl):
+        # download from the probed info instead of extracting the video again
+        _download_progress.callback = report if on_progress else None
+        try:
+            downloaded = ydl.process_ie_result(info, download=True)
+        finally:
+            _download_progress.callback = None
+        # prepare filename while ydl is available
+        try:
+            requested = downloaded.get("requested_downloads") or [{}]
+            return requested[0].get("filepath") or ydl.prepare_filename(downloaded)
+        except Exception:
+            # fallback to info fields
+            return os.path.join(staging[0], f"{downloaded.get('id', uuid.uuid4().hex)}.{downloaded.get('ext', 'mp4')}")
+
+    def fetch():
+        fetched.append(True)
+        # the download is reserved until it is in the source cache, which has a budget of its own
+        with reserved(workspace.reserve(estimate_bytes(info, section))) as reservation:
+            staging.append(tempfile.mkdtemp(prefix="ytsrc_", dir=SOURCE_CACHE_DIR))
+            reservation.track(staging[0])
+            with metrics.timed("cutter_download_seconds"):
+                full_filepath = _ydl_call(url, download, staging[0], section, is_download=True)
+        # Confirm file exists
+        if not os.path.exists(full_filepath):
+            raise SplitError({"error": "downloaded file not found", "path": full_filepath}, 500)
+        metrics.inc("cutter_download_bytes_total", os.path.getsize(full_filepath))
+        return full_filepath
+
+    try:
+        fmt = _section_key(section)
+        key = source_cache.cache_key(info, fmt)
+        with source_cache.acquire(key, fetch, info, fmt) as full_filepath:
+            metrics.inc("cutter_cache_requests_total", cache="source", result="miss" if fetched else "hit")
+            yield info, full_filepath
+    finally:
+        for path in staging:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+# formats ffmpeg can read straight from their URL; anything else is piped through yt-dlp
+DIRECT_PROTOCOLS = ("http", "https", "m3u8", "m3u8_native")
+DOWNLOAD_EXIT_GRACE = 1.0  # seconds a failed yt-dlp gets to exit once ffmpeg gave up
+
+
+def _seek_args(section) -> list:
+    if not section:
+        return []
+    start, end = section
+    args = ["-ss", f"{start:.6f}"]
+    if end != float("inf"):
+        args += ["-t", f"{end - start:.6f}"]
+    return args
+
+
+def fetches_directly(info: dict) -> bool:
+    """Whether ffmpeg can read the probed format straight from its URL (else it is piped through yt-dlp)."""
+    return not info.get("requested_formats") and bool(info.get("url")) and info.get("protocol") in DIRECT_PROTOCOLS
+
+
+def _protocol_options(info: dict, identity) -> list:
+    """ffmpeg (and ffprobe) options to fetch the probed format's URL like yt-dlp would."""
+    args = []
+    if info.get("protocol") in ("http", "https"):
+        args += ["-reconnect", "1", "-reconnect_streamed", "1", "-reconnect_delay_max", "5"]
+    headers = info.get("http_headers") or {"User-Agent": USER_AGENT}
+    args += ["-headers", "".join(f"{name}: {value}\r\n" for name, value in headers.items())]
+    if identity is not None:
+        # the way yt-dlp hands cookies to ffmpeg when it downloads with it
+        with _ydl(identity) as ydl:
+            cookies = ydl.cookiejar.get_cookies_for_url(info["url"])
+        if cookies:
+            args += ["-cookies", "".join(f"{c.name}={c.value}; path={c.path}; domain={c.domain};\r\n"
+                                         for c in cookies)]
+    return args
+
+
+def _pipe_command(info: dict, identity, tmpdir: str) -> list:
+    """A yt-dlp process that downloads the probed video to its stdout."""
+    info_path = os.path.join(tmpdir, "info.json")
+    with open(info_path, "w", encoding="utf-8") as f:
+        json.dump(info, f)
+    cmd = [
+        sys.executable, "-m", "yt_dlp",
+        "--load-info-json", info_path,
+        "--format", SOURCE_FORMAT,
+        "--output", "-",
+        "--quiet", "--no-warnings", "--no-progress", "--no-cache-dir",
+        "--retries", "3",
+        "--fragment-retries", "3",
+        "--user-agent", USER_AGENT,
+    ]
+    if identity is not None:
+        cookie_path = os.path.join(tmpdir, "cookies.txt")
+        fd = os.open(cookie_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(identity.text)
+        cmd += ["--cookies", cookie_path]
+    return cmd
+
+
+def _end_download(downloader: subprocess.Popen, errors, grace: float = 0.0):
+    """
+    Stop the yt-dlp process of a stream once ffmpeg is done reading, giving it
+    `grace` seconds to exit on its own first; raises SplitError if it had failed.
+    """
+    try:
+        downloader.wait(timeout=grace)
+    except subprocess.TimeoutExpired:
+        pass
+    downloader.stdout.close()
+    if downloader.poll() is None:
+        # ffmpeg stopped reading first (at the end of a section, or it failed)
+        downloader.terminate()
+        downloader.wait()
+        return
+    if downloader.returncode != 0:
+        errors.seek(0)
+        raise SplitError({"error": "download failed", "details": errors.read()[-2000:].strip()}, 500)
+
+
+def _raise_if_rate_limited(origin: str, identity, errors):
+    """
+    After a failed stream: if the downloader's errors (yt-dlp's, or ffmpeg's when
+    it fetched the URL itself) show a 429, back off the buckets and raise
+    scheduler.RateLimited, which the cookie pool counts against the identity.
+    """
+    errors.seek(0)
+    failure = RuntimeError(errors.read()[-2000:].strip())
+    if scheduler.is_rate_limited(failure):
+        backoff = scheduler.report_rate_limited(origin, None, identity)
+        raise scheduler.RateLimited(origin, backoff) from failure
+
+
+@contextmanager
+def stream_input(url: str, info: dict, section=None):
+    """
+    Yield (input_args, stdin, stderr, offsets) for an ffmpeg that reads the media
+    of `url` as it downloads, without storing it: the probed format's URL when
+    ffmpeg can fetch it itself, else the stdout of a yt-dlp process (stdin is None
+    or that pipe). ffmpeg writes its errors to `stderr` when it does the
+    downloading. With `section` (start, end) ffmpeg seeks to `start` and stops at
+    `end`; that needs a URL ffmpeg fetches itself (see start_split). Like a
+    downloaded section, the stream then starts on the keyframe the seek lands on:
+    `offsets` is its (preroll, list_offset) for splitter.iter_stream_segments
+    (see keyframes.stream_offsets), (0, 0) otherwise.
+
+    The stream holds a cookie pool identity, a scheduler token and a download
+    slot while the block runs, like any download. It can't be retried part way,
+    so a 429 fails the split (with a 429), after backing off the buckets and
+    the identity like any other. Raises SplitError if the downloader fails.
+    """
+    origin = scheduler.origin_of(url)
+    try:
+        with cookie_pool.lease() as identity:
+            scheduler.wait_for_token(origin, identity=identity)
+            with scheduler.download_slot(), metrics.timed("cutter_download_seconds"), \
+                    reserved(workspace.workdir("ytstream_")) as tmpdir, \
+                    open(os.path.join(tmpdir, "stderr.log"), "w+", encoding="utf-8") as errors:
+                # only yt-dlp's info and cookies go in tmpdir, the video doesn't
+                try:
+                    if fetches_directly(info):
+                        options = _protocol_options(info, identity)
+                        offsets = stream_offsets(info["url"], section[0], options) if section else (0.0, 0.0)
+                        try:
+                            yield options + _seek_args(section) + ["-i", info["url"]], None, errors, offsets
+                        except Exception:
+                            errors.seek(0)
+                            print(f"ffmpeg stream download failed: {errors.read()[-2000:].strip()}")
+                            raise
+                    else:
+                        downloader = subprocess.Popen(_pipe_command(info, identity, tmpdir), stdout=subprocess.PIPE,
+                                                      stderr=errors)
+                        try:
+                            yield ["-i", "pipe:0"], downloader.stdout, None, (0.0, 0.0)
+                        except Exception:
+                            # ffmpeg failing is often the download failing: report that instead
+                            _end_download(downloader, errors, DOWNLOAD_EXIT_GRACE)
+                            raise
+                        _end_download(downloader, errors)
+                except Exception:
+                    _raise_if_rate_limited(origin, identity, errors)
+                    raise
+            scheduler.report_success(origin, identity)
+    except scheduler.RateLimited as e:
+        raise _rate_limited(e)
+
+
+def check_duration(info: dict, section=None) -> float:
+    """Return the length in seconds of what will be split (the whole video or `section`)."""
+    duration = info.get("duration")
+    if not duration:
+        raise SplitError({"error": "Cannot determine video duration"}, 500)
+    if section:
+        start, end = section
+        if start >= duration:
+            raise SplitError({"error": f"start {start}s is beyond the end of the video ({duration}s)."}, 400)
+        duration = min(end, duration) - start
+    if duration > MAX_TOTAL_SECONDS:
+        raise SplitError({"error": f"Video duration {duration}s exceeds server limit ({MAX_TOTAL_SECONDS}s)."}, 400)
+    return duration
+
+
+def zip_stream(clips):
+    """Yield a STORED ZIP of `clips` as they arrive, deleting each clip once it has been written out."""
+    zs = ZipStream()
+    zip_seconds = 0.0  # not counting the wait for ffmpeg
+    for clip in clips:
+        started = time.monotonic()
+        yield from zs.add_file(clip, os.path.basename(clip))
+        cleanup_file(clip)
+        zip_seconds += time.monotonic() - started
+    yield zs.finish()
+    metrics.observe("cutter_zip_seconds", zip_seconds)
+
+
+def _guard(clips, mode: str, timer: metrics.StageTimer, on_clip=None):
+    """
+    Turn ffmpeg failures while producing clips into SplitError; time each clip,
+    call `on_clip()` after each one and close the last stage.
+    """
+    try:
+        while True:
+            started = time.monotonic()
+            clip = next(clips, None)
+            if clip is None:
+                break
+            metrics.observe("cutter_clip_seconds", time.monotonic() - started, mode=mode)
+            if on_clip:
+                on_clip()
+            yield clip
+    except subprocess.CalledProcessError as e:
+        # ffmpeg failed
+        traceback.print_exc()
+        raise SplitError({"error": "ffmpeg processing failed", "details": str(e)}, 500)
+    finally:
+        clips.close()
+        timer.finish()
+
+
+def start_split(url: str, interval: float, base_name: str, workdir: str, stack: ExitStack, section=None,
+                accurate: bool = False, on_stage=None, timings: dict = None, on_progress=None, mode: str = "interval",
+                stream: bool = False):
+    """
+    Get the source (from the source cache, downloading it if needed) and return a
+    lazy iterator over the clip paths; ffmpeg produces them while it is consumed.
+    With `section` (start, end) only that range is downloaded and split.
+    With `accurate` clips are cut frame-accurately instead of on keyframes.
+    With `mode="smart"` cuts go on pauses near every `interval` instead of exactly there.
+    With `stream` the source is segmented while it downloads and never stored
+    (see stream_input); the first clips are out before the download is done.
+    The cache lease (or the stream) is entered on `stack`, which must stay open
+    until the iterator is done. `workdir` only holds the clips.
+    `on_stage(name)` is called as the pipeline moves between stages; every stage
+    is timed into the cutter_stage_seconds metric. `on_progress(update)` follows
+    the download and the splitting (see the module docstring).
+    `timings` is filled with clip path -> (start, end) in the source (see splitter.py).
+    Raises SplitError for failures the client should see.
+    """
+    stage = metrics.StageTimer(on_stage)
+    interval = validate_interval(interval)
+    try:
+        # pre-flight: enforce the limits before downloading anything
+        stage("probing")
+        info = probe(url)
+        duration = check_duration(info, section)
+
+        validate_stream(stream, accurate, mode)
+        if stream and section and not fetches_directly(info):
+            # yt-dlp's pipe can't seek: download just the section instead
+            stream = False
+        if stream:
+            stage("streaming")
+            input_args, stdin, stderr, offsets = stack.enter_context(stream_input(url, info, section))
+        else:
+            stage("downloading")
+            info, full_filepath = stack.enter_context(cached_source(url, section, info, on_progress))
+    except SplitError:
+        stage.finish()
+        raise
+    except Exception as e:
+        stage.finish()
+        traceback.print_exc()
+        raise SplitError({"error": "unexpected error", "details": str(e)}, 500)
+
+    if stream:
+        times = cut_points(duration, interval)
+        on_time, on_clip = _split_progress(duration, times, on_progress)
+        return _guard(iter_stream_segments(input_args, workdir, base_name, duration, times, timings, on_time, stdin,
+                                           stderr, offsets), "stream", stage, on_clip)
+    return split_source(full_filepath, duration, interval, base_name, workdir, accurate, stage, timings, on_progress,
+                        mode)
+
+
+def _split_progress(duration: float, times, on_progress=None):
+    """(on_time, on_clip) callbacks reporting the splitting progress to `on_progress`, or (None, None)."""
+    if not on_progress:
+        return None, None
+    split = {"clips_done": 0, "clips_total": len(times) + 1, "seconds_done": 0.0, "seconds_total": round(duration, 3)}
+
+    def on_time(seconds):
+        split["seconds_done"] = round(min(seconds, duration), 3)
+        on_progress({"split": dict(split)})
+
+    def on_clip():
+        split["clips_done"] += 1
+        on_progress({"split": dict(split)})
+
+    return on_time, on_clip
+
+
+def split_source(full_filepath: str, duration: float, interval: float, base_name: str, workdir: str,
+                 accurate: bool = False, stage: metrics.StageTimer = None, timings: dict = None, on_progress=None,
+                 mode: str = "interval"):
+    """
+    The splitting half of start_split: a lazy iterator over the clips of a source
+    that is already on disk. `stage` is finished once the iterator is done.
+    """
+    stage = stage or metrics.StageTimer()
+    if mode == "smart":
+        stage("analyzing")
+        try:
+            # stream copy can only cut on keyframes, so only those are candidates
+            keyframes = None if accurate else keyframe_index(full_filepath)["keyframes"]
+            times = smart_cut_points(full_filepath, duration, interval, keyframes)
+        except Exception as e:
+            stage.finish()
+            traceback.print_exc()
+            raise SplitError({"error": "could not analyze the video for smart cuts", "details": str(e)}, 500)
+    else:
+        times = cut_points(duration, interval)
+    stage("splitting")
+    on_time, on_clip = _split_progress(duration, times, on_progress)
+    if accurate:
+        return _guard(iter_accurate_segments(full_filepath, workdir, base_name, duration, times, timings=timings,
+                                             on_time=on_time), "accurate", stage, on_clip)
+    # Split into clips in a single demux pass
+    return _guard(iter_segments(full_filepath, workdir, base_name, duration, times, timings=timings, on_time=on_time),
+                  "copy", stage, on_clip)
+
+
+def write_split(f, url: str, interval: float, base_name: str, workdir: str, section=None, accurate: bool = False,
+                on_stage=None, on_progress=None, mode: str = "interval", stream: bool = False):
+    """Run the whole pipeline, writing the ZIP to the binary file object `f` as clips are produced."""
+    try:
+        with ExitStack() as stack:
+            clips = start_split(url, interval, base_name, workdir, stack, section, accurate, on_stage,
+                                on_progress=on_progress, mode=mode, stream=stream)
+            for chunk in zip_stream(clips):
+                f.write(chunk)
+                f.flush()
+    except SplitError:
+        raise
+    except Exception as e:
+        traceback.print_exc()
+        raise SplitError({"error": "unexpected error", "details": str(e)}, 500)
+
+
+def run_split(url: str, interval: float, base_name: str, workdir: str, section=None, accurate: bool = False,
+              on_stage=None, on_progress=None, mode: str = "interval", stream: bool = False) -> str:
+    """Run the whole pipeline, write the ZIP to DOWNLOAD_FOLDER and return its path."""
+    zip_filename = os.path.join(DOWNLOAD_FOLDER, f"{base_name}_{uuid.uuid4().hex}.zip")
+    try:
+        # reserved while it is written; once done it belongs to its job (see jobs.purge_expired)
+        with reserved(workspace.reserve(estimate_bytes(probe(url), section), [zip_filename])):
+            with open(zip_filename, "wb") as f:
+                write_split(f, url, interval, base_name, workdir, section, accurate, on_stage, on_progress, mode,
+                            stream)
+        return zip_filename
+    except SplitError:
+        cleanup_file(zip_filename)
+        raise
+
+
+def _split_workdir(url: str, section=None):
+    """A workspace workdir (see workspace.py) sized for the clips of `url`, on tmpfs if they are small."""
+    return reserved(workspace.workdir("ytsplit_", estimate_bytes(probe(url), section)))
+
+
+def run_split_job(url: str, interval: float, base_name: str, section=None, accurate: bool = False,
+                  on_stage=None, on_progress=None, mode: str = "interval", stream: bool = False) -> str:
+    """run_split in a fresh workdir that is always removed afterwards."""
+    with _split_workdir(url, section) as workdir:
+        return run_split(url, interval, base_name, workdir, section, accurate, on_stage, on_progress, mode, stream)
+
+
+def write_split_job(f, url: str, interval: float, base_name: str, section=None, accurate: bool = False,
+                    on_stage=None, on_progress=None, mode: str = "interval", stream: bool = False):
+    """
+    write_split in a fresh workdir that is always removed afterwards. The archive
+    is reserved while it is written, like run_split's.
+    """
+    with _split_workdir(url, section) as workdir, \
+            reserved(workspace.reserve(estimate_bytes(probe(url), section), [f.name])):
+        write_split(f, url, interval, base_name, workdir, section, accurate, on_stage, on_progress, mode, stream)
+
+
+def write_manifest(f, url: str, interval: float, base_name: str, clip_dir: str, clip_url, section=None,
+                   accurate: bool = False, on_stage=None, on_progress=None, mode: str = "interval",
+                   stream: bool = False):
+    """
+    Run the whole pipeline, keeping the clips in `clip_dir`, and write a JSON
+    manifest of them to the binary file object `f` once all are done.
+    `clip_url(name)` returns the URL a clip is served from. The clips are
+    reserved while they are cut (see workspace.py).
+    """
+    offset = section[0] if section else 0.0
+    timings = {}
+    try:
+        with reserved(workspace.reserve(estimate_bytes(probe(url), section), [clip_dir])), ExitStack() as stack:
+            os.makedirs(clip_dir, exist_ok=True)
+            clips = []
+            for index, clip in enumerate(start_split(url, interval, base_name, clip_dir, stack, section, accurate,
+                                                     on_stage, timings, on_progress, mode, stream)):
+                start, end = timings[clip]
+                name = os.path.basename(clip)
+                clips.append({
+                    "index": index,
+                    "name": name,
+                    "start": round(offset + start, 3),
+                    "duration": round(end - start, 3),
+                    "size": os.path.getsize(clip),
+                    "url": clip_url(name),
+                })
+    except SplitError:
+        raise
+    except Exception as e:
+        traceback.print_exc()
+        raise SplitError({"error": "unexpected error", "details": str(e)}, 500)
+    f.write(json.dumps({"clips": clips}).encode("utf-8"))
+    f.flush()
+
+
+def split_key(info: dict, interval: float, base_name: str, section=None, accurate: bool = False,
+              output: str = "zip", mode: str = "interval", stream: bool = False) -> str:
+    """
+    Identity of a split for request coalescing: same video, same cuts, same clip
+    names, same output. Streamed clips differ from stored ones (see
+    splitter.iter_stream_segments), so `stream` is part of it too.
+    """
+    extractor = info.get("extractor_key") or info.get("extractor") or "generic"
+    return singleflight.flight_key(extractor, info.get("id"), repr(float(interval)), section, accurate, base_name, output,
+                                   mode, stream)
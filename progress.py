@@ -0,0 +1,186 @@
+# progress.py
+"""
+Live progress of splits and jobs, streamed to clients as server-sent events.
+
+A pipeline runs in whichever process leads its flight or runs its job, so its
+progress is written to sqlite under STATE_DIR (like the job queue) and the event
+streams of every worker poll it. A Reporter records one run: its stage, yt-dlp's
+download progress and ffmpeg's position while splitting. Progress updates are
+written at most every PROGRESS_INTERVAL seconds; stage changes and the end of the
+run right away.
+
+The state of a run, as sent in each event:
+    {"stage": "downloading", "done": false,
+     "download": {"downloaded_bytes", "total_bytes", "speed", "eta"},
+     "split": {"clips_done", "clips_total", "seconds_done", "seconds_total"},
+     "error": {...} once failed}
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import anyio
+
+from config import STATE_DIR, JOB_RESULT_TTL
+
+PROGRESS_DB = os.path.join(STATE_DIR, "progress.db")
+PROGRESS_INTERVAL = 0.5
+POLL_SECONDS = 0.5
+KEEPALIVE_SECONDS = 15
+START_TIMEOUT = 30  # how long a stream waits for its run to start
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS progress (
+    key TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    updated REAL NOT NULL
+);
+"""
+
+
+def connect():
+    conn = sqlite3.connect(PROGRESS_DB, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
+
+
+def init_db():
+    conn = connect()
+    try:
+        conn.executescript(SCHEMA)
+    finally:
+        conn.close()
+
+
+def _save(key: str, state: dict):
+    conn = connect()
+    try:
+        conn.execute(
+            "INSERT INTO progress (key, state, done, updated) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET state = excluded.state, done = excluded.done, updated = excluded.updated",
+            (key, json.dumps(state), int(state.get("done", False)), time.time()),
+        )
+    finally:
+        conn.close()
+
+
+def get(key: str):
+    """The last recorded state of the run `key`, or None."""
+    conn = connect()
+    try:
+        row = conn.execute("SELECT state FROM progress WHERE key = ?", (key,)).fetchone()
+    finally:
+        conn.close()
+    return json.loads(row["state"]) if row else None
+
+
+def forget(key: str):
+    """Drop the state of a finished run of `key`, e.g. once its output expired and it will run again."""
+    conn = connect()
+    try:
+        conn.execute("DELETE FROM progress WHERE key = ? AND done", (key,))
+    finally:
+        conn.close()
+
+
+def purge_expired():
+    """Delete the progress of runs not updated for JOB_RESULT_TTL seconds."""
+    conn = connect()
+    try:
+        conn.execute("DELETE FROM progress WHERE updated < ?", (time.time() - JOB_RESULT_TTL,))
+    finally:
+        conn.close()
+
+
+class Reporter:
+    """
+    Records the progress of one pipeline run under `key`: pass `stage` and
+    `progress` as the pipeline's on_stage/on_progress callbacks (they may be
+    called from several threads). Used as a context manager the run is marked
+    done when the block exits, failed if it raises (with the exception's
+    `payload`, see SplitError).
+    """
+
+    def __init__(self, key: str, stage: str = "starting"):
+        self.key = key
+        self.state = {"stage": stage, "done": False}
+        self._lock = threading.Lock()
+        self._written = 0.0
+        purge_expired()
+        _save(key, self.state)
+
+    def _write(self, force: bool = False):
+        now = time.monotonic()
+        if force or now - self._written >= PROGRESS_INTERVAL:
+            self._written = now
+            _save(self.key, self.state)
+
+    def stage(self, name: str):
+        with self._lock:
+            self.state["stage"] = name
+            self._write(force=True)
+
+    def progress(self, update: dict):
+        """Merge `update` ({"download": {...}} or {"split": {...}}) into the state."""
+        with self._lock:
+            self.state.update(update)
+            self._write()
+
+    def finish(self, error: dict = None, **extra):
+        with self._lock:
+            self.state.update(extra, stage="failed" if error else "done", done=True)
+            if error:
+                self.state["error"] = error
+            self._write(force=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is None:
+            self.finish()
+        else:
+            self.finish(getattr(exc, "payload", None) or {"error": "unexpected error", "details": str(exc)})
+        return False
+
+
+def _event(name: str, state: dict) -> str:
+    return f"event: {name}\ndata: {json.dumps(state)}\n\n"
+
+
+async def events(key: str):
+    """
+    Server-sent events for the run `key`: a `progress` event whenever its state
+    changes, then `done` or `failed`. Ends with `idle` if the run doesn't start
+    within START_TIMEOUT seconds.
+    """
+    last = None
+    started = time.monotonic()
+    quiet_since = started
+    while True:
+        # sqlite reads block, keep them off the event loop
+        state = await anyio.to_thread.run_sync(get, key)
+        if state is None and time.monotonic() - started > START_TIMEOUT:
+            yield _event("idle", {"error": "nothing is running for this request"})
+            return
+        if state is not None and state != last:
+            last = state
+            quiet_since = time.monotonic()
+            if state.get("done"):
+                yield _event("failed" if state.get("error") else "done", state)
+                return
+            yield _event("progress", state)
+        elif time.monotonic() - quiet_since > KEEPALIVE_SECONDS:
+            # comment line: keeps proxies from closing an idle stream
+            quiet_since = time.monotonic()
+            yield ": keepalive\n\n"
+        await anyio.sleep(POLL_SECONDS)
+
+
+init_db()
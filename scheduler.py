@@ -0,0 +1,290 @@
+# scheduler.py
+"""
+Host-wide pacing of the requests yt-dlp makes.
+
+Every extraction and download first takes a token from its origin's token bucket,
+which all requests to the origin share whoever they are made as (the origin sees
+one IP), and, when made as a cookie pool identity (see cookie_pool.py), from that
+identity's bucket for the origin too.
+Buckets refill at their current rate, which adapts: a 429 halves the rate and
+blocks the bucket for its Retry-After (or an exponentially growing backoff),
+every success raises the rate again up to DOWNLOAD_RATE. A 429 backs off both
+buckets of the request.
+The buckets live in sqlite under STATE_DIR, so all gunicorn workers and job
+workers on the host pace themselves together.
+
+Downloads also need a slot: at most DOWNLOADS_PER_PROCESS at a time in one
+process and DOWNLOADS_PER_HOST on the host (flock'd slot files under STATE_DIR,
+released automatically if a process dies).
+"""
+
+import fcntl
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import metrics
+from config import (
+    STATE_DIR, DOWNLOAD_RATE, DOWNLOAD_MIN_RATE, DOWNLOAD_BURST, DOWNLOAD_BACKOFF, DOWNLOAD_BACKOFF_MAX,
+    DOWNLOAD_ATTEMPTS, DOWNLOAD_MAX_WAIT, DOWNLOADS_PER_PROCESS, DOWNLOADS_PER_HOST,
+)
+
+SCHEDULER_DB = os.path.join(STATE_DIR, "scheduler.db")
+SLOT_POLL_SECONDS = 0.2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS origins (
+    origin TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    rate REAL NOT NULL,
+    updated REAL NOT NULL,
+    blocked_until REAL NOT NULL DEFAULT 0,
+    failures INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+# hosts that share one rate limit
+ORIGIN_ALIASES = {
+    "youtu.be": "youtube.com",
+    "youtube-nocookie.com": "youtube.com",
+}
+
+_process_slots = threading.BoundedSemaphore(DOWNLOADS_PER_PROCESS)
+
+
+class RateLimited(Exception):
+    """The origin is rate limiting us for longer than a request may wait."""
+
+    def __init__(self, origin: str, retry_after: float):
+        super().__init__(f"{origin} is rate limiting requests, retry in {retry_after:.0f}s")
+        self.origin = origin
+        self.retry_after = retry_after
+
+
+def connect():
+    conn = sqlite3.connect(SCHEDULER_DB, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
+
+
+def init_db():
+    conn = connect()
+    try:
+        conn.executescript(SCHEMA)
+    finally:
+        conn.close()
+
+
+def origin_of(url: str) -> str:
+    """Rate limit domain of `url`: the registered domain, e.g. youtube.com for www.youtube.com."""
+    host = (urlparse(url).hostname or "").lower()
+    origin = ".".join(host.split(".")[-2:]) or "unknown"
+    return ORIGIN_ALIASES.get(origin, origin)
+
+
+@contextmanager
+def _origin_row(origin: str):
+    """The origin's row (created on first use) inside a write transaction; yields (conn, row, now)."""
+    conn = connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        now = time.time()
+        row = conn.execute("SELECT * FROM origins WHERE origin = ?", (origin,)).fetchone()
+        if row is None:
+            conn.execute("INSERT INTO origins (origin, tokens, rate, updated) VALUES (?, ?, ?, ?)",
+                         (origin, DOWNLOAD_BURST, DOWNLOAD_RATE, now))
+            row = conn.execute("SELECT * FROM origins WHERE origin = ?", (origin,)).fetchone()
+        try:
+            yield conn, row, now
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+
+
+def _buckets(origin: str, identity=None) -> list:
+    """The buckets a request takes tokens from: its identity's for the origin (if any), then the origin's."""
+    return ([f"{origin}/{identity.name}"] if identity is not None else []) + [origin]
+
+
+def _take_token(origin: str) -> float:
+    """Take a token if one is available; otherwise return the seconds until one will be."""
+    with _origin_row(origin) as (conn, row, now):
+        tokens = min(DOWNLOAD_BURST, row["tokens"] + (now - row["updated"]) * row["rate"])
+        if now < row["blocked_until"]:
+            wait = row["blocked_until"] - now
+        elif tokens >= 1:
+            tokens -= 1
+            wait = 0.0
+        else:
+            wait = (1 - tokens) / row["rate"]
+        conn.execute("UPDATE origins SET tokens = ?, updated = ? WHERE origin = ?", (tokens, now, origin))
+    return wait
+
+
+def wait_for_token(origin: str, max_wait: float = DOWNLOAD_MAX_WAIT, identity=None):
+    """
+    Block until a request to `origin` (made as `identity`, if given) may go out;
+    raises RateLimited if that is more than `max_wait` away.
+    """
+    waited = 0.0
+    for bucket in _buckets(origin, identity):
+        while True:
+            wait = _take_token(bucket)
+            if wait <= 0:
+                break
+            if waited + wait > max_wait:
+                raise RateLimited(origin, wait)
+            time.sleep(wait)
+            waited += wait
+    return waited
+
+
+def report_success(origin: str, identity=None):
+    """Additive increase: the origin answered, speed back up towards DOWNLOAD_RATE."""
+    for bucket in _buckets(origin, identity):
+        with _origin_row(bucket) as (conn, row, now):
+            rate = min(DOWNLOAD_RATE, row["rate"] + DOWNLOAD_RATE / 10)
+            conn.execute("UPDATE origins SET rate = ?, failures = 0 WHERE origin = ?", (rate, bucket))
+
+
+def _back_off(bucket: str, retry_after: float = None) -> float:
+    with _origin_row(bucket) as (conn, row, now):
+        failures = row["failures"] + 1
+        backoff = retry_after if retry_after else DOWNLOAD_BACKOFF * 2 ** (failures - 1)
+        backoff = min(backoff, DOWNLOAD_BACKOFF_MAX)
+        conn.execute(
+            "UPDATE origins SET rate = ?, tokens = 0, updated = ?, blocked_until = ?, failures = ? WHERE origin = ?",
+            (max(DOWNLOAD_MIN_RATE, row["rate"] / 2), now, max(row["blocked_until"], now + backoff), failures, bucket),
+        )
+    return backoff
+
+
+def report_rate_limited(origin: str, retry_after: float = None, identity=None) -> float:
+    """
+    Multiplicative decrease after a 429: halve the rate and block the origin (and
+    the identity's bucket, if the request was made as one) for `retry_after`
+    seconds, or DOWNLOAD_BACKOFF doubled for every 429 in a row.
+    Returns the origin's backoff in seconds.
+    """
+    backoffs = [_back_off(bucket, retry_after) for bucket in _buckets(origin, identity)]
+    metrics.inc("cutter_rate_limited_total", origin=origin)
+    return backoffs[-1]
+
+
+def _http_error(exc):
+    """The HTTP error behind a yt-dlp failure (DownloadError -> ExtractorError -> HTTPError), if any."""
+    seen = set()
+    pending = [exc]
+    while pending:
+        e = pending.pop()
+        if e is None or id(e) in seen:
+            continue
+        seen.add(id(e))
+        if isinstance(getattr(e, "status", None), int) or isinstance(getattr(e, "code", None), int):
+            return e
+        exc_info = getattr(e, "exc_info", None)
+        pending += [getattr(e, "cause", None), getattr(e, "__cause__", None), getattr(e, "__context__", None),
+                    exc_info[1] if exc_info else None]
+    return None
+
+
+def is_rate_limited(exc) -> bool:
+    if isinstance(exc, RateLimited):
+        # the origin answered with a 429, not just a wait for a token that ran too long
+        return exc.__cause__ is not None and is_rate_limited(exc.__cause__)
+    error = _http_error(exc)
+    if error is not None:
+        return (getattr(error, "status", None) or getattr(error, "code", None)) == 429
+    message = str(exc)
+    return "HTTP Error 429" in message or "Too Many Requests" in message
+
+
+def retry_after(exc):
+    """Seconds from the Retry-After header of the 429 behind `exc`, or None."""
+    error = _http_error(exc)
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or getattr(error, "headers", None)
+    value = headers.get("Retry-After") if headers else None
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        # HTTP date form
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+@contextmanager
+def download_slot():
+    """Hold one of DOWNLOADS_PER_PROCESS slots of this process and one of DOWNLOADS_PER_HOST host-wide."""
+    with _process_slots:
+        fds = [os.open(os.path.join(STATE_DIR, f"download.slot.{i}"), os.O_RDWR | os.O_CREAT, 0o644)
+               for i in range(DOWNLOADS_PER_HOST)]
+        held = None
+        try:
+            while held is None:
+                for fd in fds:
+                    try:
+                        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        continue
+                    held = fd
+                    break
+                else:
+                    time.sleep(SLOT_POLL_SECONDS)
+            yield
+        finally:
+            if held is not None:
+                fcntl.flock(held, fcntl.LOCK_UN)
+            for fd in fds:
+                os.close(fd)
+
+
+def run(url: str, fn, is_download: bool = False, lease=nullcontext):
+    """
+    Call `fn(identity)` (a yt-dlp request for `url`) when its buckets allow it,
+    inside a download slot if `is_download`. `lease()` is entered around every
+    attempt and yields the identity to make the request as (see cookie_pool.py;
+    None for no identity).
+    On a 429 the buckets back off and the call is retried, with a newly leased
+    identity, up to DOWNLOAD_ATTEMPTS times. Raises RateLimited when the origin
+    stays limited for longer than DOWNLOAD_MAX_WAIT; other failures are raised
+    as they are.
+    """
+    origin = origin_of(url)
+    for attempt in range(1, DOWNLOAD_ATTEMPTS + 1):
+        started = time.monotonic()
+        identity = None
+        try:
+            with lease() as identity:
+                wait_for_token(origin, identity=identity)
+                with download_slot() if is_download else nullcontext():
+                    metrics.observe("cutter_download_wait_seconds", time.monotonic() - started)
+                    result = fn(identity)
+        except RateLimited:
+            raise
+        except Exception as e:
+            if not is_rate_limited(e):
+                raise
+            backoff = report_rate_limited(origin, retry_after(e), identity)
+            if attempt == DOWNLOAD_ATTEMPTS or backoff > DOWNLOAD_MAX_WAIT:
+                raise RateLimited(origin, backoff) from e
+            continue
+        report_success(origin, identity)
+        return result
+
+
+init_db()
@@ -0,0 +1,301 @@
+# singleflight.py
+"""
+Request coalescing for identical in-flight splits.
+
+When many clients ask for the same video/interval/range at once, only the first one
+(the leader) runs the pipeline; it writes the output (the archive, or a manifest)
+to a file under ARTIFACT_DIR and every request, the leader's included, streams that
+file while it grows. The finished output is kept for ARTIFACT_TTL seconds so late
+arrivals get it straight from disk; a flight can keep more files (e.g. the clips a
+manifest points to) in its files_dir, which lives as long as the output.
+
+Coordination is through files, so it works across gunicorn workers:
+    <key>.lock      held (flock) by the leader while it produces
+    <key>.current   name of the part file being written
+    <key>.<id>.part the output being written
+    <key>.out       the finished output (the part file renamed)
+    <key>.error     JSON error of a failed run
+    <key>.files/    extra files of the flight
+"""
+
+import fcntl
+import glob
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import traceback
+import uuid
+
+import metrics
+from config import ARTIFACT_DIR, ARTIFACT_TTL
+
+POLL_SECONDS = 0.05
+CHUNK_SIZE = 1024 * 1024
+
+
+class FlightError(Exception):
+    """
+    The flight failed; carries the JSON payload and HTTP status code of the error the
+    leader's `produce` raised (read from its `payload`/`status_code` attributes).
+    """
+
+    def __init__(self, payload: dict, status_code: int = 500):
+        super().__init__(payload.get("error"))
+        self.payload = payload
+        self.status_code = status_code
+
+
+def flight_key(*parts) -> str:
+    raw = "|".join(str(p) for p in parts)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+
+def _path(key: str, suffix: str) -> str:
+    return os.path.join(ARTIFACT_DIR, key + suffix)
+
+
+def _read_json(path: str):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path: str, data: dict):
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def files_dir(key: str) -> str:
+    """Directory for extra files of the flight for `key`; `produce` creates it if it needs one."""
+    return _path(key, ".files")
+
+
+def _fresh_artifact(key: str):
+    path = _path(key, ".out")
+    try:
+        if time.time() - os.path.getmtime(path) < ARTIFACT_TTL:
+            return path
+    except OSError:
+        pass
+    return None
+
+
+def finished_output(key: str):
+    """Path of the finished output of `key` if it is still fresh, else None."""
+    return _fresh_artifact(key)
+
+
+def _lock_is_free(key: str) -> bool:
+    fd = os.open(_path(key, ".lock"), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+    finally:
+        os.close(fd)
+
+
+def touch(key: str) -> bool:
+    """
+    Keep the finished output of `key` (and its files) for another ARTIFACT_TTL
+    seconds, e.g. while clips of a manifest are being fetched. Returns False if
+    there is no fresh output.
+    """
+    path = _fresh_artifact(key)
+    if path is None:
+        return False
+    try:
+        os.utime(path)
+    except OSError:
+        return False
+    return True
+
+
+def purge_expired():
+    """
+    Remove finished outputs, their files and error files older than ARTIFACT_TTL,
+    and part files that dead leaders left behind (skipping running flights).
+    """
+    cutoff = time.time() - ARTIFACT_TTL
+    for path in glob.glob(os.path.join(ARTIFACT_DIR, "*.out")) + glob.glob(os.path.join(ARTIFACT_DIR, "*.error")):
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+    for path in glob.glob(os.path.join(ARTIFACT_DIR, "*.files")):
+        key = os.path.basename(path)[:-len(".files")]
+        try:
+            # files of a run that expired or failed; a new run of the key clears them itself
+            if (not os.path.exists(_path(key, ".out")) and os.path.getmtime(path) < cutoff
+                    and _lock_is_free(key)):
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass
+    for path in glob.glob(os.path.join(ARTIFACT_DIR, "*.part")):
+        key = os.path.basename(path).split(".", 1)[0]
+        try:
+            # a running leader holds the lock; a new one clears the parts of its key itself
+            if os.path.getmtime(path) < cutoff and _lock_is_free(key):
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def _lead(key: str, fd: int, produce):
+    """Run `produce(fileobj)` into a new part file; called with the flight lock held in `fd`."""
+    part = _path(key, f".{uuid.uuid4().hex}.part")
+    try:
+        # leftovers of a leader that died
+        for stale in glob.glob(glob.escape(_path(key, "")) + ".*.part"):
+            os.remove(stale)
+        shutil.rmtree(files_dir(key), ignore_errors=True)
+        with open(part, "wb") as f:
+            _write_json(_path(key, ".current"), {"part": part})
+            try:
+                produce(f)
+            except Exception as e:
+                payload = getattr(e, "payload", None)
+                if payload is None:
+                    traceback.print_exc()
+                    payload = {"error": "unexpected error", "details": str(e)}
+                _write_json(_path(key, ".error"), {"part": part, "time": time.time(), "payload": payload,
+                                                   "status_code": getattr(e, "status_code", 500)})
+                shutil.rmtree(files_dir(key), ignore_errors=True)
+                return
+        os.replace(part, _path(key, ".out"))
+    finally:
+        if os.path.exists(part):
+            os.remove(part)
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+def _open_current(key: str, since: float):
+    """Open the part file of the running flight, or the finished output, or raise its error."""
+    while True:
+        artifact = _fresh_artifact(key)
+        error = _read_json(_path(key, ".error"))
+        current = _read_json(_path(key, ".current"))
+        if current:
+            try:
+                f = open(current["part"], "rb")
+                return f, current["part"]
+            except OSError:
+                pass  # already renamed or removed; look again
+        if error and error.get("time", 0) >= since:
+            raise FlightError(error["payload"], error["status_code"])
+        if artifact:
+            return open(artifact, "rb"), None
+        if _lock_is_free(key):
+            raise FlightError({"error": "split was interrupted, please retry"}, 503)
+        time.sleep(POLL_SECONDS)
+
+
+def _check(f, key: str, part: str) -> bool:
+    """
+    State of the flight writing `part`: True once it is finished (renamed to the
+    output), False while it is still running; raises FlightError if it failed or
+    its leader went away.
+    """
+    # look at the lock first: the leader publishes its result before releasing it
+    leader_gone = _lock_is_free(key)
+    try:
+        if os.stat(_path(key, ".out")).st_ino == os.fstat(f.fileno()).st_ino:
+            return True
+    except OSError:
+        pass
+    error = _read_json(_path(key, ".error"))
+    if error and error["part"] == part:
+        raise FlightError(error["payload"], error["status_code"])
+    current = _read_json(_path(key, ".current"))
+    if leader_gone or not current or current["part"] != part:
+        # the leader died (or a new one replaced its leftovers)
+        raise FlightError({"error": "split was interrupted, please retry"}, 503)
+    return False
+
+
+def _wait_for_data(f, key: str, part: str):
+    """Block until the flight has written something (or failed), so errors can still become a JSON response."""
+    while os.fstat(f.fileno()).st_size == 0:
+        if _check(f, key, part):
+            return
+        time.sleep(POLL_SECONDS)
+
+
+def _tail(f, key: str, part: str):
+    """Yield the part file as it grows, until the leader renames it to the finished output."""
+    try:
+        finished = part is None  # reading a finished output
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if chunk:
+                yield chunk
+                continue
+            if finished:
+                return
+            # at the end of what has been written: either wait for more or drain and stop
+            finished = _check(f, key, part)
+            if not finished:
+                time.sleep(POLL_SECONDS)
+    finally:
+        f.close()
+
+
+def join(key: str, produce):
+    """
+    Join the flight for `key`, starting it with `produce(fileobj)` if nobody runs it.
+    `produce` writes the output to the file object (flushing as it goes); it runs in
+    a background thread so it finishes for the other requests even if the
+    one that started it goes away.
+
+    Blocks until the first bytes are available and returns an iterator over the
+    output; raises FlightError if the flight fails before that.
+    """
+    since = time.time()
+    artifact = _fresh_artifact(key)
+    if artifact:
+        metrics.inc("cutter_cache_requests_total", cache="artifact", result="hit")
+        return _tail(open(artifact, "rb"), key, None)
+
+    fd = os.open(_path(key, ".lock"), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)  # someone else is producing it
+        metrics.inc("cutter_cache_requests_total", cache="artifact", result="shared")
+    else:
+        purge_expired()
+        # check again: a flight may have finished between the first check and the lock
+        artifact = _fresh_artifact(key)
+        if artifact:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+            metrics.inc("cutter_cache_requests_total", cache="artifact", result="hit")
+            return _tail(open(artifact, "rb"), key, None)
+        metrics.inc("cutter_cache_requests_total", cache="artifact", result="miss")
+        try:
+            os.remove(_path(key, ".current"))
+        except OSError:
+            pass
+        threading.Thread(target=_lead, args=(key, fd, produce), name=f"flight-{key[:8]}", daemon=True).start()
+
+    f, part = _open_current(key, since)
+    try:
+        if part is not None:
+            _wait_for_data(f, key, part)
+    except Exception:
+        f.close()
+        raise
+    return _tail(f, key, part)
+
+
+os.makedirs(ARTIFACT_DIR, exist_ok=True)
@@ -0,0 +1,170 @@
+# smartcuts.py
+"""
+Cut points for mode=smart: about every `interval` seconds, but on a pause in the
+audio (or a scene change) instead of mid-sentence.
+
+The audio is decoded by ffmpeg to mono 16-bit PCM at ANALYSIS_RATE and read from
+a pipe in blocks; NumPy turns each block into the RMS level of every
+WINDOW_SECONDS window. Only the levels are kept (20 floats per second of video),
+so memory stays bounded for hour-long sources. With SMART_SCENES ffmpeg's scene
+detection runs alongside (on downscaled frames) and its scene changes count as
+good cut points too.
+
+Each cut is then picked within SMART_TOLERANCE * interval of its target (the
+previous cut + interval): the quietest spot, preferring scene changes and spots
+close to the target. With stream copy clips can only start on keyframes, so
+there only keyframes are candidates.
+"""
+
+import re
+import subprocess
+import threading
+
+from config import SMART_TOLERANCE, SMART_SCENES
+
+ANALYSIS_RATE = 8000  # Hz; plenty to tell speech from silence
+WINDOW_SECONDS = 0.05
+SMOOTH_SECONDS = 0.3  # a pause has to last about this long to count
+READ_WINDOWS = 2000  # windows per read from the pipe (100 s of audio)
+SILENCE_DB = -60.0  # this quiet or quieter is silence
+SCENE_THRESHOLD = 0.3
+SCENE_WEIGHT = 0.5
+DISTANCE_WEIGHT = 0.3
+MIN_LAST_CLIP = 1.0  # seconds; don't leave a shorter clip at the end
+
+SCENE_TIME_RE = re.compile(r"pts_time:(\S+)")
+SCENE_SCORE_RE = re.compile(r"lavfi\.scene_score=(\S+)")
+
+
+def audio_levels(source: str):
+    """
+    RMS level in dBFS of every WINDOW_SECONDS of the first audio stream of
+    `source`, as a NumPy array (empty if there is no audio), in one streaming pass.
+    """
+    import numpy as np
+
+    window = int(ANALYSIS_RATE * WINDOW_SECONDS)
+    frame_bytes = window * 2
+    cmd = [
+        "ffmpeg",
+        "-hide_banner",
+        "-loglevel", "error",
+        "-i", source,
+        "-map", "0:a:0?",
+        "-vn",
+        "-ac", "1",
+        "-ar", str(ANALYSIS_RATE),
+        "-f", "s16le",
+        "pipe:1",
+    ]
+    levels = []
+    carry = b""
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as proc:
+        while True:
+            data = proc.stdout.read(frame_bytes * READ_WINDOWS)
+            if not data:
+                break
+            data = carry + data
+            usable = len(data) - len(data) % frame_bytes
+            carry = data[usable:]
+            frames = np.frombuffer(data[:usable], dtype="<i2").astype(np.float32).reshape(-1, window) / 32768.0
+            levels.append(np.sqrt(np.mean(frames * frames, axis=1)))
+    if not levels:
+        # no audio stream (or ffmpeg could not decode it)
+        return np.zeros(0, dtype=np.float32)
+    return 20 * np.log10(np.maximum(np.concatenate(levels), 1e-5))
+
+
+def scene_changes(source: str, threshold: float = SCENE_THRESHOLD) -> list:
+    """(time, score) of every frame of `source` whose scene change score is above `threshold`."""
+    cmd = [
+        "ffmpeg",
+        "-hide_banner",
+        "-loglevel", "error",
+        "-i", source,
+        "-map", "0:v:0",
+        "-an",
+        "-vf", f"scale=160:-2,select='gt(scene,{threshold})',metadata=print:file=-",
+        "-f", "null",
+        "-",
+    ]
+    changes = []
+    time = None
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True) as proc:
+        for line in proc.stdout:
+            match = SCENE_TIME_RE.search(line)
+            if match:
+                time = float(match.group(1))
+                continue
+            match = SCENE_SCORE_RE.search(line)
+            if match and time is not None:
+                changes.append((time, float(match.group(1))))
+                time = None
+    return changes
+
+
+def pick_cut_points(levels, duration: float, interval: float, scenes=(), candidates=None) -> list:
+    """
+    Interior cut points about `interval` apart, each on the best candidate within
+    SMART_TOLERANCE * interval of its target. `levels` are audio_levels(),
+    `scenes` scene_changes(); `candidates` are the allowed cut times (sorted, e.g.
+    keyframes), default any analysis window.
+    """
+    import numpy as np
+
+    count = max(len(levels), int(duration / WINDOW_SECONDS) + 1)
+    # 0 (loud) .. 1 (silent), averaged so a single quiet window is no pause
+    quiet = np.zeros(count, dtype=np.float32)
+    if len(levels):
+        smooth = max(int(SMOOTH_SECONDS / WINDOW_SECONDS), 1)
+        quiet[:len(levels)] = np.convolve(np.clip(levels / SILENCE_DB, 0.0, 1.0), np.ones(smooth) / smooth,
+                                          mode="same")
+    scene = np.zeros(count, dtype=np.float32)
+    for time, score in scenes:
+        i = min(int(time / WINDOW_SECONDS), count - 1)
+        # a window either side: keyframes and scene changes rarely share a window exactly
+        scene[max(i - 1, 0):i + 2] = np.maximum(scene[max(i - 1, 0):i + 2], score)
+
+    if candidates is None:
+        times = (np.arange(count) + 0.5) * WINDOW_SECONDS
+    else:
+        times = np.asarray(candidates, dtype=np.float64)
+    index = np.clip((times / WINDOW_SECONDS).astype(np.int64), 0, count - 1)
+    merit = quiet[index] + SCENE_WEIGHT * scene[index]
+
+    tolerance = interval * SMART_TOLERANCE
+    cuts = []
+    previous = 0.0
+    while previous + interval < duration - MIN_LAST_CLIP:
+        target = previous + interval
+        lo, hi = np.searchsorted(times, [target - tolerance, target + tolerance])
+        cut = target
+        if hi > lo:
+            score = merit[lo:hi] - DISTANCE_WEIGHT * np.abs(times[lo:hi] - target) / max(tolerance, 1e-9)
+            cut = float(times[lo + int(np.argmax(score))])
+        if cut <= previous or cut >= duration - MIN_LAST_CLIP:
+            break
+        cuts.append(cut)
+        previous = cut
+    return cuts
+
+
+def smart_cut_points(source: str, duration: float, interval: float, keyframes=None) -> list:
+    """
+    Cut points for `source` (see the module docstring). Pass the source's
+    `keyframes` when clips are stream copied: cuts then land on keyframes (just
+    before them, so the segment muxer cuts there and not on the next one).
+    """
+    scenes = []
+    scanner = None
+    if SMART_SCENES:
+        scanner = threading.Thread(target=lambda: scenes.extend(scene_changes(source)), name="scene-scan",
+                                   daemon=True)
+        scanner.start()
+    levels = audio_levels(source)
+    if scanner is not None:
+        scanner.join()
+    cuts = pick_cut_points(levels, duration, interval, scenes, keyframes)
+    if keyframes is not None:
+        cuts = [max(cut - 0.001, 0.001) for cut in cuts]
+    return cuts
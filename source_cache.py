@@ -0,0 +1,169 @@
+# source_cache.py
+"""
+Content-addressed cache of downloaded source videos.
+
+Entries are keyed by extractor + video id + requested format, so splitting the same
+video again (e.g. with another interval) reuses the file instead of downloading it.
+The index lives in sqlite under STATE_DIR and the files under SOURCE_CACHE_DIR, so
+all gunicorn workers and job workers share one cache.
+
+Concurrency: every entry has a lock file. Readers hold a shared flock for as long as
+they use the file; the download that fills an entry holds it exclusively; eviction
+only removes entries it can lock exclusively without waiting, i.e. nobody is reading.
+"""
+
+import fcntl
+import glob
+import hashlib
+import os
+import shutil
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from config import STATE_DIR, SOURCE_CACHE_DIR, SOURCE_CACHE_BYTES, SOURCE_CACHE_TTL
+
+CACHE_DB = os.path.join(STATE_DIR, "source_cache.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    key TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    extractor TEXT,
+    video_id TEXT,
+    format TEXT,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sources_lru ON sources (last_used);
+"""
+
+
+def connect():
+    conn = sqlite3.connect(CACHE_DB, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
+
+
+def init_db():
+    conn = connect()
+    try:
+        conn.executescript(SCHEMA)
+    finally:
+        conn.close()
+
+
+def cache_key(info: dict, fmt: str) -> str:
+    extractor = info.get("extractor_key") or info.get("extractor") or "generic"
+    raw = f"{extractor}:{info.get('id')}:{fmt}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+
+def _lock_path(key: str) -> str:
+    return os.path.join(SOURCE_CACHE_DIR, f"{key}.lock")
+
+
+def _lookup(conn, key: str):
+    row = conn.execute("SELECT * FROM sources WHERE key = ?", (key,)).fetchone()
+    if row is None:
+        return None
+    if not os.path.exists(row["path"]):
+        # file removed behind our back: forget the entry
+        conn.execute("DELETE FROM sources WHERE key = ?", (key,))
+        return None
+    conn.execute("UPDATE sources SET last_used = ? WHERE key = ?", (time.time(), key))
+    return row["path"]
+
+
+@contextmanager
+def acquire(key: str, fetch, info: dict = None, fmt: str = None):
+    """
+    Yield the path of the cached source for `key`, calling `fetch()` to download it
+    on a miss. `fetch()` must return the path of the downloaded file, which is moved
+    into the cache. The file is guaranteed to stay in place until the block exits.
+    """
+    info = info or {}
+    fd = os.open(_lock_path(key), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        conn = connect()
+        try:
+            # fast path: already cached, share it with other readers
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            path = _lookup(conn, key)
+            if path is None:
+                # miss: take the entry exclusively and check again, someone may have filled it meanwhile
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                path = _lookup(conn, key)
+                if path is None:
+                    downloaded = fetch()
+                    ext = os.path.splitext(downloaded)[1] or ".mp4"
+                    path = os.path.join(SOURCE_CACHE_DIR, f"{key}{ext}")
+                    shutil.move(downloaded, path)
+                    now = time.time()
+                    conn.execute(
+                        "INSERT OR REPLACE INTO sources (key, path, size, extractor, video_id, format, created, last_used) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (key, path, os.path.getsize(path), info.get("extractor_key"), info.get("id"), fmt, now, now),
+                    )
+                # downgrade so other readers can use the entry while we do
+                fcntl.flock(fd, fcntl.LOCK_SH)
+                evict(conn)
+        finally:
+            # the block may finish on another thread (e.g. a streamed response), so don't keep the connection
+            conn.close()
+        yield path
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+def _remove_entry(conn, row) -> bool:
+    """Remove one entry unless someone is using it. Returns True if removed."""
+    fd = os.open(_lock_path(row["key"]), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False  # in use
+        try:
+            if os.path.exists(row["path"]):
+                os.remove(row["path"])
+            # sidecar files such as the keyframe index
+            for extra in glob.glob(glob.escape(row["path"]) + ".*"):
+                os.remove(extra)
+        except OSError:
+            return False
+        conn.execute("DELETE FROM sources WHERE key = ?", (row["key"],))
+        return True
+    finally:
+        os.close(fd)
+
+
+def evict(conn=None):
+    """Drop entries unused for SOURCE_CACHE_TTL, then least recently used ones until under SOURCE_CACHE_BYTES."""
+    own = conn is None
+    conn = conn or connect()
+    try:
+        cutoff = time.time() - SOURCE_CACHE_TTL
+        for row in conn.execute("SELECT * FROM sources WHERE last_used < ?", (cutoff,)).fetchall():
+            _remove_entry(conn, row)
+
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM sources").fetchone()[0]
+        if total <= SOURCE_CACHE_BYTES:
+            return
+        for row in conn.execute("SELECT * FROM sources ORDER BY last_used").fetchall():
+            if total <= SOURCE_CACHE_BYTES:
+                break
+            if _remove_entry(conn, row):
+                total -= row["size"]
+    finally:
+        if own:
+            conn.close()
+
+
+os.makedirs(SOURCE_CACHE_DIR, exist_ok=True)
+init_db()
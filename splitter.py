@@ -0,0 +1,371 @@
+# splitter.py
+"""
+Single-pass splitting engine.
+
+Instead of spawning one `ffmpeg -ss/-to -c copy` per clip (each one re-opening and
+re-demuxing the whole source), the source is demuxed once and ffmpeg's segment
+muxer writes every clip in the same pass. Cut points are passed with
+`-segment_times`, so non-uniform cuts work the same way as fixed intervals.
+Clips keep the `{base_name}{i}.mp4` naming used by /split.
+
+Pass `on_time(seconds)` to follow how many seconds of the source ffmpeg has
+processed (read from `ffmpeg -progress`).
+
+iter_stream_segments runs the same pass on a source that is still arriving (a
+URL ffmpeg reads itself, or a pipe), so clips come out while it downloads.
+
+With stream copy clips start on keyframes; iter_accurate_segments cuts them
+frame-accurately by re-encoding only the partial GOP at the head of each clip.
+"""
+
+import csv
+import math
+import os
+import subprocess
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import toolchain
+from keyframes import keyframe_index, next_keyframe, source_offsets
+
+
+def cut_points(duration: float, interval: float):
+    """Interior cut points for `ceil(duration / interval)` clips of `interval` seconds."""
+    num_clips = math.ceil(duration / interval)
+    return [i * interval for i in range(1, num_clips)]
+
+
+def clip_path(workdir: str, base_name: str, index: int) -> str:
+    return os.path.join(workdir, f"{base_name}{index}.mp4")
+
+
+def _segment_cmd(input_args, workdir: str, base_name: str, times):
+    # '%' is the segment muxer's pattern character, so escape it in user supplied names
+    pattern = os.path.join(workdir, base_name.replace("%", "%%") + "%d.mp4")
+    cmd = [
+        "ffmpeg",
+        "-y",
+        "-hide_banner",
+        "-loglevel", "error",
+        *input_args,
+        "-c", "copy",
+        "-f", "segment",
+        "-segment_format", "mp4",
+        "-segment_start_number", "0",
+        "-reset_timestamps", "1",
+    ]
+    if times:
+        cmd += ["-segment_times", ",".join(f"{t:.3f}" for t in times)]
+    else:
+        # a single clip: make sure the muxer never splits on its own
+        cmd += ["-segment_time", str(10 ** 9)]
+    cmd.append(pattern)
+    return cmd
+
+
+def _read_progress(lines, on_time):
+    """Call on_time(seconds) for every position ffmpeg reports on its -progress output."""
+    for line in lines:
+        name, _, value = line.strip().partition("=")
+        if name == "out_time_us" and value.isdigit():
+            on_time(int(value) / 1e6)
+
+
+def _progress_reader(fd: int, on_time) -> threading.Thread:
+    """Read `ffmpeg -progress pipe:<fd>` output from the read end `fd` in a background thread."""
+    def read():
+        with os.fdopen(fd, "r") as lines:
+            _read_progress(lines, on_time)
+
+    reader = threading.Thread(target=read, name="ffmpeg-progress", daemon=True)
+    reader.start()
+    return reader
+
+
+def cut_clip(source: str, start: float, end: float, out_path: str):
+    """Cut one clip with its own ffmpeg process (used to recover individual clips)."""
+    cmd = [
+        "ffmpeg",
+        "-y",
+        "-hide_banner",
+        "-loglevel", "error",
+        "-ss", str(start),
+        "-to", str(end),
+        "-i", source,
+        "-c", "copy",
+        out_path
+    ]
+    subprocess.run(cmd, check=True)
+
+
+def iter_segments(source: str, workdir: str, base_name: str, duration: float, times, timings: dict = None,
+                  on_time=None):
+    """
+    Split `source` at `times` (sorted interior cut points, in seconds) in one ffmpeg pass,
+    yielding each clip path, in order, as soon as ffmpeg has closed that segment.
+    If `timings` is given it is filled with clip path -> (start, end), the times the
+    clip actually covers in the source (cuts snap to keyframes).
+
+    The segment muxer can only cut on keyframes and uses up one cut point per
+    keyframe, so when two cuts fall in the same GOP its segments stop matching
+    the clips; the pass is stopped there (see _segment_pass). Every clip the pass
+    did not finish is re-cut on its own; only if that also fails is the error
+    raised (subprocess.CalledProcessError).
+
+    A downloaded section starts on the keyframe before it (see
+    keyframes.source_offsets); the first clip then starts before 0 and its
+    `timings` say so.
+    """
+    times = [t for t in times if 0 < t < duration]
+    bounds = [0.0] + list(times) + [duration]
+    num_clips = len(bounds) - 1
+
+    done, _, returncode = yield from _segment_pass(["-i", source], workdir, base_name, duration, times, timings,
+                                                   on_time, stop_on_merge=True, offsets=source_offsets(source))
+    if returncode != 0 or done < num_clips:
+        # keep the clips that were closed; the rest are recovered below
+        print(f"ffmpeg segment pass stopped after {done}/{num_clips} clips (exit code {returncode})")
+
+    for i in range(done, num_clips):
+        # never reported as closed, so it is missing or possibly truncated
+        path = clip_path(workdir, base_name, i)
+        cut_clip(source, bounds[i], bounds[i + 1], path)
+        if timings is not None:
+            timings[path] = (bounds[i], bounds[i + 1])
+        if on_time:
+            on_time(bounds[i + 1])
+        yield path
+
+
+STREAM_END_TOLERANCE = 2.0  # seconds; metadata durations are rounded
+MERGE_EPSILON = 0.001  # seconds; the segment list has microsecond precision
+
+
+def iter_stream_segments(input_args, workdir: str, base_name: str, duration: float, times, timings: dict = None,
+                         on_time=None, stdin=None, stderr=None, offsets=(0.0, 0.0)):
+    """
+    iter_segments for a source that can only be read once, front to back:
+    `input_args` are ffmpeg's input options ending in `-i <url>`, or `-i pipe:0`
+    with the stream on `stdin`; ffmpeg's errors go to `stderr` if given, and
+    `offsets` are the stream's like a stored source's (see _segment_pass). Clips
+    come out as the source arrives. Nothing can be re-cut afterwards, so a pass
+    that fails or ends early (a truncated download) raises
+    subprocess.CalledProcessError. Where cuts share a GOP the
+    muxer's segments are kept as they are: fewer, longer clips, each named and
+    timed after what it actually covers.
+    """
+    times = [t for t in times if 0 < t < duration]
+    done, end, returncode = yield from _segment_pass(input_args, workdir, base_name, duration, times, timings,
+                                                     on_time, stdin, stderr, offsets=offsets)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, "ffmpeg")
+    if done == 0 or end < duration - STREAM_END_TOLERANCE:
+        # the muxer closes the last segment wherever the input ends, so a
+        # download that broke off still exits 0
+        raise subprocess.CalledProcessError(1, "ffmpeg", f"source ended at {end:.1f}s of {duration:.1f}s")
+
+
+def _segment_pass(input_args, workdir: str, base_name: str, duration: float, times, timings: dict = None,
+                  on_time=None, stdin=None, stderr=None, stop_on_merge: bool = False, offsets=(0.0, 0.0)):
+    """
+    Run one segment muxer pass, yielding each clip path as ffmpeg closes it.
+    Returns (clips closed, end of the last one in the source, ffmpeg's exit code);
+    the caller decides what a failed pass means.
+
+    The muxer cuts at the first keyframe past each cut point and moves on to the
+    next cut point only after that, so a segment that runs past the *next* cut
+    point too has swallowed a clip and every later segment is off by one. With
+    `stop_on_merge` the pass ends at such a segment without yielding it, so the
+    caller can cut the remaining clips another way.
+
+    `offsets` are the source's (preroll, list_offset) (see keyframes.source_offsets):
+    the muxer counts the cut points from its first video packet, preroll seconds
+    before 0, and the segment list from list_offset seconds before 0. `times`,
+    `timings`, `on_time` and the returned end are in source time.
+    """
+    num_clips = len(times) + 1
+    preroll, list_offset = offsets
+    if on_time and list_offset:
+        on_time = (lambda report: lambda seconds: report(max(seconds - list_offset, 0.0)))(on_time)
+    # the muxer prints one line to the segment list every time it closes a segment
+    # a cut point on a keyframe is compared with a time a rounding error short of it after a seek
+    cmd = _segment_cmd(input_args, workdir, base_name, [t + preroll - MERGE_EPSILON for t in times])
+    cmd[-1:-1] = ["-segment_list", "pipe:1", "-segment_list_type", "csv"]
+    if stderr is not None:
+        # the caller reads this log: keep warnings, which is where ffmpeg reports HTTP errors (e.g. a 429)
+        cmd[cmd.index("-loglevel") + 1] = "warning"
+    reader = None
+    if on_time:
+        # stdout carries the segment list, so progress goes to a pipe of its own
+        read_fd, write_fd = os.pipe()
+        cmd[1:1] = ["-progress", f"pipe:{write_fd}"]
+        try:
+            proc = subprocess.Popen(cmd, stdin=stdin, stdout=subprocess.PIPE, stderr=stderr, text=True,
+                                    pass_fds=(write_fd,))
+        except Exception:
+            os.close(read_fd)
+            raise
+        finally:
+            os.close(write_fd)
+        reader = _progress_reader(read_fd, on_time)
+    else:
+        proc = subprocess.Popen(cmd, stdin=stdin, stdout=subprocess.PIPE, stderr=stderr, text=True)
+    done = 0
+    end = 0.0
+    try:
+        for row in csv.reader(proc.stdout):
+            # the list starts at the first packet, the first clip at the first frame shown
+            start, stop = max(float(row[1]) - list_offset, -preroll), float(row[2]) - list_offset
+            if stop_on_merge and done + 1 < len(times) and stop > times[done + 1] - MERGE_EPSILON:
+                break  # ffmpeg is killed below
+            end = stop
+            if done < num_clips:
+                path = clip_path(workdir, base_name, done)
+                if timings is not None:
+                    timings[path] = (start, min(end, duration))
+                yield path
+                done += 1
+        else:
+            proc.wait()
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        if reader is not None:
+            reader.join()
+    return done, end, proc.returncode
+
+
+def split_segments(source: str, workdir: str, base_name: str, duration: float, times):
+    """Like iter_segments, but waits for all clips and returns their paths."""
+    return list(iter_segments(source, workdir, base_name, duration, times))
+
+
+# ---------- accurate (smart) cuts ----------
+# Stream copy can only start a clip on a keyframe. For frame-accurate clips only the
+# partial GOP at the head of each clip is re-encoded, the rest is copied, and the two
+# parts are joined. Parts go through MPEG-TS so the re-encoded head and the copied
+# tail each keep their own in-band parameter sets.
+SMART_CUT_ENCODERS = {
+    "h264": "libx264",
+    "hevc": "libx265",
+}
+FALLBACK_ENCODER = "libx264"
+
+
+def _ffmpeg(*args, on_time=None):
+    cmd = ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error", *args]
+    if on_time is None:
+        subprocess.run(cmd, check=True)
+        return
+    cmd[1:1] = ["-progress", "pipe:1"]
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True) as proc:
+        _read_progress(proc.stdout, on_time)
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+
+def _encode_args(video: dict, encoder: str):
+    args = ["-c:v", encoder, "-preset", "veryfast", "-crf", "18", "-threads", "1"]
+    if video.get("pix_fmt"):
+        args += ["-pix_fmt", video["pix_fmt"]]
+    return args + ["-c:a", "aac"]
+
+
+def _accurate_clip(source: str, index: dict, start: float, end: float, out_path: str, on_time=None):
+    """
+    Cut [start, end) exactly, re-encoding only what lies before the first keyframe.
+    `on_time` gets the seconds of the clip done so far.
+    """
+    video = index["video"]
+    encoder = SMART_CUT_ENCODERS.get(video.get("codec_name"))
+    if encoder and not toolchain.has_encoder(encoder):
+        encoder = None  # this ffmpeg build lacks it
+    k = next_keyframe(index["keyframes"], start)
+    streams = ["-map", "0:v:0", "-map", "0:a:0?"]
+
+    if encoder and k is not None and abs(k - start) < 0.001:
+        # already starts on a keyframe: plain copy
+        _ffmpeg("-ss", str(start), "-i", source, "-t", str(end - start), *streams, "-c", "copy", out_path,
+                on_time=on_time)
+        return
+    if not encoder or k is None or k >= end:
+        # no keyframe inside the clip (or a codec we can't match): re-encode all of it
+        _ffmpeg("-ss", str(start), "-i", source, "-t", str(end - start), *streams,
+                *_encode_args(video, encoder or FALLBACK_ENCODER), out_path, on_time=on_time)
+        return
+
+    base = os.path.splitext(out_path)[0]
+    head, tail, listing = base + ".head.ts", base + ".tail.ts", base + ".concat.txt"
+    try:
+        _ffmpeg("-ss", str(start), "-i", source, "-t", str(k - start), *streams,
+                *_encode_args(video, encoder), "-f", "mpegts", head, on_time=on_time)
+        tail_time = (lambda seconds: on_time(k - start + seconds)) if on_time else None
+        _ffmpeg("-ss", str(k), "-i", source, "-t", str(end - k), *streams, "-c", "copy", "-f", "mpegts", tail,
+                on_time=tail_time)
+        with open(listing, "w", encoding="utf-8") as f:
+            for part in (head, tail):
+                escaped = part.replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        _ffmpeg("-f", "concat", "-safe", "0", "-i", listing, "-c", "copy", "-bsf:a", "aac_adtstoasc", out_path)
+    finally:
+        for part in (head, tail, listing):
+            if os.path.exists(part):
+                os.remove(part)
+
+
+def iter_accurate_segments(source: str, workdir: str, base_name: str, duration: float, times, workers: int = None,
+                           timings: dict = None, on_time=None):
+    """
+    Frame-accurate version of iter_segments. The keyframe index of `source` is built
+    (or read from its cache) first; clips are then cut in parallel by up to `workers`
+    ffmpeg processes (default: one per CPU) and yielded in order. `timings` and
+    `on_time` work like in iter_segments (on_time gets the total of all clips).
+    Clip starts are exact; the copied end of a clip can still run over by the
+    codec's frame reordering delay (a frame or two with B-frames).
+    Raises subprocess.CalledProcessError if a clip can't be cut.
+    """
+    index = keyframe_index(source)
+    times = [t for t in times if 0 < t < duration]
+    bounds = [0.0] + list(times) + [duration]
+    num_clips = len(bounds) - 1
+    workers = workers or os.cpu_count() or 1
+
+    lock = threading.Lock()
+    clip_done = {}  # clip index -> seconds of it done
+
+    def clip_time(i):
+        if on_time is None:
+            return None
+
+        def report(seconds):
+            with lock:
+                clip_done[i] = min(seconds, bounds[i + 1] - bounds[i])
+                total = sum(clip_done.values())
+            on_time(total)
+        return report
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        submitted = 0
+        try:
+            while submitted < num_clips or pending:
+                # keep a bounded window in flight so clips don't pile up on disk
+                while submitted < num_clips and len(pending) < workers * 2:
+                    path = clip_path(workdir, base_name, submitted)
+                    report = clip_time(submitted)
+                    future = pool.submit(_accurate_clip, source, index, bounds[submitted], bounds[submitted + 1], path,
+                                         report)
+                    pending.append((future, path, (bounds[submitted], bounds[submitted + 1]), report))
+                    submitted += 1
+                future, path, bound, report = pending.popleft()
+                future.result()
+                if timings is not None:
+                    timings[path] = bound
+                if report:
+                    report(bound[1] - bound[0])
+                yield path
+        finally:
+            for future, _, _, _ in pending:
+                future.cancel()
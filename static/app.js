@@ -1,30 +1,150 @@
+// Live progress from /split/events (server-sent events) while the split runs.
+function formatMB(bytes) {
+    return (bytes / 1048576).toFixed(1);
+}
+
+function showProgress(state) {
+    const container = document.getElementById('progress-container');
+    const bar = document.getElementById('progress-bar');
+    const statusDiv = document.getElementById('status');
+    const steps = {downloading: 'step1', analyzing: 'step2', splitting: 'step2', streaming: 'step2'};
+    container.style.display = '';
+    for (const id of ['step1', 'step2', 'step3']) {
+        document.getElementById(id).classList.remove('active');
+    }
+    const step = state.done ? 'step3' : steps[state.stage];
+    if (step) document.getElementById(step).classList.add('active');
+
+    // first half of the bar for the download, second half for splitting
+    let fraction = 0;
+    const download = state.download;
+    const split = state.split;
+    if (split && split.seconds_total) {
+        fraction = 0.5 + 0.5 * Math.min(split.seconds_done / split.seconds_total, 1);
+    } else if (download && download.total_bytes) {
+        fraction = 0.5 * Math.min(download.downloaded_bytes / download.total_bytes, 1);
+    }
+    if (state.done) fraction = 1;
+    bar.style.width = `${Math.round(fraction * 100)}%`;
+
+    if (state.stage === 'downloading' && download) {
+        const total = download.total_bytes ? ` / ${formatMB(download.total_bytes)}` : '';
+        statusDiv.textContent = `Downloading ${formatMB(download.downloaded_bytes || 0)}${total} MB...`;
+    } else if ((state.stage === 'splitting' || state.stage === 'streaming') && split) {
+        statusDiv.textContent = `Splitting: ${split.clips_done} of ${split.clips_total} clips done...`;
+    } else if (!state.done) {
+        statusDiv.textContent = `${state.stage.charAt(0).toUpperCase() + state.stage.slice(1)}...`;
+    }
+}
+
+function followProgress(query) {
+    const events = new EventSource(`/split/events?${query}`);
+    const update = (e) => showProgress(JSON.parse(e.data));
+    events.addEventListener('progress', update);
+    events.addEventListener('done', (e) => { update(e); events.close(); });
+    events.addEventListener('failed', () => events.close());
+    events.addEventListener('idle', () => events.close());
+    // the built-in error event: connection lost, don't reconnect
+    events.onerror = () => events.close();
+    return events;
+}
+
 document.getElementById('splitForm').addEventListener('submit', async function(e) {
     e.preventDefault();
     const url = document.getElementById('url').value;
     const interval = document.getElementById('interval').value;
     const base_name = document.getElementById('base_name').value;
+    const mode = document.getElementById('smart').checked ? 'smart' : 'interval';
     const statusDiv = document.getElementById('status');
+    const clipList = document.getElementById('clip-list');
+    const zipLink = document.getElementById('download-link');
     statusDiv.textContent = 'Processing...';
     statusDiv.style.color = '#2a5298';
+    clipList.innerHTML = '';
+    zipLink.style.display = 'none';
+    document.getElementById('progress-bar').style.width = '0%';
 
+    const query = `url=${encodeURIComponent(url)}&interval=${interval}&base_name=${encodeURIComponent(base_name)}&mode=${mode}`;
+    const events = followProgress(`${query}&output=manifest`);
     try {
-        const response = await fetch(`/split?url=${encodeURIComponent(url)}&interval=${interval}&base_name=${encodeURIComponent(base_name)}`);
-        if (response.ok) {
-            const blob = await response.blob();
-            const filename = response.headers.get('content-disposition')?.split('filename=')[1] || 'clips.zip';
-            const link = document.createElement('a');
-            link.href = window.URL.createObjectURL(blob);
-            link.download = filename.replace(/"/g, '');
-            link.click();
-            statusDiv.textContent = 'Download started!';
-            statusDiv.style.color = '#1e3c72';
-        } else {
-            const error = await response.json();
-            statusDiv.textContent = error.error || 'Error occurred.';
+        // the manifest only lists the clips; each one is downloaded on its own
+        const response = await fetch(`/split?${query}&output=manifest`);
+        const result = await response.json();
+        events.close();
+        if (!response.ok) {
+            statusDiv.textContent = result.error || 'Error occurred.';
             statusDiv.style.color = 'red';
+            return;
         }
+        for (const clip of result.clips) {
+            const item = document.createElement('li');
+            const link = document.createElement('a');
+            link.href = clip.url;
+            link.download = clip.name;
+            link.textContent = clip.name;
+            const details = document.createElement('span');
+            details.textContent = ` ${clip.duration.toFixed(1)}s, ${(clip.size / 1048576).toFixed(1)} MB`;
+            item.append(link, details);
+            clipList.appendChild(item);
+        }
+        // a plain link: the browser streams the archive to disk instead of holding it in memory;
+        // the archive is built from the clips above, the video is not split again
+        zipLink.href = result.zip_url;
+        zipLink.style.display = '';
+        showProgress({stage: 'done', done: true});
+        statusDiv.textContent = `${result.clips.length} clips ready.`;
+        statusDiv.style.color = '#1e3c72';
     } catch (err) {
+        events.close();
         statusDiv.textContent = 'Network error.';
         statusDiv.style.color = 'red';
     }
 });
+
+// Video preview: /probe only reads metadata, so this is quick and
+// warms the server's info cache for the split that follows.
+let probedDuration = null;
+
+function updateEstimatedClips() {
+    const interval = parseFloat(document.getElementById('interval').value);
+    const estimated = document.getElementById('estimated-clips');
+    if (probedDuration && interval > 0) {
+        estimated.textContent = `Estimated Clips: ${Math.ceil(probedDuration / interval)}`;
+    } else {
+        estimated.textContent = 'Estimated Clips: --';
+    }
+}
+
+document.getElementById('url').addEventListener('change', async function() {
+    const preview = document.getElementById('video-preview');
+    const statusDiv = document.getElementById('status');
+    probedDuration = null;
+    preview.style.display = 'none';
+    if (!this.value) return;
+
+    try {
+        const response = await fetch(`/probe?url=${encodeURIComponent(this.value)}`);
+        const info = await response.json();
+        if (!response.ok) {
+            statusDiv.textContent = info.error || 'Could not read video info.';
+            statusDiv.style.color = 'red';
+            return;
+        }
+        probedDuration = info.duration;
+        document.getElementById('thumbnail').src = info.thumbnail || '';
+        document.getElementById('video-title').textContent = info.title || 'Untitled';
+        document.getElementById('video-duration').textContent = `Duration: ${info.duration ? Math.round(info.duration) + 's' : '--'}`;
+        updateEstimatedClips();
+        preview.style.display = '';
+        if (!info.allowed) {
+            statusDiv.textContent = info.error;
+            statusDiv.style.color = 'red';
+        } else {
+            statusDiv.textContent = '';
+        }
+    } catch (err) {
+        // preview is optional; the split itself reports errors
+    }
+});
+
+document.getElementById('interval').addEventListener('input', updateEstimatedClips);
@@ -0,0 +1,70 @@
+# toolchain.py
+"""
+The ffmpeg/ffprobe installation this process runs, detected once.
+
+Paths, versions and the available encoders are probed the first time they are
+needed (the app does it at startup, see main.lifespan) and kept for the life of
+the process, so requests don't spawn `ffmpeg -version` to check for ffmpeg.
+"""
+
+import shutil
+import subprocess
+import threading
+
+_lock = threading.Lock()
+_detected = None
+
+
+def _first_line(cmd) -> str:
+    try:
+        out = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, timeout=30).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    lines = out.splitlines()
+    return lines[0] if lines else None
+
+
+def _encoders(ffmpeg: str) -> list:
+    """Encoder names from `ffmpeg -encoders` (the table after the ' ------' line)."""
+    try:
+        out = subprocess.run([ffmpeg, "-hide_banner", "-encoders"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                             text=True, timeout=30).stdout
+    except (OSError, subprocess.SubprocessError):
+        return []
+    encoders = []
+    table = False
+    for line in out.splitlines():
+        if line.strip().startswith("------"):
+            table = True
+            continue
+        fields = line.split()
+        if table and len(fields) >= 2:
+            encoders.append(fields[1])
+    return sorted(encoders)
+
+
+def detect() -> dict:
+    """{"ffmpeg": {path, version}, "ffprobe": {path, version}, "encoders": [...]}; probed on the first call only."""
+    global _detected
+    with _lock:
+        if _detected is None:
+            detected = {}
+            for tool in ("ffmpeg", "ffprobe"):
+                path = shutil.which(tool)
+                detected[tool] = {"path": path, "version": _first_line([path, "-version"]) if path else None}
+            ffmpeg = detected["ffmpeg"]["path"]
+            detected["encoders"] = _encoders(ffmpeg) if ffmpeg else []
+            _detected = detected
+        return _detected
+
+
+def require():
+    """Raise RuntimeError unless ffmpeg and ffprobe are installed."""
+    detected = detect()
+    missing = [tool for tool in ("ffmpeg", "ffprobe") if not detected[tool]["path"]]
+    if missing:
+        raise RuntimeError(f"{' and '.join(missing)} not found: install ffmpeg and ensure it's in PATH.")
+
+
+def has_encoder(name: str) -> bool:
+    return name in detect()["encoders"]
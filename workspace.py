@@ -0,0 +1,412 @@
+# workspace.py
+"""
+Budgeted scratch space for the pipeline, and the janitor that cleans up after crashes.
+
+Everything a split writes while it runs (the source while it downloads, the clip
+workdir, a job's archive) is reserved first, at its estimated size, in a ledger
+in sqlite under STATE_DIR that every process on the host shares. A reservation
+is granted while the reserved total stays within the budget of its place (disk:
+WORKSPACE_BYTES, tmpfs: WORKSPACE_TMPFS_BYTES) and the filesystem keeps
+WORKSPACE_MIN_FREE free. Otherwise it waits for room, `wait` seconds at most
+(WORKSPACE_WAIT for requests; jobs wait longer, see patience()), and then
+raises WorkspaceFull.
+
+Only the first reservation of a thread waits: once a request is admitted, the
+reservations it makes on the way are granted right away (if the disk has the
+room), so requests never hold space while waiting for more. A request that
+reserves from more than one thread hands its admission to the others (see
+admitted()).
+
+Workdirs small enough (at most WORKSPACE_TMPFS_MAX) go to tmpfs when
+WORKSPACE_TMPFS is usable, so their clips are written and read from memory,
+in a directory of their own for every STATE_DIR.
+
+A reservation records the paths its holder writes and the holder's pid. The
+janitor (every WORKSPACE_JANITOR_INTERVAL seconds, one process per host at a
+time) removes the paths of reservations whose process died or that are older
+than WORKSPACE_LEASE, then whatever a crash left behind: anything in the
+workspace, source downloads in progress and archives in DOWNLOAD_FOLDER that no
+reservation or job owns and that is older than WORKSPACE_ORPHAN_AGE. It also
+purges expired and orphaned flight outputs under ARTIFACT_DIR (see singleflight.py).
+"""
+
+import fcntl
+import glob
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from contextlib import contextmanager
+
+import metrics
+import singleflight
+from config import (
+    STATE_DIR, DOWNLOAD_FOLDER, SOURCE_CACHE_DIR, WORKSPACE_DIR, WORKSPACE_BYTES, WORKSPACE_MIN_FREE,
+    WORKSPACE_TMPFS, WORKSPACE_TMPFS_BYTES, WORKSPACE_TMPFS_MAX, WORKSPACE_WAIT, WORKSPACE_LEASE,
+    WORKSPACE_ORPHAN_AGE, WORKSPACE_JANITOR_INTERVAL,
+)
+
+WORKSPACE_DB = os.path.join(STATE_DIR, "workspace.db")
+JANITOR_LOCK = os.path.join(STATE_DIR, "workspace.janitor.lock")
+# tmpfs is shared by the whole host: one directory per ledger, so a janitor only sweeps its own
+TMPFS_SUBDIR = "cutter-work-" + hashlib.sha256(os.path.abspath(STATE_DIR).encode("utf-8")).hexdigest()[:12]
+POLL_SECONDS = 1.0
+RETRY_AFTER = 60  # what a refused client is told; space frees up as running splits finish
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reservations (
+    id TEXT PRIMARY KEY,
+    place TEXT NOT NULL,           -- disk | tmpfs
+    bytes INTEGER NOT NULL,
+    paths TEXT NOT NULL,           -- JSON list of what the holder writes
+    pid INTEGER NOT NULL,
+    created REAL NOT NULL
+);
+"""
+
+# per thread: how many reservations it holds and how long its first one may wait
+_local = threading.local()
+
+
+class WorkspaceFull(Exception):
+    """No room for a reservation within the time it could wait."""
+
+    def __init__(self, place: str, nbytes: int):
+        super().__init__(f"not enough {place} space for {nbytes / 1024 ** 2:.0f} MB of scratch files")
+        self.place = place
+        self.nbytes = nbytes
+        self.retry_after = RETRY_AFTER
+
+
+def connect():
+    conn = sqlite3.connect(WORKSPACE_DB, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
+
+
+def init_db():
+    conn = connect()
+    try:
+        conn.executescript(SCHEMA)
+    finally:
+        conn.close()
+
+
+def tmpfs_root():
+    """The workspace directory on tmpfs, or None if WORKSPACE_TMPFS is off or not usable."""
+    if not WORKSPACE_TMPFS or not os.path.isdir(WORKSPACE_TMPFS) or not os.access(WORKSPACE_TMPFS, os.W_OK):
+        return None
+    root = os.path.join(WORKSPACE_TMPFS, TMPFS_SUBDIR)
+    os.makedirs(root, exist_ok=True)
+    return root
+
+
+def _root(place: str) -> str:
+    return tmpfs_root() if place == "tmpfs" else WORKSPACE_DIR
+
+
+def _budget(place: str) -> int:
+    return WORKSPACE_TMPFS_BYTES if place == "tmpfs" else WORKSPACE_BYTES
+
+
+@contextmanager
+def patience(wait: float):
+    """Let the reservations made in this thread during the block wait up to `wait` seconds for room."""
+    previous = getattr(_local, "wait", None)
+    _local.wait = wait
+    try:
+        yield
+    finally:
+        _local.wait = previous
+
+
+def admission():
+    """This thread's admission and patience, for a thread working for the same request (see admitted())."""
+    return getattr(_local, "held", 0) > 0 or getattr(_local, "admitted", False), getattr(_local, "wait", None)
+
+
+@contextmanager
+def admitted(state):
+    """Reserve in this thread during the block as the thread `state` (its admission()) came from would."""
+    previous = getattr(_local, "admitted", False), getattr(_local, "wait", None)
+    _local.admitted, _local.wait = state
+    try:
+        yield
+    finally:
+        _local.admitted, _local.wait = previous
+
+
+# ---------- reservations ----------
+class Reservation:
+    """`bytes` of a place held until release(); track() records the paths written under it."""
+
+    def __init__(self, reservation_id: str, place: str, nbytes: int, paths: list):
+        self.id = reservation_id
+        self.place = place
+        self.bytes = nbytes
+        self.paths = paths
+
+    def track(self, path: str):
+        """Record `path` as written by the holder: the janitor removes it if the holder dies."""
+        self.paths.append(os.path.abspath(path))
+        conn = connect()
+        try:
+            conn.execute("UPDATE reservations SET paths = ? WHERE id = ?", (json.dumps(self.paths), self.id))
+        finally:
+            conn.close()
+
+    def release(self):
+        conn = connect()
+        try:
+            conn.execute("DELETE FROM reservations WHERE id = ?", (self.id,))
+        finally:
+            conn.close()
+
+
+def _free(place: str, paths) -> int:
+    """Free bytes on the filesystem the reservation writes to."""
+    where = os.path.dirname(paths[0]) if paths else _root(place)
+    return shutil.disk_usage(where).free
+
+
+def _try_reserve(place: str, nbytes: int, paths: list, admitted: bool):
+    """Insert the reservation if it fits; returns its id or None. `admitted` holders may exceed the budget."""
+    min_free = WORKSPACE_MIN_FREE if place == "disk" else 0
+    conn = connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            reserved = conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM reservations WHERE place = ?",
+                                    (place,)).fetchone()[0]
+            # a single request larger than the budget still runs, alone
+            over_budget = reserved > 0 and reserved + nbytes > _budget(place)
+            if _free(place, paths) - nbytes < min_free or (over_budget and not admitted):
+                conn.execute("ROLLBACK")
+                return None
+            reservation_id = uuid.uuid4().hex
+            conn.execute("INSERT INTO reservations (id, place, bytes, paths, pid, created) VALUES (?, ?, ?, ?, ?, ?)",
+                         (reservation_id, place, nbytes, json.dumps(paths), os.getpid(), time.time()))
+            conn.execute("COMMIT")
+            return reservation_id
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+
+
+def _acquire(place: str, nbytes: int, paths: list, wait: float = None) -> Reservation:
+    nbytes = max(int(nbytes or 0), 0)
+    paths = [os.path.abspath(path) for path in paths]
+    admitted = admission()[0]
+    if wait is None:
+        wait = getattr(_local, "wait", None)
+        wait = WORKSPACE_WAIT if wait is None else wait
+    started = time.monotonic()
+    reclaimed = False
+    while True:
+        reservation_id = _try_reserve(place, nbytes, paths, admitted)
+        if reservation_id is not None:
+            break
+        if not reclaimed:
+            # space held by dead processes is the first thing to take back
+            reclaimed = True
+            reclaim_stale()
+            continue
+        if admitted or time.monotonic() - started >= wait:
+            metrics.inc("cutter_workspace_refused_total", place=place)
+            raise WorkspaceFull(place, nbytes)
+        time.sleep(POLL_SECONDS)
+    if time.monotonic() - started >= POLL_SECONDS:
+        metrics.observe("cutter_workspace_wait_seconds", time.monotonic() - started, place=place)
+    _local.held = getattr(_local, "held", 0) + 1
+    return Reservation(reservation_id, place, nbytes, paths)
+
+
+def _release(reservation: Reservation):
+    _local.held = getattr(_local, "held", 1) - 1
+    reservation.release()
+
+
+@contextmanager
+def reserve(nbytes: int, paths=(), wait: float = None):
+    """
+    Hold `nbytes` of disk while the block runs, waiting up to `wait` seconds for
+    room (default: see patience()); raises WorkspaceFull if there is none by then.
+    `paths` (and what the yielded Reservation's track() adds) are removed by the
+    janitor if the holder dies; when the block exits they are left alone.
+    """
+    reservation = _acquire("disk", nbytes, list(paths), wait)
+    try:
+        yield reservation
+    finally:
+        _release(reservation)
+
+
+@contextmanager
+def workdir(prefix: str, nbytes: int = 0, wait: float = None):
+    """
+    A fresh directory for `nbytes` of scratch files, reserved like reserve() and
+    removed with everything in it when the block exits. On tmpfs if it is small
+    enough and there is room there, else under WORKSPACE_DIR.
+    """
+    reservation = None
+    if 0 < nbytes <= WORKSPACE_TMPFS_MAX and tmpfs_root():
+        try:
+            # tmpfs is a bonus: take it if it is free right now, never wait for it
+            reservation = _acquire("tmpfs", nbytes, [], wait=0)
+        except WorkspaceFull:
+            pass
+    if reservation is None:
+        reservation = _acquire("disk", nbytes, [], wait)
+    try:
+        path = tempfile.mkdtemp(prefix=prefix, dir=_root(reservation.place))
+        reservation.track(path)
+        try:
+            yield path
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+    finally:
+        _release(reservation)
+
+
+def usage() -> dict:
+    """Reserved bytes, budget and free bytes of each place (for /health)."""
+    conn = connect()
+    try:
+        reserved = dict(conn.execute("SELECT place, SUM(bytes) FROM reservations GROUP BY place").fetchall())
+    finally:
+        conn.close()
+    places = {"disk": WORKSPACE_DIR}
+    if tmpfs_root():
+        places["tmpfs"] = tmpfs_root()
+    return {
+        place: {"reserved": reserved.get(place) or 0, "budget": _budget(place), "free": shutil.disk_usage(root).free}
+        for place, root in places.items()
+    }
+
+
+# ---------- janitor ----------
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # exists, owned by someone else
+    return True
+
+
+def _remove(path: str) -> int:
+    """Delete a file or a directory tree; returns the bytes freed."""
+    size = 0
+    try:
+        if os.path.isdir(path) and not os.path.islink(path):
+            for dirpath, _, names in os.walk(path):
+                for name in names:
+                    try:
+                        size += os.path.getsize(os.path.join(dirpath, name))
+                    except OSError:
+                        pass
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.lexists(path):
+            size = os.path.getsize(path)
+            os.remove(path)
+    except OSError as e:
+        print(f"workspace: could not remove {path}: {e}")
+    return size
+
+
+def reclaim_stale() -> int:
+    """Remove what reservations of dead processes (or past WORKSPACE_LEASE) wrote, and the reservations."""
+    cutoff = time.time() - WORKSPACE_LEASE
+    freed = 0
+    conn = connect()
+    try:
+        for row in conn.execute("SELECT * FROM reservations").fetchall():
+            if _alive(row["pid"]) and row["created"] >= cutoff:
+                continue
+            for path in json.loads(row["paths"]):
+                freed += _remove(path)
+            conn.execute("DELETE FROM reservations WHERE id = ?", (row["id"],))
+    finally:
+        conn.close()
+    if freed:
+        metrics.inc("cutter_workspace_reclaimed_bytes_total", freed, reason="stale")
+    return freed
+
+
+def _leftovers():
+    """Everything a crashed split may have left behind."""
+    for root in (WORKSPACE_DIR, tmpfs_root()):
+        if root:
+            yield from glob.glob(os.path.join(root, "*"))
+    yield from glob.glob(os.path.join(SOURCE_CACHE_DIR, "ytsrc_*"))
+    yield from glob.glob(os.path.join(DOWNLOAD_FOLDER, "*.zip"))
+
+
+def sweep() -> int:
+    """
+    One janitor pass: reclaim_stale(), singleflight.purge_expired(), then remove
+    the leftovers no reservation or job owns that are older than
+    WORKSPACE_ORPHAN_AGE. Returns the bytes freed (not counting flight outputs).
+    """
+    import jobs
+
+    freed = reclaim_stale()
+    singleflight.purge_expired()
+    conn = connect()
+    try:
+        owned = {path for row in conn.execute("SELECT paths FROM reservations") for path in json.loads(row["paths"])}
+    finally:
+        conn.close()
+    owned |= {os.path.abspath(path) for path in jobs.archive_paths()}
+    cutoff = time.time() - WORKSPACE_ORPHAN_AGE
+    orphaned = 0
+    for path in _leftovers():
+        try:
+            if os.path.abspath(path) in owned or os.path.getmtime(path) >= cutoff:
+                continue
+        except OSError:
+            continue  # gone already
+        orphaned += _remove(path)
+    if orphaned:
+        metrics.inc("cutter_workspace_reclaimed_bytes_total", orphaned, reason="orphan")
+    return freed + orphaned
+
+
+def run_janitor(stop: threading.Event):
+    """sweep() every WORKSPACE_JANITOR_INTERVAL seconds until `stop` is set; one sweep at a time per host."""
+    while True:
+        fd = os.open(JANITOR_LOCK, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            pass  # another process is sweeping
+        else:
+            try:
+                freed = sweep()
+                if freed:
+                    print(f"workspace janitor: reclaimed {freed / 1024 ** 2:.1f} MB")
+            except Exception:
+                traceback.print_exc()
+        finally:
+            os.close(fd)
+        if stop.wait(WORKSPACE_JANITOR_INTERVAL):
+            return
+
+
+os.makedirs(WORKSPACE_DIR, exist_ok=True)
+init_db()
+
+if __name__ == "__main__":
+    print(f"reclaimed {sweep()} bytes")
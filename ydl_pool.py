@@ -0,0 +1,80 @@
+# ydl_pool.py
+"""
+Warm yt_dlp.YoutubeDL instances, reused between requests.
+
+Building a YoutubeDL costs more than answering a request from the caches, and
+the extractors it loads stay loaded on it, so each process keeps a few idle
+instances per option set and leases them out one at a time (an instance is not
+thread safe). Options that change on every call (output directory, download
+ranges) are applied for the lease only; everything else belongs to the option
+set. An instance is closed after YDL_POOL_MAX_USES leases, after a failed call,
+or when YDL_POOL_SIZE instances of its option set are idle already.
+
+yt_dlp itself is imported on first use, not when the app starts.
+"""
+
+import threading
+from contextlib import contextmanager
+
+import metrics
+from config import YDL_POOL_SIZE, YDL_POOL_MAX_USES
+
+_MISSING = object()
+_lock = threading.Lock()
+_idle = {}  # option set key -> [[ydl, uses], ...]
+
+
+def _close(ydl):
+    try:
+        ydl.close()
+    except Exception as e:
+        print(f"ydl pool: closing a YoutubeDL failed: {e}")
+
+
+@contextmanager
+def lease(key, make_params, per_call: dict = None):
+    """
+    Yield a YoutubeDL of the option set `key`, built from `make_params()` if no
+    idle one is left, with `per_call` params set until the block exits.
+    """
+    per_call = per_call or {}
+    with _lock:
+        idle = _idle.get(key)
+        entry = idle.pop() if idle else None
+    metrics.inc("cutter_cache_requests_total", cache="ydl", result="miss" if entry is None else "hit")
+    if entry is None:
+        import yt_dlp
+
+        entry = [yt_dlp.YoutubeDL(make_params()), 0]
+    ydl = entry[0]
+    saved = {name: ydl.params.get(name, _MISSING) for name in per_call}
+    ydl.params.update(per_call)
+    reusable = False
+    try:
+        yield ydl
+        reusable = True
+    finally:
+        for name, value in saved.items():
+            if value is _MISSING:
+                ydl.params.pop(name, None)
+            else:
+                ydl.params[name] = value
+        entry[1] += 1
+        keep = reusable and entry[1] < YDL_POOL_MAX_USES
+        if keep:
+            with _lock:
+                idle = _idle.setdefault(key, [])
+                keep = len(idle) < YDL_POOL_SIZE
+                if keep:
+                    idle.append(entry)
+        if not keep:
+            _close(ydl)
+
+
+def clear():
+    """Close every idle instance."""
+    with _lock:
+        entries = [entry for idle in _idle.values() for entry in idle]
+        _idle.clear()
+    for ydl, _ in entries:
+        _close(ydl)
@@ -0,0 +1,143 @@
+# zipstream.py
+"""
+Streaming ZIP writer.
+
+Builds an archive on the fly without seeking: every entry is STORED (clips are
+already compressed MP4, DEFLATE would only burn CPU), its CRC and sizes follow the
+data in a data descriptor, and ZIP64 records are used wherever a size, offset or
+entry count does not fit the classic format. The output is a plain iterator of
+bytes, so it can be fed straight into a StreamingResponse or written to a file.
+
+    zs = ZipStream()
+    for path in clips:
+        yield from zs.add_file(path, os.path.basename(path))
+    yield zs.finish()
+"""
+
+import os
+import struct
+import time
+import zlib
+
+CHUNK_SIZE = 1024 * 1024
+
+ZIP32_MAX = 0xFFFFFFFF
+ZIP16_MAX = 0xFFFF
+# sizes, offsets and counts from these limits on go into ZIP64 records
+ZIP64_LIMIT = ZIP32_MAX
+ZIP64_COUNT_LIMIT = ZIP16_MAX
+
+FLAG_DATA_DESCRIPTOR = 0x0008
+FLAG_UTF8 = 0x0800
+METHOD_STORED = 0
+VERSION_DEFAULT = 20
+VERSION_ZIP64 = 45
+MADE_BY_UNIX = 3 << 8
+
+
+def _dos_time(ts: float):
+    t = time.localtime(ts)
+    year = max(t.tm_year, 1980)
+    dos_date = ((year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    return dos_time, dos_date
+
+
+class ZipStream:
+    def __init__(self):
+        self._entries = []
+        self._offset = 0
+
+    def _emit(self, data: bytes) -> bytes:
+        self._offset += len(data)
+        return data
+
+    def add_file(self, path: str, arcname: str):
+        """Yield the bytes of one STORED entry for the file at `path`."""
+        st = os.stat(path)
+        # the size is known up front, so ZIP64 is only used for entries that need it
+        zip64 = st.st_size >= ZIP64_LIMIT
+        name = arcname.encode("utf-8")
+        dos_time, dos_date = _dos_time(st.st_mtime)
+        offset = self._offset
+        version = VERSION_ZIP64 if zip64 else VERSION_DEFAULT
+
+        extra = b""
+        size_field = 0
+        if zip64:
+            extra = struct.pack("<HHQQ", 0x0001, 16, 0, 0)
+            size_field = ZIP32_MAX
+        header = struct.pack(
+            "<IHHHHHIIIHH",
+            0x04034B50, version, FLAG_DATA_DESCRIPTOR | FLAG_UTF8, METHOD_STORED,
+            dos_time, dos_date, 0, size_field, size_field, len(name), len(extra),
+        )
+        yield self._emit(header + name + extra)
+
+        crc = 0
+        size = 0
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+                yield self._emit(chunk)
+
+        if zip64:
+            descriptor = struct.pack("<IIQQ", 0x08074B50, crc, size, size)
+        else:
+            descriptor = struct.pack("<IIII", 0x08074B50, crc, size, size)
+        yield self._emit(descriptor)
+
+        self._entries.append({
+            "name": name, "crc": crc, "size": size, "offset": offset,
+            "dos_time": dos_time, "dos_date": dos_date, "zip64": zip64,
+        })
+
+    def finish(self) -> bytes:
+        """Return the central directory and end records."""
+        cd_offset = self._offset
+        records = []
+        for e in self._entries:
+            extra_fields = []
+            size_field = e["size"]
+            offset_field = e["offset"]
+            if e["zip64"] or e["size"] >= ZIP64_LIMIT:
+                extra_fields += [e["size"], e["size"]]
+                size_field = ZIP32_MAX
+            if e["offset"] >= ZIP64_LIMIT:
+                extra_fields.append(e["offset"])
+                offset_field = ZIP32_MAX
+            extra = b""
+            if extra_fields:
+                extra = struct.pack(f"<HH{len(extra_fields)}Q", 0x0001, 8 * len(extra_fields), *extra_fields)
+            version = VERSION_ZIP64 if (e["zip64"] or extra_fields) else VERSION_DEFAULT
+            records.append(struct.pack(
+                "<IHHHHHHIIIHHHHHII",
+                0x02014B50, MADE_BY_UNIX | VERSION_ZIP64, version, FLAG_DATA_DESCRIPTOR | FLAG_UTF8, METHOD_STORED,
+                e["dos_time"], e["dos_date"], e["crc"], size_field, size_field,
+                len(e["name"]), len(extra), 0, 0, 0, 0o100644 << 16, offset_field,
+            ) + e["name"] + extra)
+        central_dir = b"".join(records)
+        cd_size = len(central_dir)
+        count = len(self._entries)
+
+        end = b""
+        zip64_end = count >= ZIP64_COUNT_LIMIT or cd_size >= ZIP64_LIMIT or cd_offset >= ZIP64_LIMIT
+        if zip64_end:
+            eocd64_offset = cd_offset + cd_size
+            end += struct.pack(
+                "<IQHHIIQQQQ",
+                0x06064B50, 44, MADE_BY_UNIX | VERSION_ZIP64, VERSION_ZIP64, 0, 0,
+                count, count, cd_size, cd_offset,
+            )
+            end += struct.pack("<IIQI", 0x07064B50, 0, eocd64_offset, 1)
+        end += struct.pack(
+            "<IHHHHIIH",
+            0x06054B50, 0, 0,
+            ZIP16_MAX if zip64_end else count, ZIP16_MAX if zip64_end else count,
+            ZIP32_MAX if zip64_end else cd_size, ZIP32_MAX if zip64_end else cd_offset, 0,
+        )
+        return self._emit(central_dir + end)